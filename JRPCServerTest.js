@@ -53,6 +53,11 @@ class TestClass {
     return arg1;
   }
 
+  scale(values, factor){
+    // numpy arrays from Python peers arrive as typed arrays, the result goes back as one
+    return values.map((v) => v*factor);
+  }
+
   get server(){return this.getServer();}
 
   echoBack(args){
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Compare JSON rows with an Arrow IPC stream for tabular results.
+
+Measures payload size, encode time and decode time for a table returned from
+an exposed method, as it would be sent by JRPC2._send_response.
+
+Usage: python benchmarks/bench_arrow.py [rows]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pyarrow as pa
+
+from jrpc_oo import Attachments
+
+
+def best_of(fn, repeat=5):
+    """Return (best time in ms, last result) over repeat runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(rows):
+    rng = np.random.default_rng(0)
+    columns = {
+        'id': np.arange(rows, dtype=np.int64),
+        'price': rng.random(rows),
+        'volume': rng.integers(0, 10000, rows, dtype=np.int32),
+        'symbol': [f"SYM{i % 500}" for i in range(rows)],
+    }
+    table = pa.table(columns)
+    row_dicts = table.to_pylist()
+    response = {'jsonrpc': '2.0', 'id': 'bench'}
+
+    def encode_json():
+        return json.dumps(dict(response, result=row_dicts))
+
+    def encode_arrow():
+        text, payloads = Attachments.encode(dict(response, result=table), ['arrow'], key=1)
+        return text, [Attachments.pack_frame({'key': 1, 'i': i}, p) for i, p in enumerate(payloads)]
+
+    json_ms, json_text = best_of(encode_json)
+    arrow_ms, (arrow_text, frames) = best_of(encode_arrow)
+
+    def decode_json():
+        return json.loads(json_text)['result']
+
+    def decode_arrow():
+        header, view = Attachments.unpack_frame(frames[0])
+        message = json.loads(arrow_text)
+        table = Attachments.splice(message['result'], {header['i']: view})
+        return table.table  # force the lazy decode
+
+    json_dec_ms, _ = best_of(decode_json)
+    arrow_dec_ms, _ = best_of(decode_arrow)
+
+    json_bytes = len(json_text.encode('utf-8'))
+    arrow_bytes = len(arrow_text) + sum(len(f) for f in frames)
+
+    print(f"{rows} rows, {len(columns)} columns")
+    print(f"{'':8}{'bytes':>14}{'encode ms':>12}{'decode ms':>12}")
+    print(f"{'json':8}{json_bytes:>14,}{json_ms:>12.1f}{json_dec_ms:>12.1f}")
+    print(f"{'arrow':8}{arrow_bytes:>14,}{arrow_ms:>12.1f}{arrow_dec_ms:>12.1f}")
+    print(f"arrow is {json_bytes / arrow_bytes:.1f}x smaller, "
+          f"{json_ms / arrow_ms:.1f}x faster to encode, {json_dec_ms / arrow_dec_ms:.1f}x faster to decode")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
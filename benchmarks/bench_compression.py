@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+CPU time against bytes on the wire for permessage-deflate settings.
+
+A JRPCServer and JRPCClient talk over localhost. For each setting a workload
+of many small calls and a workload of a few large results are run, and the
+time spent in permessage-deflate, the process CPU time (both ends, best of
+three runs) and the bytes sent and received by the client are reported.
+
+Usage: python benchmarks/bench_compression.py [small calls] [large calls]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+
+from jrpc_oo import Compression, JRPCClient, JRPCServer
+
+SETTINGS = [
+    ('off', False),
+    ('websockets default', None),
+    ('all, level 1', Compression(level=1, min_size=0)),
+    ('all, level 6', Compression(level=6, min_size=0)),
+    ('all, level 9', Compression(level=9, min_size=0)),
+    ('>= 1 KiB, level 6', Compression()),
+    ('>= 1 KiB, level 1, 15 bit window', Compression(level=1, window_bits=15)),
+]
+
+
+deflate_time = [0.0]
+
+
+def timed(fn):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            deflate_time[0] += time.perf_counter() - start
+    return wrapper
+
+
+# Time spent compressing and decompressing, on both ends
+PerMessageDeflate.encode = timed(PerMessageDeflate.encode)
+PerMessageDeflate.decode = timed(PerMessageDeflate.decode)
+
+
+class Bench:
+    def __init__(self):
+        self.rows = [{'name': f"item{i}", 'value': i * 0.5, 'status': 'ok'} for i in range(20000)]
+
+    def small(self, i):
+        return {'i': i, 'ok': True}
+
+    def large(self):
+        return self.rows
+
+
+async def run(port, compression, small_calls, large_calls):
+    server = JRPCServer(port=port, compression=compression)
+    server.add_class(Bench())
+    await server.start()
+    client = JRPCClient(f"ws://127.0.0.1:{port}", compression=compression)
+    task = asyncio.create_task(client.connect())
+    while 'Bench.large' not in client.server:
+        await asyncio.sleep(0.01)
+
+    # Count bytes where the client meets the socket
+    counts = {'sent': 0, 'received': 0}
+    ws = client.ws
+    write, data_received = ws.transport.write, ws.data_received
+
+    def counting_write(data):
+        counts['sent'] += len(data)
+        write(data)
+
+    def counting_received(data):
+        counts['received'] += len(data)
+        data_received(data)
+
+    ws.transport.write = counting_write
+    ws.data_received = counting_received
+
+    results = {}
+    for name, calls in (('small', lambda: [client.server['Bench.small'](i) for i in range(small_calls)]),
+                        ('large', lambda: [client.server['Bench.large']() for _ in range(large_calls)])):
+        counts.update(sent=0, received=0)
+        deflate_time[0] = 0.0
+        cpu = time.process_time()
+        await asyncio.gather(*calls())
+        results[name] = (deflate_time[0], time.process_time() - cpu, counts['sent'] + counts['received'])
+
+    await client.disconnect()
+    task.cancel()
+    await server.stop()
+    return results
+
+
+async def main(small_calls, large_calls, repeats=3):
+    print(f"{'':34} {'small calls':^30} {'large results':^30}")
+    print(f"{'setting':34}" + f" {'deflate ms':>10} {'cpu ms':>10} {'KiB':>8}" * 2)
+    port = 19200
+    for name, compression in SETTINGS:
+        best = {}
+        for _ in range(repeats):
+            port += 1
+            results = await run(port, compression, small_calls, large_calls)
+            for workload, result in results.items():
+                best[workload] = min(best.get(workload, result), result)
+        line = f"{name:34}"
+        for workload in ('small', 'large'):
+            deflate, cpu, size = best[workload]
+            line += f" {deflate * 1000:10.0f} {cpu * 1000:10.0f} {size / 1024:8.0f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(main(*(args + [2000, 10][len(args):])))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Peak memory of receiving one large chunked JSON-RPC request.
+
+Compares buffering the whole message before json.loads with decoding the
+chunks as they arrive (needs ijson with a C backend).
+
+Usage: python benchmarks/bench_decode.py [values]
+"""
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jrpc_oo.IncrementalDecoder import IncrementalDecoder, incremental_available
+
+
+def measure(data, incremental, chunk=2**20):
+    """Return (peak MiB, decoded MiB, ms) for decoding data in chunks."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    decoder = IncrementalDecoder(len(data), incremental=incremental)
+    for offset in range(0, len(data), chunk):
+        decoder.feed(memoryview(data)[offset:offset + chunk])
+    message = decoder.close()
+    elapsed = (time.perf_counter() - start) * 1000
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tracemalloc.start()
+    copy = json.loads(data)
+    decoded, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del message, copy
+    return peak / 2**20, decoded / 2**20, elapsed
+
+
+def main(values):
+    payloads = {
+        'records': [{'name': f"item{i}", 'value': i * 0.5} for i in range(values)],
+        'numbers': [i * 0.5 for i in range(values * 5)],
+    }
+    modes = [('buffered', False)] + ([('incremental', True)] if incremental_available() else [])
+    for shape, arg in payloads.items():
+        params = {'args': [arg]}
+        data = json.dumps({'jsonrpc': '2.0', 'method': 'Bench.load', 'params': params, 'id': '1'}).encode()
+        print(f"{shape}: message {len(data) / 2**20:.1f} MiB")
+        for name, incremental in modes:
+            peak, decoded, ms = measure(data, incremental)
+            print(f"  {name:12} peak {peak:7.1f} MiB  decoded object {decoded:7.1f} MiB  {ms:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
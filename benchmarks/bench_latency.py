@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Latency of small calls while a large result is being encoded, sent and decoded.
+
+A JRPCServer and JRPCClient talk over localhost with the default settings,
+so the large result is compressed by permessage-deflate and sent as chunk
+frames of at most max_size. One task keeps calling a small method while
+another fetches the large result, the small call latencies are reported
+with slicing disabled and enabled.
+
+Usage: python benchmarks/bench_latency.py [rows]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jrpc_oo import JRPCClient, JRPCServer
+
+
+class Bench:
+    def __init__(self, rows):
+        self.rows = [{'name': f"item{i}", 'value': i * 0.5, 'tags': ['a', 'b']} for i in range(rows)]
+
+    def ping(self):
+        return 'pong'
+
+    def table(self):
+        return self.rows
+
+
+async def run(port, rows, slice_threshold, slice_time):
+    server = JRPCServer(port=port)
+    server.add_class(Bench(rows))
+    await server.start()
+    client = JRPCClient(f"ws://127.0.0.1:{port}")
+    task = asyncio.create_task(client.connect())
+    while 'Bench.table' not in client.server:
+        await asyncio.sleep(0.01)
+    for remote in (*server.remotes.values(), *client.remotes.values()):
+        remote.slice_threshold = slice_threshold
+        remote.slice_time = slice_time
+
+    latencies = []
+    big = asyncio.create_task(client.server['Bench.table']())
+    start = time.perf_counter()
+    while not big.done():
+        sent = time.perf_counter()
+        await client.server['Bench.ping']()
+        latencies.append((time.perf_counter() - sent) * 1000)
+    total = (time.perf_counter() - start) * 1000
+
+    await client.disconnect()
+    task.cancel()
+    await server.stop()
+    return total, latencies
+
+
+async def main(rows):
+    # Inline never returns to the event loop, not while encoding, decoding or between frames
+    for port, (name, threshold, slice_time) in enumerate((('inline', 0, float('inf')),
+                                                          ('sliced', 2**20, 0.005)), 19300):
+        total, latencies = await run(port, rows, threshold, slice_time)
+        print(f"{name:7} large call {total:7.0f} ms  small calls {len(latencies):6}  "
+              f"median {statistics.median(latencies):6.2f} ms  max {max(latencies):7.1f} ms")
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 300000))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Latency of calls offered faster than a server can run them.
+
+Two JRPC2 peers are wired back to back. The caller sends requests at a
+fixed rate to a method which spends 2 ms of CPU in each of its five steps,
+so the server can run about 100 a second. The latency of the completed
+calls and the number refused are reported without admission control and
+with a limit on running requests.
+
+Usage: python benchmarks/bench_overload.py [rate] [seconds]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jrpc_oo.Admission import Admission
+from jrpc_oo.JRPC2 import JRPC2
+
+
+def make_pair(admission):
+    a, b = JRPC2(), JRPC2()
+
+    def wire(receiver):
+        async def transmit(msg, next_cb):
+            await asyncio.sleep(0)  # Stand in for the socket
+            receiver.receive(msg)
+            next_cb(False)
+        return transmit
+
+    a.set_transmitter(wire(b))
+    b.set_transmitter(wire(a))
+    for side in (a, b):
+        side.upgrade()
+    b.admission = admission
+    return a, b
+
+
+async def work(next_cb):
+    for _ in range(5):
+        end = time.perf_counter() + 0.002
+        while time.perf_counter() < end:
+            pass
+        await asyncio.sleep(0)
+    next_cb(None, 'done')
+
+
+async def run(admission, rate, seconds):
+    a, b = make_pair(admission)
+    b.methods['Bench.work'] = lambda params, next_cb: asyncio.ensure_future(work(next_cb))
+    latencies, refused = [], 0
+    loop = asyncio.get_running_loop()
+    pending = []
+
+    def send():
+        future = loop.create_future()
+        sent = time.perf_counter()
+
+        def done(err, res):
+            nonlocal refused
+            if err:
+                refused += 1
+            else:
+                latencies.append((time.perf_counter() - sent) * 1000)
+            future.set_result(None)
+        a.call('Bench.work', {'args': []}, done)
+        pending.append(future)
+
+    start = time.perf_counter()
+    total = int(rate * seconds)
+    while len(pending) < total:
+        # The sender shares the loop, catch up on the requests due by now
+        due = min(total, int((time.perf_counter() - start) * rate) + 1)
+        while len(pending) < due:
+            send()
+        await asyncio.sleep(0.001)
+    await asyncio.gather(*pending)
+    return latencies, refused
+
+
+def main(rate, seconds):
+    for name, admission in (('unlimited', None),
+                            ('admission', Admission(max_inflight=8, max_queue_time=0.1))):
+        latencies, refused = asyncio.run(run(admission, rate, seconds))
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99)] if latencies else 0
+        print(f"{name:9} completed {len(latencies):5}  refused {refused:5}  "
+              f"median {statistics.median(latencies) if latencies else 0:7.1f} ms  p99 {p99:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 200, float(sys.argv[2]) if len(sys.argv) > 2 else 3)
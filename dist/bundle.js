@@ -234,6 +234,130 @@ if (typeof module !== 'undefined' && typeof module.exports !== 'undefined'){  //
 if (!crypto.randomUUID)
   crypto.randomUUID = ()=>{return crypto.getRandomValues(new Uint8Array(32)).toString('base64').replaceAll(',','');};
 
+/** Binary attachments, the same frames as jrpc_oo/Attachments.py.
+A frame is FRAME_MAGIC, a 4 byte big endian header length, the JSON header
+{key, i} padded with spaces to 8 bytes and the payload. The message names its
+frames with "bin" : [key, count] and a placeholder {"$bytes" : {frame}} or
+{"$ndarray" : {dtype, shape, frame}} where each value was.
+*/
+const FRAME_MAGIC = [0, 74, 82, 66]; // '\0JRB', never the start of JSON text
+const LITTLE_ENDIAN = new Uint8Array(new Uint16Array([1]).buffer)[0] === 1;
+const DTYPES = { // numpy dtype without its byte order -> typed array
+  i1 : Int8Array, u1 : Uint8Array, b1 : Uint8Array, i2 : Int16Array, u2 : Uint16Array,
+  i4 : Int32Array, u4 : Uint32Array, i8 : BigInt64Array, u8 : BigUint64Array,
+  f4 : Float32Array, f8 : Float64Array
+};
+const ATTACHMENT_KINDS = ['bytes', 'ndarray'];
+
+/** The numpy dtype of a typed array, null for the ones sent as bytes */
+function dtypeOf(value){
+  if (value instanceof Uint8Array || !ArrayBuffer.isView(value) || value instanceof DataView)
+    return null;
+  if (value instanceof Uint8ClampedArray)
+    return '|u1';
+  let code = Object.keys(DTYPES).find((k) => k !== 'b1' && value instanceof DTYPES[k]);
+  if (code == null)
+    return null;
+  return (value.BYTES_PER_ELEMENT === 1 ? '|' : (LITTLE_ENDIAN ? '<' : '>')) + code;
+}
+
+/** Replace typed arrays and ArrayBuffers in value with placeholders, the payloads go in frames.
+Only the kinds the peer negotiated are replaced and value is not changed, containers holding
+attachments are copied.
+@param value The value to send
+@param kinds The attachment kinds the peer takes
+@param frames Map of frame number -> payload, the numbers are unique until transmit takes them
+@param next The next frame number
+@return [value, next]
+*/
+function extractAttachments(value, kinds, frames, next){
+  if (value == null || typeof value !== 'object')
+    return [value, next];
+  if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)){
+    let dtype = dtypeOf(value);
+    let kind = dtype ? 'ndarray' : 'bytes';
+    if (kinds.indexOf(kind) < 0)
+      return [value, next];
+    let payload = value instanceof ArrayBuffer ? new Uint8Array(value) : new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+    frames.set(next, payload);
+    let meta = dtype ? {dtype : dtype, shape : value.shape || [value.length], frame : next} : {frame : next};
+    return [{['$'+kind] : meta}, next+1];
+  }
+  if (!Array.isArray(value) && Object.getPrototypeOf(value) !== Object.prototype)
+    return [value, next];
+  let copy = null;
+  for (const k of Object.keys(value)){
+    let extracted;
+    [extracted, next] = extractAttachments(value[k], kinds, frames, next);
+    if (extracted !== value[k]){
+      if (copy == null)
+        copy = Array.isArray(value) ? value.slice() : Object.assign({}, value);
+      copy[k] = extracted;
+    }
+  }
+  return [copy || value, next];
+}
+
+/** Call fn on each attachment placeholder in a decoded value, replacing it with what fn returns */
+function mapPlaceholders(value, fn){
+  if (value == null || typeof value !== 'object')
+    return value;
+  let keys = Object.keys(value);
+  if (!Array.isArray(value) && keys.length === 1 && keys[0][0] === '$'){
+    let meta = value[keys[0]];
+    if (meta != null && typeof meta === 'object' && 'frame' in meta)
+      return fn(keys[0].substring(1), meta);
+  }
+  keys.forEach((k) => {value[k] = mapPlaceholders(value[k], fn);});
+  return value;
+}
+
+/** Build a binary frame from its header and payload */
+function packFrame(header, payload){
+  let head = JSON.stringify(header);
+  head += ' '.repeat((8 - (8 + head.length) % 8) % 8); // the payload starts 8 byte aligned
+  let frame = new Uint8Array(8 + head.length + payload.byteLength);
+  frame.set(FRAME_MAGIC);
+  new DataView(frame.buffer).setUint32(4, head.length);
+  for (let n=0; n<head.length; n++) // the header is ASCII JSON
+    frame[8+n] = head.charCodeAt(n);
+  frame.set(payload, 8 + head.length);
+  return frame;
+}
+
+/** Split a binary frame into its header and a view on its payload, null if it isn't a frame */
+function unpackFrame(data){
+  let bytes = data instanceof ArrayBuffer ? new Uint8Array(data) : new Uint8Array(data.buffer, data.byteOffset, data.byteLength);
+  if (bytes.length < 8 || FRAME_MAGIC.some((b, n) => bytes[n] !== b))
+    return null;
+  let size = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength).getUint32(4);
+  let header = JSON.parse(new TextDecoder().decode(bytes.subarray(8, 8+size)));
+  return {header : header, payload : bytes.subarray(8+size)};
+}
+
+/** Rebuild an attachment from its placeholder and frame payload.
+bytes arrive as a Uint8Array view on the frame, ndarrays as the matching typed array with a
+shape member, on the frame unless it must be realigned or byte swapped. dtypes without a typed
+array (complex, float16 ...) arrive as their bytes.
+*/
+function decodeAttachment(kind, meta, payload){
+  if (kind !== 'ndarray' || !(meta.dtype.substring(1) in DTYPES))
+    return payload;
+  let TypedArray = DTYPES[meta.dtype.substring(1)];
+  let size = TypedArray.BYTES_PER_ELEMENT;
+  if (size > 1 && meta.dtype[0] === (LITTLE_ENDIAN ? '>' : '<')){ // swap each element's bytes into a copy
+    let swapped = new Uint8Array(payload.length);
+    for (let n=0; n<payload.length; n+=size)
+      for (let b=0; b<size; b++)
+        swapped[n+b] = payload[n+size-1-b];
+    payload = swapped;
+  } else if (payload.byteOffset % size) // typed arrays must be aligned to their element size
+    payload = payload.slice();
+  let array = new TypedArray(payload.buffer, payload.byteOffset, payload.byteLength / size);
+  array.shape = meta.shape;
+  return array;
+}
+
 /** Call remotes in two different ways :
 To call one remote :
   this.remote[uuid].rpcs[fnName](args)
@@ -271,13 +395,14 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
 
     if (this.ws) { // browser version of ws
       ws=this.ws;
+      this.ws.binaryType = 'arraybuffer'; // attachment frames
       this.ws.onclose =  function (evMsg) {this.rmRemote(evMsg, remote.uuid);}.bind(this);
-      this.ws.onmessage = (evMsg) => { remote.receive(evMsg.data); };
+      this.ws.onmessage = (evMsg) => { this.receive(remote, evMsg.data); };
     } else { // node version of ws
       ws.on('close', (evMsg, buf)=>this.rmRemote.bind(this)(evMsg, remote.uuid));
-      ws.on('message', function(data, isBinary) {
+      ws.on('message', (data, isBinary) => {
         const msg = isBinary ? data : data.toString(); // changes for upgrade to v8
-        remote.receive(msg);
+        this.receive(remote, msg);
       });
     }
 
@@ -285,6 +410,65 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
     return remote;
   }
 
+  /** Pass a received message to the remote, once the binary frames it carries have arrived.
+  @param remote The remote the message arrived on
+  @param data JSON text or a binary attachment frame
+  */
+  receive(remote, data){
+    if (typeof data !== 'string') {
+      let frame = unpackFrame(data);
+      if (frame == null)
+        return console.log('JRPCCommon::receive dropped a binary message which is not an attachment frame');
+      this.inboundTransfer(remote, frame.header.key).frames[frame.header.i] = frame.payload;
+      return this.completeTransfer(remote, frame.header.key);
+    }
+    if (data.indexOf('"bin"') < 0) // the common case, no attachments
+      return remote.receive(data);
+    let message;
+    try {
+      message = JSON.parse(data);
+    } catch (e) {
+      return remote.receive(data);
+    }
+    if (message == null || Array.isArray(message) || !Array.isArray(message.bin))
+      return remote.receive(message);
+    let transfer = this.inboundTransfer(remote, message.bin[0]);
+    transfer.count = message.bin[1];
+    delete message.bin;
+    transfer.message = message;
+    this.completeTransfer(remote, transfer.key);
+  }
+
+  /** The message and frames received so far for a transfer key, they are dropped after inboundTimeout seconds
+  */
+  inboundTransfer(remote, key){
+    if (remote.transfersIn == null)
+      remote.transfersIn = {};
+    if (remote.transfersIn[key] == null) {
+      let timeout = (this.inboundTimeout || 30)*1000;
+      remote.transfersIn[key] = {key : key, frames : {}, count : null, message : null, timer : setTimeout(() => {
+        console.log('JRPCCommon::inboundTransfer dropped attachment transfer '+key+', its frames did not all arrive');
+        delete remote.transfersIn[key];
+      }, timeout)};
+    }
+    return remote.transfersIn[key];
+  }
+
+  /** Splice the frames into a transfer's message and pass it on, once they have all arrived */
+  completeTransfer(remote, key){
+    let transfer = remote.transfersIn[key];
+    if (transfer.message == null || Object.keys(transfer.frames).length < transfer.count)
+      return;
+    clearTimeout(transfer.timer);
+    delete remote.transfersIn[key];
+    let message = transfer.message;
+    ['params', 'result'].forEach((member) => {
+      if (member in message)
+        message[member] = mapPlaceholders(message[member], (kind, meta) => decodeAttachment(kind, meta, transfer.frames[meta.frame]));
+    });
+    remote.receive(message);
+  }
+
   /** Overload this to execute code when the remote comes up
   */
   remoteIsUp() {
@@ -344,13 +528,26 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
   @param ws the websocket for transmission
   */
   setupRemote(remote, ws){
-    remote.setTransmitter(this.transmit.bind(ws)); // Let JRPC send requests and responses continuously
+    // Let JRPC send requests and responses continuously, each followed by its attachment frames
+    remote.setTransmitter((msg, next) => this.transmit.bind(ws)(this.attachFrames(remote, msg), next));
     if (this.classes)
       this.classes.forEach((c) => {
-        remote.expose(c);
+        remote.expose(this.exposeAttachments(remote, c));
       });
+    remote.peerCapabilities = {};
+    remote.expose('system.capabilities', (params, next) => {
+      // Answered before taking the remote's capabilities, so the answer is plain JSON-RPC
+      next(null, this.capabilities());
+      if (params != null && typeof params === 'object')
+        remote.peerCapabilities = params;
+    });
     remote.upgrade();
 
+    // Negotiate binary attachments, peers which don't know system.capabilities stay plain JSON-RPC
+    remote.call('system.capabilities', this.capabilities(), (err, result) => {
+      remote.peerCapabilities = (!err && result != null && typeof result === 'object') ? result : {};
+    });
+
     remote.call('system.listComponents', [], (err, result) => {
       if (err) {
         console.log(err);
@@ -360,14 +557,87 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
     });
   }
 
+  /** The wire extensions this side offers to its peers, sent with system.capabilities.
+  Typed arrays and ArrayBuffers travel in binary frames unless this.attachments is false.
+  */
+  capabilities(){
+    return this.attachments === false ? {} : {attachments : ATTACHMENT_KINDS};
+  }
+
+  /** Wrap the functions of an exposed class so their typed array results are sent as attachments
+  @param remote The remote calling the functions
+  @param jrpcObj The js-JRPC friendly function object, see ExposeClass.exposeAllFns
+  */
+  exposeAttachments(remote, jrpcObj){
+    let wrapped = {};
+    Object.keys(jrpcObj).forEach((fnName) => {
+      wrapped[fnName] = (params, next) => jrpcObj[fnName](params, (err, result) => next(err, this.withAttachments(remote, result)));
+    });
+    return wrapped;
+  }
+
+  /** Move the typed arrays in a value sent to remote out to binary frames, when remote negotiated them.
+  @param remote The remote the value is sent to
+  @param value A call's params or a result
+  @return value with attachment placeholders, sent with their frames by attachFrames
+  */
+  withAttachments(remote, value){
+    let kinds = (remote.peerCapabilities || {}).attachments;
+    if (!Array.isArray(kinds) || !kinds.length)
+      return value;
+    if (remote.framesOut == null) {
+      remote.framesOut = new Map;
+      remote.frameSeq = 0;
+      remote.binSeq = 0;
+    }
+    [value, remote.frameSeq] = extractAttachments(value, kinds, remote.framesOut, remote.frameSeq);
+    return value;
+  }
+
+  /** Follow each message JRPC transmits with the frames of its attachments.
+  Batches holding attachments are sent as single messages, each one naming its frames with "bin".
+  @param remote The remote transmitting msg
+  @param msg The JSON text JRPC transmits
+  @return msg, or an array of the messages and frames to send in order
+  */
+  attachFrames(remote, msg){
+    if (remote.framesOut == null || !remote.framesOut.size)
+      return msg;
+    let batch = JSON.parse(msg);
+    let messages = Array.isArray(batch) ? batch : (batch.requests && batch.responses ? batch.responses.concat(batch.requests) : [batch]);
+    let out = [];
+    messages.forEach((message) => {
+      let payloads = [];
+      ['params', 'result'].forEach((member) => {
+        if (member in message)
+          message[member] = mapPlaceholders(message[member], (kind, meta) => {
+            if (!remote.framesOut.has(meta.frame))
+              return {['$'+kind] : meta};
+            payloads.push(remote.framesOut.get(meta.frame));
+            remote.framesOut.delete(meta.frame);
+            meta.frame = payloads.length-1;
+            return {['$'+kind] : meta};
+          });
+      });
+      if (payloads.length)
+        message.bin = [++remote.binSeq, payloads.length];
+      out.push(JSON.stringify(message));
+      payloads.forEach((payload, n) => out.push(packFrame({key : message.bin[0], i : n}, payload)));
+    });
+    return out;
+  }
+
   /** Transmit a message or queue of messages to the server.
   Bind the web socket to this method for calling this.send
-  @param msg the message to send
+  @param msg the message to send, or an array of messages and binary frames to send in order
   @param next the next to execute
   */
   transmit(msg, next){
   	try {
-  	  this.send(msg);
+  	  if (Array.isArray(msg))
+  	    msg.forEach((data) => this.send(data));
+  	  else
+  	    this.send(msg);
   	  return next(false);
   	} catch (e) {
       console.log(e);
@@ -381,6 +651,7 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
   @param remote The remote to call
   */
   setupFns(fnNames, remote){
+     let self=this;
      fnNames.forEach(fnName => {
       if (remote.rpcs==null) // each remote holds its own rpcs
         remote.rpcs={};
@@ -388,7 +659,7 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
       // each remote's rpcs will hold the functino to call and returns a promise
       remote.rpcs[fnName] = function (params) {
         return new Promise((resolve, reject) => {
-          remote.call(fnName, {args : Array.from(arguments)}, (err, result) => {
+          remote.call(fnName, self.withAttachments(remote, {args : Array.from(arguments)}), (err, result) => {
               if (err) {
                 console.log('Error when calling remote function : '+fnName);
                 reject(err);
@@ -432,7 +703,7 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
         // remote.rpcs[fnNAme] reference if the else case is triggered in future
         this.server[fnName] = function (params) {
           return new Promise((resolve, reject) => {
-            remote.call(fnName, {args : Array.from(arguments)}, (err, result) => {
+            remote.call(fnName, self.withAttachments(remote, {args : Array.from(arguments)}), (err, result) => {
                 if (err) {
                   console.log('Error when calling remote function : '+fnName);
                   reject(err);
@@ -481,7 +752,7 @@ let JRPCCommon$1 = class JRPCCommon extends LitElement {
 
     if (this.remotes!=null) // update all existing remotes
       for (const [uuid, remote] of Object.entries(this.remotes)) {
-        remote.expose(jrpcObj); // expose the functions from the class
+        remote.expose(this.exposeAttachments(remote, jrpcObj)); // expose the functions from the class
         remote.upgrade();  // Handshake extended capabilities
       }
 
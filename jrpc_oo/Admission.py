@@ -0,0 +1,330 @@
+"""
+Admission control for inbound requests.
+
+Without limits a server starts every request it receives, so under overload
+all of them slow down together until callers time out. Admission caps the
+requests running at once, overall, per connection and per method. Requests
+over a cap wait in a bounded queue for a limited time and are then refused
+with a "Server overloaded" error carrying a retry_after hint, which callers
+receive straight away instead of after their timeout.
+
+Queued requests wait in one of two lanes. The high priority lane is served
+first, for control calls and interactive use, but low priority requests
+still get a share of the slots freed while both lanes wait. Within a lane
+connections take turns, weighted deficit round robin, so one client
+pipelining thousands of requests waits behind its own requests rather than
+in front of everybody else's.
+"""
+import asyncio
+import collections
+import time
+from typing import Any, Callable, Dict, Optional
+
+from . import Deadlines
+
+# JSON-RPC error code for requests refused by admission control
+OVERLOADED = -32001
+
+HIGH = 'high'
+LOW = 'low'
+
+
+def overloaded_error(retry_after: float) -> Dict[str, Any]:
+    """The JSON-RPC error object sent for a refused request."""
+    return {'code': OVERLOADED, 'message': 'Server overloaded',
+            'data': {'retry_after': retry_after}}
+
+
+def priority(level: str):
+    """Set the lane a method's requests wait in when admission is limited.
+
+    Callers can override it per request with with_options(priority=...).
+
+    Args:
+        level: 'high' or 'low', the default
+    """
+    if level not in (HIGH, LOW):
+        raise ValueError(f"priority must be '{HIGH}' or '{LOW}'")
+
+    def mark(fn):
+        fn.jrpc_priority = level
+        return fn
+
+    return mark
+
+
+class _Waiting:
+    """A request queued for a slot."""
+
+    __slots__ = ('remote', 'method', 'execute', 'respond', 'lane', 'deadline', 'timer')
+
+    def __init__(self, remote, method, execute, respond, lane, deadline):
+        self.remote = remote
+        self.method = method
+        self.execute = execute
+        self.respond = respond
+        self.lane = lane
+        self.deadline = deadline
+        self.timer = None
+
+
+class _Lane:
+    """Requests waiting at one priority, served round robin across remotes."""
+
+    def __init__(self):
+        self.queues = {}                     # Remote -> deque of its waiting requests
+        self.turns = collections.deque()     # Remotes with waiting requests, next to serve first
+        self.deficit = collections.Counter() # Remote -> starts left in its turn
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, entry):
+        queue = self.queues.get(entry.remote)
+        if queue is None:
+            queue = self.queues[entry.remote] = collections.deque()
+            self.turns.append(entry.remote)
+        queue.append(entry)
+        self.size += 1
+
+    def peek(self, fits: Callable, weight: Callable):
+        """The next request to serve which fits, None if none does.
+
+        Args:
+            fits: Whether a request fits in the free slots
+            weight: Remote -> requests it starts per turn, which may be
+                fractional
+        """
+        waiting = True
+        while waiting:
+            # Remotes with fractional weights may need several rounds
+            waiting = False
+            for _ in range(len(self.turns)):
+                remote = self.turns[0]
+                entry = next((entry for entry in self.queues[remote] if fits(entry)), None)
+                if entry is not None:
+                    waiting = True
+                    if self.deficit[remote] < 1:
+                        self.deficit[remote] += weight(remote)
+                    if self.deficit[remote] >= 1:
+                        return entry
+                # Its turn passes, with what is left of its deficit
+                self.turns.rotate(-1)
+        return None
+
+    def remove(self, entry, served: bool = False):
+        """Take a request out of the lane.
+
+        Args:
+            entry: The request, if served it was returned by peek
+            served: Charge it to its remote's turn
+        """
+        queue = self.queues[entry.remote]
+        queue.remove(entry)
+        self.size -= 1
+        if served:
+            self.deficit[entry.remote] -= 1
+            if self.deficit[entry.remote] < 1:
+                self.turns.rotate(-1)
+        if not queue:
+            del self.queues[entry.remote]
+            self.turns.remove(entry.remote)
+            self.deficit.pop(entry.remote, None)
+
+    def drop(self, remote: str):
+        """Remove and return all the requests of a remote."""
+        queue = self.queues.pop(remote, None)
+        if queue is None:
+            return []
+        self.size -= len(queue)
+        self.turns.remove(remote)
+        self.deficit.pop(remote, None)
+        return list(queue)
+
+
+class Admission:
+    """Limits on the requests a server runs at once.
+
+    Set one on JRPCServer or JRPCClient before remotes connect, it is shared
+    by all of them. A request is running from when its method is called
+    until it responds. system.* methods are always admitted.
+
+    Args:
+        max_inflight: Most requests running at once, None for no limit
+        per_remote: Most requests running at once for one connection
+        methods: Method name -> most requests of that method running at once
+        max_queue: Most requests waiting for a slot, more are refused
+            straight away
+        remote_queue: Most requests of one connection waiting for a slot,
+            so one client can't fill the queue, None for no limit
+        max_queue_time: Seconds a request may wait for a slot before it is
+            refused
+        retry_after: Seconds callers are told to wait before retrying
+        reserved: Slots of max_inflight only high priority requests may use,
+            so they find one free while low priority work fills the rest
+        high_share: High priority requests started for each low priority
+            one while both lanes wait, so the low lane is never starved
+        weights: Remote uuid -> its share of the queued requests started,
+            relative to the default of 1. Entries can be added as remotes
+            connect and are forgotten when they close
+    """
+
+    def __init__(self, max_inflight: Optional[int] = None, per_remote: Optional[int] = None,
+                 methods: Optional[Dict[str, int]] = None, max_queue: int = 1000,
+                 max_queue_time: float = 1.0, retry_after: float = 1.0,
+                 reserved: int = 0, high_share: int = 8, remote_queue: Optional[int] = None,
+                 weights: Optional[Dict[str, float]] = None):
+        self.max_inflight = max_inflight
+        self.per_remote = per_remote
+        self.methods = dict(methods or {})
+        self.max_queue = max_queue
+        self.remote_queue = remote_queue
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.reserved = reserved
+        self.high_share = high_share
+        self.weights = dict(weights or {})
+        self.inflight = 0
+        self.by_remote = collections.Counter()
+        self.by_method = collections.Counter()
+        self.lanes = {HIGH: _Lane(), LOW: _Lane()}
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self._draining = False
+        self._high_run = 0  # High priority requests started since the last low one
+
+    def admit(self, remote: str, method: str, execute: Callable, respond: Callable, lane: str = LOW,
+              deadline: Optional[float] = None):
+        """Run a request now, queue it or refuse it.
+
+        Args:
+            remote: The uuid of the connection the request came from
+            method: The requested method
+            execute: Runs the method, called with a callback taking
+                (err, result) which must be called once it is done
+            respond: Called with (err, result) to answer the request
+            lane: 'high' or 'low' priority
+            deadline: The time.monotonic() the request is answered by, it
+                leaves the queue then if it hasn't started
+        """
+        entry = _Waiting(remote, method, execute, respond, HIGH if lane == HIGH else LOW, deadline)
+        if self._fits(entry):
+            self._start(entry)
+        elif self.queued() >= self.max_queue or (
+                self.remote_queue is not None and self.queued(remote) >= self.remote_queue):
+            self._reject(entry)
+        else:
+            left = None if deadline is None else deadline - time.monotonic()
+            if left is not None and left < self.max_queue_time:
+                entry.timer = asyncio.get_running_loop().call_later(left, self._expire, entry, True)
+            else:
+                entry.timer = asyncio.get_running_loop().call_later(self.max_queue_time, self._expire, entry)
+            self.lanes[entry.lane].append(entry)
+
+    def queued(self, remote: Optional[str] = None) -> int:
+        """The number of requests waiting for a slot, overall or of one remote."""
+        if remote is None:
+            return sum(len(lane) for lane in self.lanes.values())
+        return sum(len(lane.queues.get(remote, ())) for lane in self.lanes.values())
+
+    def drop(self, remote: str):
+        """Forget the queued requests and weight of a closed connection."""
+        for lane in self.lanes.values():
+            for entry in lane.drop(remote):
+                entry.timer.cancel()
+        self.weights.pop(remote, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Running, queued, admitted, refused and expired request counts."""
+        return {'inflight': self.inflight, 'queued': self.queued(),
+                'queued_high': len(self.lanes[HIGH]),
+                'admitted': self.admitted, 'rejected': self.rejected, 'expired': self.expired}
+
+    def _fits(self, entry) -> bool:
+        if self.max_inflight is not None:
+            limit = self.max_inflight if entry.lane == HIGH else self.max_inflight - self.reserved
+            if self.inflight >= limit:
+                return False
+        if self.per_remote is not None and self.by_remote[entry.remote] >= self.per_remote:
+            return False
+        limit = self.methods.get(entry.method)
+        return limit is None or self.by_method[entry.method] < limit
+
+    def _start(self, entry):
+        self.inflight += 1
+        self.by_remote[entry.remote] += 1
+        self.by_method[entry.method] += 1
+        self.admitted += 1
+        finished = False
+
+        def done(err, result):
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            try:
+                entry.respond(err, result)
+            finally:
+                self._release(entry)
+
+        try:
+            entry.execute(done)
+        except Exception as e:
+            done(str(e), None)
+
+    def _release(self, entry):
+        self.inflight -= 1
+        for counter, key in ((self.by_remote, entry.remote), (self.by_method, entry.method)):
+            counter[key] -= 1
+            if not counter[key]:
+                del counter[key]
+        self._start_queued()
+
+    def _start_queued(self):
+        """Start the longest waiting requests which fit in the free slots."""
+        # Methods which respond straight away release their slot from inside
+        # _start, the outer call carries on instead of recursing
+        if self._draining:
+            return
+        self._draining = True
+        try:
+            while self.max_inflight is None or self.inflight < self.max_inflight:
+                entry = self._next_queued()
+                if entry is None:
+                    return
+                self.lanes[entry.lane].remove(entry, served=True)
+                entry.timer.cancel()
+                self._start(entry)
+        finally:
+            self._draining = False
+
+    def _next_queued(self):
+        """The queued request to start next, None if none fits."""
+        high = self.lanes[HIGH].peek(self._fits, self._weight)
+        low = self.lanes[LOW].peek(self._fits, self._weight)
+        if low is None:
+            self._high_run = 0
+            return high
+        if high is None or self._high_run >= self.high_share:
+            self._high_run = 0
+            return low
+        self._high_run += 1
+        return high
+
+    def _weight(self, remote):
+        # A remote without weight would never finish its turn
+        return max(self.weights.get(remote, 1), 0.01)
+
+    def _expire(self, entry, deadline=False):
+        self.lanes[entry.lane].remove(entry)
+        if deadline:
+            self.expired += 1
+            entry.respond(Deadlines.deadline_error(), None)
+        else:
+            self._reject(entry)
+
+    def _reject(self, entry):
+        self.rejected += 1
+        entry.respond(overloaded_error(self.retry_after), None)
@@ -0,0 +1,372 @@
+"""
+Out-of-band binary attachments for JRPC messages.
+
+Values which JSON represents poorly (bytes, numpy arrays ...) are pulled out
+of a message while it is encoded, replaced with a small placeholder object and
+sent as adjacent binary WebSocket frames. The receiver splices the frames back
+in without copying the payload.
+"""
+import base64
+import json
+import re
+import struct
+import uuid
+from typing import Any, Dict, List, Tuple, Union
+
+from . import SlicedJSON
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+
+# Binary frames start with a NUL byte so they can never be mistaken for JSON text
+FRAME_MAGIC = b'\x00JRB'
+# RawJSON is encoded as this string followed by its index, then replaced by its text
+_RAW_MARK = '\x00raw-' + uuid.uuid4().hex + ':'
+_RAW_PATTERN = re.compile(re.escape(json.dumps(_RAW_MARK)[:-1]) + r'(\d+)"')
+_HEADER_LEN = struct.Struct('>I')
+_PREFIX_LEN = len(FRAME_MAGIC) + _HEADER_LEN.size
+
+
+class AttachmentCodec:
+    """Base class for a type which travels as a binary attachment.
+
+    The placeholder left in the JSON message is ``{"$<kind>": meta}`` where
+    meta carries the ``frame`` index plus whatever the codec needs to rebuild
+    the value.
+    """
+
+    kind = None
+
+    def available(self) -> bool:
+        """Return True when the codec's dependencies are importable."""
+        return True
+
+    def match(self, value) -> bool:
+        """Return True if this codec can encode value."""
+        raise NotImplementedError
+
+    def encode(self, value) -> Tuple[Dict[str, Any], Any]:
+        """Return (meta, payload) where payload supports the buffer protocol."""
+        raise NotImplementedError
+
+    def decode(self, meta: Dict[str, Any], payload: memoryview):
+        """Rebuild the value from its meta data and a view on the frame payload."""
+        raise NotImplementedError
+
+    def to_jsonable(self, value):
+        """Plain JSON fallback used when the peer has not negotiated this kind."""
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class NDArrayCodec(AttachmentCodec):
+    """numpy ndarrays as raw buffers with dtype/shape headers."""
+
+    kind = 'ndarray'
+
+    def available(self):
+        return np is not None
+
+    def match(self, value):
+        if np is None or not isinstance(value, np.ndarray):
+            return False
+        # Object and structured dtypes have no portable raw representation
+        return not value.dtype.hasobject and value.dtype.fields is None
+
+    def encode(self, value):
+        arr = np.ascontiguousarray(value)
+        meta = {'dtype': arr.dtype.str, 'shape': list(arr.shape)}
+        return meta, arr.reshape(-1).view(np.uint8)
+
+    def decode(self, meta, payload):
+        # frombuffer shares memory with the received frame, it does not copy,
+        # so the array is read-only. Call .copy() on it for a writable one.
+        arr = np.frombuffer(payload, dtype=np.dtype(meta['dtype']))
+        return arr.reshape(meta['shape'])
+
+    def to_jsonable(self, value):
+        if np is not None:
+            if isinstance(value, np.ndarray):
+                return value.tolist()
+            if isinstance(value, np.generic):
+                return value.item()
+        return super().to_jsonable(value)
+
+
+class BytesCodec(AttachmentCodec):
+    """bytes, bytearray and memoryview values as raw frames instead of base64."""
+
+    kind = 'bytes'
+
+    def match(self, value):
+        return isinstance(value, (bytes, bytearray, memoryview))
+
+    def encode(self, value):
+        if isinstance(value, memoryview) and not value.contiguous:
+            value = value.tobytes()
+        return {}, value
+
+    def decode(self, meta, payload):
+        # A read-only view on the received frame, call bytes() for a copy
+        return payload
+
+    def to_jsonable(self, value):
+        if self.match(value):
+            return base64.b64encode(value).decode('ascii')
+        return super().to_jsonable(value)
+
+
+class Columnar:
+    """Mark a dict of equal length columns for columnar transport.
+
+    Plain dicts are left alone, wrap one in Columnar to have it sent as an
+    Arrow table instead of a JSON object of lists.
+    """
+
+    def __init__(self, columns: Dict[str, Any]):
+        self.columns = columns
+
+    def to_pydict(self) -> Dict[str, list]:
+        return {name: list(col.tolist() if hasattr(col, 'tolist') else col)
+                for name, col in self.columns.items()}
+
+
+class RawJSON:
+    """JSON text which is spliced into a message as it is.
+
+    Return one from an exposed method, or place one anywhere in a result,
+    to send data encoded once rather than on every call. The text is not
+    checked, it must be a single valid JSON value.
+
+    Args:
+        text: The encoded JSON, str or UTF-8 bytes
+    """
+
+    __slots__ = ('text',)
+
+    def __init__(self, text: Union[str, bytes]):
+        self.text = text.decode('utf-8') if isinstance(text, (bytes, bytearray, memoryview)) else text
+
+    @classmethod
+    def encode(cls, value) -> 'RawJSON':
+        """Encode value once, attachment types degrade to plain JSON."""
+        return cls(json.dumps(value, default=to_jsonable))
+
+    def __len__(self):
+        return len(self.text)
+
+    def __repr__(self):
+        return f"RawJSON({self.text[:40]!r}{'...' if len(self.text) > 40 else ''})"
+
+
+class LazyTable:
+    """A received Arrow IPC stream which is only decoded when first used.
+
+    The stream is read straight from the received frame, so numeric columns
+    share its memory.
+    """
+
+    def __init__(self, payload: memoryview):
+        self._payload = payload
+        self._table = None
+
+    @property
+    def table(self):
+        """The decoded pyarrow.Table."""
+        if self._table is None:
+            reader = pa.ipc.open_stream(pa.py_buffer(self._payload))
+            self._table = reader.read_all()
+        return self._table
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the encoded stream."""
+        return self._payload.nbytes
+
+    def to_pandas(self, **kwargs):
+        return self.table.to_pandas(**kwargs)
+
+    def to_pydict(self) -> Dict[str, list]:
+        return self.table.to_pydict()
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getattr__(self, name):
+        # Everything else is answered by the pyarrow.Table
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.table, name)
+
+
+class ArrowCodec(AttachmentCodec):
+    """Tabular values as an Arrow IPC stream, column names are sent once."""
+
+    kind = 'arrow'
+
+    def available(self):
+        return pa is not None
+
+    def match(self, value):
+        if pa is None:
+            return False
+        if isinstance(value, (pa.Table, pa.RecordBatch, Columnar)):
+            return True
+        return pd is not None and isinstance(value, pd.DataFrame)
+
+    def encode(self, value):
+        if isinstance(value, Columnar):
+            value = pa.table(value.columns)
+        elif pd is not None and isinstance(value, pd.DataFrame):
+            value = pa.Table.from_pandas(value, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, value.schema) as writer:
+            writer.write(value)
+        return {}, sink.getvalue()
+
+    def decode(self, meta, payload):
+        return LazyTable(payload)
+
+    def to_jsonable(self, value):
+        # Fall back to a JSON object of columns, not a list of row dicts
+        if isinstance(value, Columnar):
+            return value.to_pydict()
+        if pa is not None and isinstance(value, (pa.Table, pa.RecordBatch)):
+            return value.to_pydict()
+        if pd is not None and isinstance(value, pd.DataFrame):
+            return value.to_dict(orient='list')
+        return super().to_jsonable(value)
+
+
+CODECS: List[AttachmentCodec] = [BytesCodec(), NDArrayCodec(), ArrowCodec()]
+
+
+def available_kinds() -> List[str]:
+    """The attachment kinds this process can encode and decode."""
+    return [codec.kind for codec in CODECS if codec.available()]
+
+
+def pack_frame(header: Dict[str, Any], payload) -> bytes:
+    """Build a binary frame from a JSON header and a buffer payload.
+
+    Layout: FRAME_MAGIC, 4 byte big endian header length, header JSON, payload.
+    The header is padded with spaces so the payload starts 8 byte aligned,
+    which lets numpy and Arrow use it in place.
+    """
+    head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    head += b' ' * (-(_PREFIX_LEN + len(head)) % 8)
+    return b''.join((FRAME_MAGIC, _HEADER_LEN.pack(len(head)), head, payload))
+
+
+def is_frame(data) -> bool:
+    """Return True if data is a binary attachment frame."""
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:len(FRAME_MAGIC)]) == FRAME_MAGIC
+
+
+def unpack_frame(data) -> Tuple[Dict[str, Any], memoryview]:
+    """Split a binary frame into its header and a zero-copy view on the payload."""
+    view = memoryview(data)
+    (size,) = _HEADER_LEN.unpack_from(view, len(FRAME_MAGIC))
+    header = json.loads(bytes(view[_PREFIX_LEN:_PREFIX_LEN + size]))
+    return header, view[_PREFIX_LEN + size:]
+
+
+def to_jsonable(value):
+    """json.dumps default hook which degrades attachment types to plain JSON."""
+    for codec in CODECS:
+        if codec.available():
+            try:
+                return codec.to_jsonable(value)
+            except TypeError:
+                continue
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(message: Union[Dict[str, Any], list], kinds, key=None) -> Tuple[str, List[Any]]:
+    """Encode a message, extracting attachments of the given kinds.
+
+    Args:
+        message: The JSON-RPC message dict, or a compact message list
+        kinds: Attachment kinds the receiving peer has negotiated
+        key: Transfer key which ties the binary frames to this message
+
+    Returns:
+        (text, payloads) where text is the JSON message. When payloads is not
+        empty the message carries a ``"bin": [key, count]`` member, or a last
+        ``[key, count]`` element for a list, and each
+        payload must be sent with pack_frame({'key': key, 'i': index}, payload).
+    """
+    default, payloads, fragments = _extractor(kinds, key)
+    return _finish(json.dumps(message, default=default), key, payloads, fragments), payloads
+
+
+async def encode_sliced(message: Union[Dict[str, Any], list], kinds, key=None,
+                        slice_time: float = 0.005) -> Tuple[str, List[Any]]:
+    """Like encode, returning to the event loop every slice_time seconds."""
+    default, payloads, fragments = _extractor(kinds, key)
+    text = await SlicedJSON.dumps(message, default, slice_time)
+    return _finish(text, key, payloads, fragments), payloads
+
+
+def _extractor(kinds, key):
+    """Return a json default hook moving attachments into a payload list.
+
+    RawJSON values are collected too and left as a marker for _finish.
+    """
+    payloads = []
+    fragments = []
+    codecs = [codec for codec in CODECS if codec.kind in kinds] if key is not None else []
+
+    def default(value):
+        if isinstance(value, RawJSON):
+            fragments.append(value.text)
+            return _RAW_MARK + str(len(fragments) - 1)
+        for codec in codecs:
+            if codec.match(value):
+                meta, payload = codec.encode(value)
+                meta['frame'] = len(payloads)
+                payloads.append(payload)
+                return {'$' + codec.kind: meta}
+        return to_jsonable(value)
+
+    return default, payloads, fragments
+
+
+def _finish(text, key, payloads, fragments=()):
+    if fragments:
+        text = _RAW_PATTERN.sub(lambda match: fragments[int(match.group(1))], text)
+    if payloads:
+        # The count is only known after encoding, so append it to the object,
+        # or as the last element of a compact message list
+        member = ', "bin": ' if text[-1] == '}' else ', '
+        text = text[:-1] + member + json.dumps([key, len(payloads)]) + text[-1]
+    return text
+
+
+def splice(value, frames: Dict[int, memoryview]):
+    """Replace attachment placeholders in a decoded value with their frames."""
+    if isinstance(value, dict):
+        if len(value) == 1:
+            (name, meta), = value.items()
+            if name.startswith('$') and isinstance(meta, dict) and 'frame' in meta:
+                for codec in CODECS:
+                    if name == '$' + codec.kind:
+                        return codec.decode(meta, frames[meta['frame']])
+        for k, v in value.items():
+            value[k] = splice(v, frames)
+    elif isinstance(value, list):
+        for i, v in enumerate(value):
+            value[i] = splice(v, frames)
+    return value
@@ -0,0 +1,59 @@
+"""
+Choosing one of several remotes for a call.
+
+Each JRPC2 keeps what the choice is based on: its requests waiting for an
+answer, an exponentially weighted moving average of their latency, and of
+the round trip of system.ping.
+
+Strategies:
+    least: Fewest requests waiting for an answer, the lower latency on a tie
+    p2c: The less loaded of two remotes picked at random, which spreads calls
+        almost as well as least without every caller piling onto the same
+        remote
+    rtt: Lowest ping round trip, weighted by the requests waiting, so a
+        close remote is preferred until it has a queue. Remotes not yet
+        measured count with the mean round trip of the others.
+"""
+import random
+from typing import List
+
+LEAST = 'least'
+P2C = 'p2c'
+RTT = 'rtt'
+
+
+def load(remote):
+    """Sort key of a remote's load, least loaded first."""
+    return len(remote.requests), remote.latency or 0.0
+
+
+def rtt_load(remote, unmeasured: float = 0.0):
+    """Sort key of a remote's round trip weighted by its load.
+
+    Args:
+        remote: The JRPC2 to rank
+        unmeasured: Round trip assumed for a remote which has none yet
+    """
+    rtt = unmeasured if remote.rtt is None else remote.rtt
+    return rtt * (len(remote.requests) + 1), len(remote.requests)
+
+
+def choose(remotes: List, strategy: str = LEAST, rng=random):
+    """The remote to send a call to.
+
+    Args:
+        remotes: JRPC2 instances exposing the method
+        strategy: 'least', 'p2c' or 'rtt'
+        rng: Source of the random picks for p2c
+    """
+    if len(remotes) == 1:
+        return remotes[0]
+    if strategy == P2C:
+        return min(rng.sample(remotes, 2), key=load)
+    if strategy == RTT:
+        measured = [remote.rtt for remote in remotes if remote.rtt is not None]
+        unmeasured = sum(measured) / len(measured) if measured else 0.0
+        return min(remotes, key=lambda remote: rtt_load(remote, unmeasured))
+    if strategy != LEAST:
+        raise ValueError(f"Unknown balancing strategy {strategy}")
+    return min(remotes, key=load)
@@ -0,0 +1,92 @@
+"""
+Circuit breakers for calls to a remote.
+
+A remote which stopped answering makes each call to it wait for its
+timeout, and every retry leaves another request pending. Each remote's
+CircuitBreaker counts consecutive failed calls: timeouts, requests which
+couldn't be sent and "Server overloaded" answers. Enough of them trip the
+breaker open, and calls to the remote then fail straight away, so fan-out
+calls wait only for the healthy remotes and call_one and call_any choose
+others. After reset_after seconds one probe call is let through, its
+success closes the breaker and its failure opens it again.
+
+Error answers from the method itself show the remote is working and count
+as successes. system.* calls are not counted or refused.
+"""
+import time
+from typing import Any, Dict
+
+from .Admission import OVERLOADED
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_failure(err: Any) -> bool:
+    """Whether an error answer means the remote can't serve calls."""
+    return isinstance(err, dict) and err.get('code') == OVERLOADED
+
+
+class CircuitBreaker:
+    """The health of the calls to one remote.
+
+    Args:
+        failures: Consecutive failed calls which trip the breaker
+        reset_after: Seconds the breaker stays open before a probe call
+    """
+
+    def __init__(self, failures: int = 5, reset_after: float = 5.0):
+        self.threshold = failures
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0      # Consecutive failed calls
+        self.opened = 0.0      # time.monotonic() the breaker last tripped
+        self.probe = None      # time.monotonic() the probe call was let through
+        self.trips = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now, counting it as the probe if half open."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN and now - self.opened >= self.reset_after:
+            self.state = HALF_OPEN
+            self.probe = None
+        # A probe which never finished, cancelled say, is replaced in time
+        if self.state == HALF_OPEN and (self.probe is None or now - self.probe >= self.reset_after):
+            self.probe = now
+            return True
+        self.rejected += 1
+        return False
+
+    def available(self) -> bool:
+        """Whether allow would let a call through, without counting anything."""
+        if self.state == CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == OPEN:
+            return now - self.opened >= self.reset_after
+        return self.probe is None or now - self.probe >= self.reset_after
+
+    def success(self):
+        """Note a call the remote answered."""
+        self.state = CLOSED
+        self.failures = 0
+        self.probe = None
+
+    def failure(self):
+        """Note a call which timed out, couldn't be sent or was refused as overloaded."""
+        self.failures += 1
+        # Calls sent before it tripped may still fail while it is open
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.threshold):
+            self.state = OPEN
+            self.opened = time.monotonic()
+            self.probe = None
+            self.trips += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """The state, consecutive failures, times tripped and calls refused."""
+        return {'state': self.state, 'failures': self.failures,
+                'trips': self.trips, 'rejected': self.rejected}
@@ -0,0 +1,321 @@
+"""
+Caching of exposed method results.
+
+cached memoizes a method per instance and per arguments, with LRU and TTL
+eviction, so repeated identical calls skip the method body. Methods which
+return the same large structure to every caller, configuration or catalog
+data for example, can keep their result encoded with encoded. The cached
+RawJSON is spliced into each response as it is, so a call costs a copy of
+the text instead of a serialization. single_flight shares one execution of
+an async method between concurrent calls with equal arguments.
+
+Hit, miss and eviction counts are served by system.cacheStats.
+
+Methods marked with cacheable are offered to peers during the handshake,
+which keep their results in a ResponseCache. Invalidating a cached method
+pushes system.invalidate to those peers, see JRPCCommon.invalidate.
+"""
+import asyncio
+import inspect
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+from .Attachments import RawJSON
+
+
+def canonical_key(*args, **kwargs) -> str:
+    """A cache key which is equal for equal JSON arguments.
+
+    Dict arguments compare equal whatever their key order.
+
+    Raises:
+        TypeError: An argument is not plain JSON. Its repr is no key, an
+            ndarray's for example leaves out most of its values.
+    """
+    return json.dumps([args, kwargs], sort_keys=True, separators=(',', ':'))
+
+
+class CachedMethod:
+    """A method whose results are cached per instance and per arguments.
+
+    Use the cached, encoded or single_flight decorators to create one.
+    Accessed through an instance it gives a BoundCachedMethod, which is
+    called like the method.
+
+    Args:
+        fn: The method, sync or async
+        maxsize: Most results kept, the least recently used is evicted
+            first. None keeps every result.
+        ttl: Seconds a result is kept, None keeps it until evicted
+        key: Function of the call arguments returning the cache key
+        encode: Keep results encoded as RawJSON
+        single_flight: Concurrent calls of an async method with equal keys
+            share one execution
+        keep: Keep results, False to only share executions
+    """
+
+    def __init__(self, fn: Callable, maxsize: Optional[int] = 128, ttl: Optional[float] = None,
+                 key: Optional[Callable] = None, encode: bool = False,
+                 single_flight: bool = False, keep: bool = True):
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize must be at least 1, or None")
+        self.fn = fn
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.key = key or canonical_key
+        self.encode = encode
+        self.single_flight = single_flight
+        self.keep = keep
+        self.name = fn.__name__
+        self.is_async = inspect.iscoroutinefunction(fn)
+        self.__doc__ = fn.__doc__
+        self.__wrapped__ = fn
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return BoundCachedMethod(self, instance)
+
+
+class _Store:
+    """The cached results of one method of one instance."""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # Key -> (result, expiry time or None), least recently used first
+        self.generation = 0           # Bumped by invalidation, so in flight results are not kept
+        self.inflight = {}            # Key -> task running the method, for single flight
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0            # Calls which joined a running execution
+        self.listeners = []           # Called with the args of invalidated results, None for all
+
+
+class BoundCachedMethod:
+    """A CachedMethod of one instance."""
+
+    def __init__(self, method: CachedMethod, instance):
+        self._method = method
+        self._instance = instance
+        self.__wrapped__ = method.fn.__get__(instance)
+
+    def _store(self) -> _Store:
+        # Each instance keeps its own results, in its __dict__
+        stores = self._instance.__dict__.setdefault('_jrpc_caches', {})
+        store = stores.get(self._method.name)
+        if store is None:
+            store = stores[self._method.name] = _Store()
+        return store
+
+    def __call__(self, *args, **kwargs):
+        key = self._method.key(*args, **kwargs)
+        store = self._store()
+        entry = store.entries.get(key)
+        if entry is not None:
+            if entry[1] is None or entry[1] > time.monotonic():
+                store.entries.move_to_end(key)
+                store.hits += 1
+                return _ready(entry[0]) if self._method.is_async else entry[0]
+            del store.entries[key]
+            store.evictions += 1
+        if self._method.is_async:
+            if self._method.single_flight:
+                return self._call_shared(store, key, args, kwargs)
+            store.misses += 1
+            return self._call_async(store, key, args, kwargs)
+        store.misses += 1
+        result = self._prepare(self._method.fn(self._instance, *args, **kwargs))
+        self._put(store, key, result)
+        return result
+
+    def _call_shared(self, store, key, args, kwargs):
+        task = store.inflight.get(key)
+        if task is not None:
+            store.coalesced += 1
+        else:
+            store.misses += 1
+            task = asyncio.ensure_future(self._call_async(store, key, args, kwargs))
+            store.inflight[key] = task
+
+            def done(task):
+                if store.inflight.get(key) is task:
+                    del store.inflight[key]
+                # Every waiter may have been cancelled, don't leave the error unretrieved
+                if not task.cancelled():
+                    task.exception()
+            task.add_done_callback(done)
+        # A cancelled caller leaves the execution running for the others
+        return asyncio.shield(task)
+
+    async def _call_async(self, store, key, args, kwargs):
+        generation = store.generation
+        result = self._prepare(await self._method.fn(self._instance, *args, **kwargs))
+        # A result computed before an invalidation is returned but not kept
+        if store.generation == generation:
+            self._put(store, key, result)
+        return result
+
+    def _prepare(self, result):
+        if self._method.encode and not isinstance(result, RawJSON):
+            return RawJSON.encode(result)
+        return result
+
+    def _put(self, store, key, result):
+        if not self._method.keep:
+            return
+        ttl = self._method.ttl
+        store.entries[key] = (result, None if ttl is None else time.monotonic() + ttl)
+        store.entries.move_to_end(key)
+        maxsize = self._method.maxsize
+        while maxsize is not None and len(store.entries) > maxsize:
+            store.entries.popitem(last=False)
+            store.evictions += 1
+
+    def invalidate(self, *args, **kwargs) -> bool:
+        """Drop the result cached for these arguments.
+
+        Returns:
+            True if a result was cached
+        """
+        store = self._store()
+        store.generation += 1
+        key = self._method.key(*args, **kwargs)
+        # Later calls start a fresh execution rather than join a stale one
+        store.inflight.pop(key, None)
+        # Remote callers only pass positional arguments
+        self._notify(store, None if kwargs else list(args))
+        return store.entries.pop(key, None) is not None
+
+    def clear(self):
+        """Drop every cached result of this method."""
+        store = self._store()
+        store.generation += 1
+        store.inflight.clear()
+        store.entries.clear()
+        self._notify(store, None)
+
+    def on_invalidate(self, listener: Callable):
+        """Call listener whenever results are invalidated.
+
+        Args:
+            listener: Called with the list of invalidated arguments, or None
+                when every result was dropped
+        """
+        self._store().listeners.append(listener)
+
+    def _notify(self, store, args):
+        for listener in store.listeners:
+            try:
+                listener(args)
+            except Exception as e:
+                print(f"Cache invalidation listener failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counts and the current size.
+
+        misses counts executions of the method, coalesced the calls which
+        shared a running execution instead.
+        """
+        store = self._store()
+        stats = {'hits': store.hits, 'misses': store.misses, 'evictions': store.evictions,
+                 'size': len(store.entries), 'maxsize': self._method.maxsize, 'ttl': self._method.ttl}
+        if self._method.single_flight:
+            stats['coalesced'] = store.coalesced
+        return stats
+
+
+async def _ready(result):
+    return result
+
+
+def cached(fn: Optional[Callable] = None, *, maxsize: Optional[int] = 128,
+           ttl: Optional[float] = None, key: Optional[Callable] = None,
+           single_flight: bool = False):
+    """Memoize a method, repeated identical calls skip its body.
+
+    Results are kept per instance and per arguments. Callers receive the
+    cached object itself, so it must not be modified.
+
+    Call ``obj.method.invalidate(*args)`` or ``obj.method.clear()`` when the
+    data changes, ``obj.method.stats()`` returns the hit and miss counts.
+
+    Args:
+        fn: The method, when used as a bare decorator
+        maxsize: Most results kept, None for no limit
+        ttl: Seconds a result is kept, None for no expiry
+        key: Function of the call arguments returning the cache key,
+            canonical_key by default, which takes plain JSON arguments only
+        single_flight: Calls arriving while an async method computes a
+            result wait for it rather than run the method again
+    """
+    def decorate(fn):
+        return CachedMethod(fn, maxsize, ttl, key, single_flight=single_flight)
+
+    return decorate(fn) if fn is not None else decorate
+
+
+def encoded(fn: Optional[Callable] = None, *, maxsize: Optional[int] = None,
+            ttl: Optional[float] = None, key: Optional[Callable] = None,
+            single_flight: bool = False):
+    """Like cached, keeping results encoded as JSON.
+
+    The first call with some arguments runs the method and encodes its
+    result once. Later calls return the RawJSON, which JRPC2 splices into
+    the response. Results can't carry binary attachments or streams, they
+    are encoded as plain JSON.
+
+    Args:
+        fn: The method, when used as a bare decorator
+        maxsize: Most results kept, None for no limit
+        ttl: Seconds a result is kept, None for no expiry
+        key: Function of the call arguments returning the cache key,
+            canonical_key by default
+        single_flight: See cached
+    """
+    def decorate(fn):
+        return CachedMethod(fn, maxsize, ttl, key, encode=True, single_flight=single_flight)
+
+    return decorate(fn) if fn is not None else decorate
+
+
+def single_flight(fn: Optional[Callable] = None, *, key: Optional[Callable] = None):
+    """Share one execution of an async method between concurrent equal calls.
+
+    A call made while the method runs with equal arguments waits for that
+    execution and receives its result or error, nothing is kept once it
+    finishes. Sync methods can't overlap, they are called as they are.
+
+    Args:
+        fn: The method, when used as a bare decorator
+        key: Function of the call arguments returning the key calls are
+            matched on, canonical_key by default
+    """
+    def decorate(fn):
+        return CachedMethod(fn, None, None, key, single_flight=True, keep=False)
+
+    return decorate(fn) if fn is not None else decorate
+
+
+def cacheable(fn: Optional[Callable] = None, *, ttl: Optional[float] = 60, maxsize: int = 256):
+    """Let remote callers cache a method's results.
+
+    Marked methods are listed to peers during the handshake, which then
+    answer repeated calls from their own cache. Apply it above cached or
+    encoded to push their invalidations to the peers, otherwise call
+    JRPCServer.invalidate when the data changes.
+
+    Args:
+        fn: The method, when used as a bare decorator
+        ttl: Seconds peers keep a result, None until invalidated
+        maxsize: Most results a peer keeps for this method
+    """
+    def mark(fn):
+        fn.jrpc_cacheable = {'ttl': ttl, 'maxsize': maxsize}
+        return fn
+
+    return mark(fn) if fn is not None else mark
@@ -0,0 +1,136 @@
+"""
+permessage-deflate settings for JRPC WebSocket connections.
+
+websockets compresses every message by default, which costs more CPU than it
+saves bandwidth on the many small messages JSON-RPC sends. With a
+Compression the settings the peers agree on during the WebSocket handshake
+still apply, but messages below a size threshold are sent uncompressed.
+RFC 7692 marks each message as compressed or not, so every permessage-deflate
+peer reads them.
+
+The threshold hooks into websockets internals, whose layout is only known
+for websockets 10 and later.
+"""
+from typing import Dict, Optional
+
+try:
+    from websockets.extensions.permessage_deflate import (
+        ClientPerMessageDeflateFactory,
+        PerMessageDeflate,
+        ServerPerMessageDeflateFactory,
+    )
+    from websockets.frames import CONT, DATA_OPCODES
+except ImportError:
+    ClientPerMessageDeflateFactory = PerMessageDeflate = ServerPerMessageDeflateFactory = object
+    CONT = DATA_OPCODES = None
+
+from .Context import sending_method
+
+
+class Compression:
+    """Compression settings for JRPCServer and JRPCClient.
+
+    Args:
+        level: zlib compression level, 1 is fastest, 9 smallest
+        window_bits: Size of the LZ77 window, 9 to 15. Larger windows compress
+            better and take more memory per connection.
+        mem_level: zlib memory level, 1 to 9
+        min_size: Messages smaller than this many bytes are sent uncompressed
+        methods: Maps method names to True to always compress their requests
+            and responses, or False to never compress them, overriding min_size
+    """
+
+    def __init__(self, level: int = 6, window_bits: int = 12, mem_level: int = 5,
+                 min_size: int = 1024, methods: Optional[Dict[str, bool]] = None):
+        if DATA_OPCODES is None:
+            raise ImportError("Compression needs websockets 10 or later, pip install -U websockets")
+        if not 9 <= window_bits <= 15:
+            raise ValueError("window_bits must be between 9 and 15")
+        self.level = level
+        self.window_bits = window_bits
+        self.mem_level = mem_level
+        self.min_size = min_size
+        self.methods = dict(methods or {})
+
+    def should_compress(self, size: int) -> bool:
+        """Return True if a message of size bytes is worth compressing."""
+        forced = self.methods.get(sending_method.get())
+        if forced is not None:
+            return forced
+        return size >= self.min_size
+
+    def server_extensions(self):
+        """Extension factories for websockets.serve."""
+        return [_ServerFactory(self)]
+
+    def client_extensions(self):
+        """Extension factories for websockets.connect."""
+        return [_ClientFactory(self)]
+
+    def _compress_settings(self):
+        return {'level': self.level, 'memLevel': self.mem_level}
+
+
+def websocket_options(compression, server: bool):
+    """Keyword arguments selecting compression for websockets.serve/connect.
+
+    Args:
+        compression: A Compression, True for its default settings, False to
+            turn compression off or None to leave websockets' default
+        server: True for websockets.serve, False for websockets.connect
+    """
+    if compression is None:
+        return {}
+    if compression is True:
+        compression = Compression()
+    if not compression:
+        return {'compression': None}
+    extensions = compression.server_extensions() if server else compression.client_extensions()
+    return {'compression': None, 'extensions': extensions}
+
+
+class _ThresholdDeflate(PerMessageDeflate):
+    """PerMessageDeflate which sends messages the policy skips uncompressed."""
+
+    def __init__(self, extension: PerMessageDeflate, policy: Compression):
+        super().__init__(extension.remote_no_context_takeover, extension.local_no_context_takeover,
+                         extension.remote_max_window_bits, extension.local_max_window_bits,
+                         policy._compress_settings())
+        self.policy = policy
+        self._skipping = False
+
+    def encode(self, frame):
+        if frame.opcode is CONT:
+            # Fragments follow the decision made for the first frame
+            if self._skipping:
+                return frame
+        elif frame.opcode in DATA_OPCODES:
+            self._skipping = not self.policy.should_compress(len(frame.data))
+            if self._skipping:
+                return frame
+        return super().encode(frame)
+
+
+class _ServerFactory(ServerPerMessageDeflateFactory):
+
+    def __init__(self, policy: Compression):
+        super().__init__(server_max_window_bits=policy.window_bits,
+                         client_max_window_bits=policy.window_bits,
+                         compress_settings=policy._compress_settings())
+        self.policy = policy
+
+    def process_request_params(self, params, accepted_extensions):
+        response_params, extension = super().process_request_params(params, accepted_extensions)
+        return response_params, _ThresholdDeflate(extension, self.policy)
+
+
+class _ClientFactory(ClientPerMessageDeflateFactory):
+
+    def __init__(self, policy: Compression):
+        super().__init__(client_max_window_bits=policy.window_bits,
+                         compress_settings=policy._compress_settings())
+        self.policy = policy
+
+    def process_response_params(self, params, accepted_extensions):
+        extension = super().process_response_params(params, accepted_extensions)
+        return _ThresholdDeflate(extension, self.policy)
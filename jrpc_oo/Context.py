@@ -0,0 +1,8 @@
+"""
+Context variables shared by JRPC2 and the transport.
+"""
+import contextvars
+
+# The method a message being transmitted belongs to, for the request method
+# of a response. Lets the transport treat methods differently, see Compression.
+sending_method = contextvars.ContextVar('sending_method', default=None)
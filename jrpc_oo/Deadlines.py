@@ -0,0 +1,77 @@
+"""
+Deadlines carried by requests.
+
+A caller which stops waiting after a few seconds sends its deadline with the
+request, in the meta member. The server answers requests whose deadline has
+passed with an error instead of running them, including requests which
+expire while waiting for an admission slot, so no work is spent on results
+nobody will read.
+
+While a method runs, its deadline is in current_deadline and the calls it
+makes to other remotes carry what is left of it.
+
+On the wire the deadline is the budget in seconds, relative to when the
+request is received, which needs no agreement between the peers' clocks:
+
+    {"meta": {"budget": 1.5}}
+
+An absolute deadline in seconds since the epoch is also accepted:
+
+    {"meta": {"dl": 1767225600.0}}
+"""
+import contextvars
+import math
+import time
+from typing import Any, Dict, Optional
+
+# JSON-RPC error code for requests whose deadline passed before they ran
+DEADLINE_EXCEEDED = -32002
+
+# The time.monotonic() the request being handled must be answered by, None without a deadline
+current_deadline = contextvars.ContextVar('current_deadline', default=None)
+
+
+def time_remaining() -> Optional[float]:
+    """Seconds left to answer the request being handled, None without a deadline."""
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def deadline_error() -> Dict[str, Any]:
+    """The JSON-RPC error object sent for an expired request."""
+    return {'code': DEADLINE_EXCEEDED, 'message': 'Deadline exceeded'}
+
+
+def for_call(options: Dict[str, Any]) -> Optional[float]:
+    """The deadline of a call made now, the earliest of its options' and the inherited one.
+
+    Args:
+        options: The call_options, where timeout is seconds from now and
+            deadline is seconds since the epoch
+    """
+    deadlines = [current_deadline.get()]
+    if options.get('timeout') is not None:
+        deadlines.append(time.monotonic() + options['timeout'])
+    if options.get('deadline') is not None:
+        deadlines.append(time.monotonic() + options['deadline'] - time.time())
+    return min((d for d in deadlines if d is not None), default=None)
+
+
+def from_meta(meta: Any) -> Optional[float]:
+    """The local deadline of a received request, None if it has none."""
+    if not isinstance(meta, dict):
+        return None
+    try:
+        if meta.get('budget') is not None:
+            return time.monotonic() + float(meta['budget'])
+        if meta.get('dl') is not None:
+            return time.monotonic() + float(meta['dl']) - time.time()
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def to_meta(deadline: float) -> Dict[str, float]:
+    """The meta members sending a deadline."""
+    # Whole milliseconds, rounded down so the remote's deadline isn't later
+    return {'budget': math.floor((deadline - time.monotonic()) * 1000) / 1000}
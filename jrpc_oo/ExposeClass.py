@@ -5,6 +5,12 @@ import asyncio
 import inspect
 from typing import Any, Dict, List, Callable, Optional
 
+from .Caching import BoundCachedMethod, CachedMethod
+
+
+def _is_method(member) -> bool:
+    return inspect.isfunction(member) or isinstance(member, CachedMethod)
+
 
 class ExposeClass:
     """Class to expose another class's methods for use with JRPC."""
@@ -36,7 +42,7 @@ class ExposeClass:
             # Get methods that don't start with underscore
             methods = [
                 f"{class_name}.{name}" 
-                for name, method in inspect.getmembers(c, predicate=inspect.isfunction)
+                for name, method in inspect.getmembers(c, predicate=_is_method)
                 if not name.startswith('_')
             ]
             
@@ -80,23 +86,50 @@ class ExposeClass:
                         # For direct calls without args wrapping
                         result = method(params)
                     
-                    # Handle async methods
-                    if asyncio.iscoroutine(result):
+                    # Handle async methods. asyncio.iscoroutine also accepts plain
+                    # generators, which are streamed by JRPC2 rather than awaited
+                    if inspect.isawaitable(result):
                         async def await_and_callback():
                             try:
                                 actual_result = await result
                                 return next_cb(None, actual_result)
+                            except asyncio.CancelledError:
+                                # The caller cancelled the request, release what waits on it
+                                next_cb("Request cancelled", None)
+                                raise
                             except Exception as e:
                                 print(f"Async method failed: {e}")
                                 return next_cb(str(e), None)
-                        asyncio.create_task(await_and_callback())
-                        return  # Don't call next_cb here, it will be called after await
+                        # The task is returned so the request can be cancelled
+                        return asyncio.create_task(await_and_callback())
                         
+                    # Generators and async generators go to next_cb as they are
                     return next_cb(None, result)
                 except Exception as e:
                     print(f"Failed: {e}")
                     return next_cb(str(e), None)
             
+            # Cached methods keep their cache reachable for system.cacheStats
+            member = getattr(cls_instance, method_name)
+            if isinstance(member, BoundCachedMethod):
+                wrapper.cache = member
+            # Methods callers may cache are offered during the handshake
+            definition = getattr(type(cls_instance), method_name, None)
+            cacheable = getattr(definition, 'jrpc_cacheable', None) or \
+                getattr(getattr(definition, '__wrapped__', None), 'jrpc_cacheable', None)
+            if cacheable:
+                wrapper.cacheable = cacheable
+            # The admission lane of the method's requests
+            priority = getattr(definition, 'jrpc_priority', None) or \
+                getattr(getattr(definition, '__wrapped__', None), 'jrpc_priority', None)
+            if priority:
+                wrapper.priority = priority
+            # Callers wait this long for the method's results
+            timeout = getattr(definition, 'jrpc_timeout', None) or \
+                getattr(getattr(definition, '__wrapped__', None), 'jrpc_timeout', None)
+            if timeout:
+                wrapper.timeout = timeout
+
             fns_exp[fn_name] = wrapper
             
         return fns_exp
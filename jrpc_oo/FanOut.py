@@ -0,0 +1,119 @@
+"""
+One call sent to many remotes.
+
+Calling a method on every remote used to build a coroutine, a future and a
+JSON encoding of the arguments for each remote, all at once. A FanOut
+encodes the arguments once, as RawJSON spliced into each remote's request
+which only differs in its id, sends at most window requests at a time and
+collects the answers in one table with one future for the whole call.
+Requests sent as earlier ones are answered carry the caller's context, the
+with_options of the call, like the first window does.
+
+Arguments holding attachment types (bytes, ndarray ...) or streams are
+encoded for each remote, which may negotiate attachments differently.
+Remotes keeping the method's results in their response cache get the
+params decoded, the cache keys its results on them.
+"""
+import asyncio
+import collections
+import contextvars
+import json
+from typing import Any, Dict, Iterable, Optional
+
+from . import Streams
+from .Attachments import RawJSON
+
+
+class RemoteError(Exception):
+    """A remote's error answer in a FanOut's results table.
+
+    Args:
+        error: The JSON-RPC error object or message the remote answered
+    """
+
+    def __init__(self, error):
+        super().__init__(error.get('message', str(error)) if isinstance(error, dict) else str(error))
+        self.error = error
+        self.code = error.get('code') if isinstance(error, dict) else None
+
+
+def shared_params(args: Iterable[Any]):
+    """The params of a call to many remotes, encoded once when they are plain JSON."""
+    params = {'args': list(args)}
+    if any(Streams.is_async_iterable(arg) for arg in params['args']):
+        return params
+    try:
+        # Without a default hook, attachment types raise and keep their frames
+        return RawJSON(json.dumps(params))
+    except (TypeError, ValueError):
+        return params
+
+
+class FanOut:
+    """A call of one method on many remotes, answered into one table.
+
+    Args:
+        method: The method to call
+        params: Its params, see shared_params
+        remotes: JRPC2 instances to call
+        window: Most requests waiting for an answer at once, None for no limit
+    """
+
+    def __init__(self, method: str, params: Any, remotes: Iterable, window: Optional[int] = None):
+        self.method = method
+        self.params = params
+        self.window = window
+        self.waiting = collections.deque(remotes)
+        self.results = dict.fromkeys(remote.uuid for remote in self.waiting)  # In the remotes' order
+        self.outstanding = 0
+        self.done = asyncio.get_running_loop().create_future()
+        self._sending = False
+        self._decoded = None  # The shared params as a dict, for remotes caching the results
+        self._context = contextvars.copy_context()  # The caller's call_options, for every request
+
+    async def run(self) -> Dict[str, Any]:
+        """Send the call to every remote.
+
+        Returns:
+            Remote uuid -> its result, or an Exception for its error, a
+            RemoteError carrying the error object for the remote's answers
+        """
+        self._send()
+        return await self.done
+
+    def _send(self):
+        # Answers arriving straight away, a circuit open say, come back in
+        # here, the outer call carries on instead of recursing
+        if self._sending:
+            return
+        self._sending = True
+        try:
+            while self.waiting and (self.window is None or self.outstanding < self.window):
+                remote = self.waiting.popleft()
+                self.outstanding += 1
+                try:
+                    self._context.run(remote.call, self.method, self._params_for(remote),
+                                      lambda err, result, uuid=remote.uuid: self._answer(uuid, err, result))
+                except Exception as e:
+                    self._answer(remote.uuid, e, None)
+        finally:
+            self._sending = False
+        if not self.waiting and not self.outstanding and not self.done.done():
+            self.done.set_result(self.results)
+
+    def _params_for(self, remote):
+        """The params to send remote, decoded once for response caches which key on them."""
+        cache = remote.response_cache
+        if isinstance(self.params, RawJSON) and cache is not None and self.method in cache:
+            if self._decoded is None:
+                self._decoded = json.loads(self.params.text)
+            return self._decoded
+        return self.params
+
+    def _answer(self, uuid, err, result):
+        self.outstanding -= 1
+        if err:
+            # Local failures keep their type, remote errors their JSON-RPC code
+            result = err if isinstance(err, Exception) else RemoteError(err)
+        self.results[uuid] = result
+        self._send()
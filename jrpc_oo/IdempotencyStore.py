@@ -0,0 +1,155 @@
+"""
+Results of requests sent with an idempotency key.
+
+A client which retries a request after a lost connection or a timeout
+sends the same key, see JRPC2.with_options. The server answers the retry
+with the first attempt's result rather than running the method again.
+
+Keys belong to the caller which sent them and to the request's params.
+A caller reusing a key for different params is answered with an error
+rather than with another request's result.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from . import Attachments
+from . import Streams
+
+# JSON-RPC error code for an idempotency key reused with different params
+KEY_REUSED = -32003
+
+
+def key_reused_error() -> Dict[str, Any]:
+    """The JSON-RPC error object sent for a key reused with different params."""
+    return {'code': KEY_REUSED, 'message': 'Idempotency key reused with different params'}
+
+
+def params_digest(params) -> str:
+    """A digest which is equal for the params of equal requests."""
+    def default(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(value).hexdigest()
+        try:
+            return Attachments.to_jsonable(value)
+        except TypeError:
+            # Streamed arguments are read once, their content can't be compared
+            return type(value).__name__
+    text = json.dumps(params, sort_keys=True, separators=(',', ':'), default=default)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """Results of requests carrying an idempotency key.
+
+    One store is shared by all the remotes of a server. Clients identify
+    themselves during the handshake, so a request retried over a new
+    connection finds the result of the first attempt. A duplicate arriving
+    while the first attempt runs waits for its result, for up to
+    running_ttl seconds, later duplicates run the request again. Errors are
+    not kept, retrying a failed request runs it again.
+
+    Args:
+        maxsize: Most results kept, the least recently used is evicted first
+        ttl: Seconds a result is kept
+        running_ttl: Seconds duplicates join a running attempt
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 300, running_ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.running_ttl = running_ttl
+        self.entries = OrderedDict()  # Key -> (result, expiry time, params digest), least recently used first
+        self.inflight = {}            # Key -> the running attempt, see run
+        self.hits = 0
+        self.joined = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused = 0               # Requests refused for reusing a key with different params
+        self.expired = 0              # Running attempts which stopped taking duplicates
+
+    def run(self, key, params, respond: Callable, execute: Callable):
+        """Answer a request from a kept result, or run it once.
+
+        Args:
+            key: Identifies the request, the caller, the method and its
+                idempotency key
+            params: The request's params, a retry must send equal ones
+            respond: Called with (err, result) to answer this request
+            execute: Runs the method, called with a callback taking
+                (err, result)
+        """
+        digest = params_digest(params)
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                if entry[2] != digest:
+                    self.reused += 1
+                    respond(key_reused_error(), None)
+                    return
+                self.entries.move_to_end(key)
+                self.hits += 1
+                respond(None, entry[0])
+                return
+            del self.entries[key]
+            self.evictions += 1
+
+        attempt = self.inflight.get(key)
+        if attempt is not None:
+            if attempt['digest'] != digest:
+                self.reused += 1
+                respond(key_reused_error(), None)
+                return
+            self.joined += 1
+            attempt['waiting'].append(respond)
+            return
+
+        self.misses += 1
+        attempt = self.inflight[key] = {'digest': digest, 'waiting': [respond], 'timer': None}
+
+        def expire():
+            # The attempt may never answer, later duplicates run the request again
+            if self.inflight.get(key) is attempt:
+                del self.inflight[key]
+                self.expired += 1
+
+        attempt['timer'] = asyncio.get_running_loop().call_later(self.running_ttl, expire)
+
+        def done(err, result):
+            if attempt['timer'] is None:
+                return  # Answered already
+            attempt['timer'].cancel()
+            attempt['timer'] = None
+            current = self.inflight.get(key) is attempt
+            if current:
+                del self.inflight[key]
+            waiting = attempt['waiting']
+            if Streams.is_stream_source(result):
+                # A stream can only be read once, the duplicates are refused
+                waiting[0](err, result)
+                for other in waiting[1:]:
+                    other("Duplicate request for a streamed result", None)
+                return
+            # A newer attempt runs once this one expired, its result is kept instead
+            if not err and current:
+                self._put(key, result, digest)
+            for callback in waiting:
+                callback(err, result)
+
+        execute(done)
+
+    def _put(self, key, result, digest):
+        self.entries[key] = (result, time.monotonic() + self.ttl, digest)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit, join, miss, eviction and refusal counts and the current size."""
+        return {'hits': self.hits, 'joined': self.joined, 'misses': self.misses,
+                'evictions': self.evictions, 'reused': self.reused, 'expired': self.expired,
+                'size': len(self.entries), 'running': len(self.inflight)}
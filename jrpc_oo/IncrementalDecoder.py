@@ -0,0 +1,89 @@
+"""
+Incremental JSON decoding of large inbound messages.
+"""
+import json
+
+from . import SlicedJSON
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+def incremental_available() -> bool:
+    """Return True if a C ijson backend can parse chunks as they arrive.
+
+    The pure Python ijson backend is far slower than json.loads, so it is
+    not used.
+    """
+    return ijson is not None and ijson.backend in ('yajl2_c', 'yajl2_cffi')
+
+
+class IncrementalDecoder:
+    """Decode one JSON document fed in order as a sequence of byte chunks.
+
+    With a C ijson backend each chunk is parsed as it arrives and then
+    dropped. Otherwise the chunks are gathered into one preallocated buffer
+    which is released as soon as it has been decoded to text, before
+    json.loads builds the objects.
+
+    Args:
+        size: Total size of the document in bytes
+        incremental: Parse chunks as they arrive when ijson is available
+    """
+
+    def __init__(self, size: int, incremental: bool = True):
+        self.size = size
+        self.received = 0
+        if incremental and incremental_available():
+            self._objects = ijson.sendable_list()
+            self._parser = ijson.items_coro(self._objects, '', use_float=True)
+            self._buffer = None
+        else:
+            self._parser = None
+            self._buffer = bytearray(size)
+
+    def feed(self, chunk):
+        """Add the next chunk of the document.
+
+        Args:
+            chunk: A bytes-like chunk, chunks must arrive in order
+        """
+        if self._parser is not None:
+            self._parser.send(bytes(chunk))
+        else:
+            self._buffer[self.received:self.received + len(chunk)] = chunk
+        self.received += len(chunk)
+
+    @property
+    def complete(self) -> bool:
+        return self.received >= self.size
+
+    def close(self):
+        """Finish decoding and return the document."""
+        if self._parser is None:
+            return json.loads(self._take_text())
+        return self._close_parser()
+
+    async def aclose(self, slice_time: float = 0.005):
+        """Like close, buffered documents are decoded a slice at a time."""
+        if self._parser is None:
+            return await SlicedJSON.loads(self._take_text(), slice_time)
+        return self._close_parser()
+
+    def _take_text(self):
+        # Release the raw bytes before the objects are built, so they and
+        # the decoded objects are never alive at the same time
+        text = self._buffer.decode('utf-8')
+        self._buffer = None
+        return text
+
+    def _close_parser(self):
+        try:
+            self._parser.close()
+        except ijson.common.IncompleteJSONError as e:
+            raise json.JSONDecodeError(str(e), '', self.received) from e
+        if len(self._objects) != 1:
+            raise json.JSONDecodeError("Expected exactly one JSON document", '', self.received)
+        return self._objects[0]
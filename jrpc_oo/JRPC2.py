@@ -2,11 +2,62 @@
 JSON-RPC 2.0 implementation for WebSockets.
 """
 import asyncio
+import contextlib
+import contextvars
 import inspect
 import json
+import time
 import uuid
+import weakref
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
+from . import Attachments
+from . import Breakers
+from . import Deadlines
+from . import SlicedJSON
+from . import Streams
+from . import Zstd
+from .Context import sending_method
+from .IncrementalDecoder import IncrementalDecoder
+
+# Options for the calls made in this context, see with_options
+call_options = contextvars.ContextVar('call_options', default={})
+
+
+@contextlib.contextmanager
+def with_options(**options):
+    """Set options for the remote calls made inside the with block.
+
+    Options:
+        idempotency_key: Calls retried with the same key run only once on a
+            server keeping an IdempotencyStore, duplicates receive the
+            first call's result
+        priority: 'high' or 'low', the lane the requests wait in on a server
+            with admission limits, overriding the method's own priority
+        timeout: Seconds to wait for the results, the server won't start
+            requests which arrive or wait longer than this
+        deadline: Like timeout, as seconds since the epoch (time.time())
+    """
+    token = call_options.set({**call_options.get(), **options})
+    try:
+        yield
+    finally:
+        call_options.reset(token)
+
+
+# Kinds of message in the compact wire profile, see JRPC2._expand
+REQUEST, RESULT, ERROR = 0, 1, 2
+
+# Marks a request in JRPC2._running which was cancelled before it started
+CANCELLED = object()
+
+# Weight of the newest sample in the latency and round trip averages
+EWMA_WEIGHT = 0.2
+
+
+def _ewma(average, sample):
+    return sample if average is None else average + EWMA_WEIGHT * (sample - average)
+
 
 class JRPC2:
     """JSON-RPC 2.0 implementation for handling RPC calls over WebSockets."""
@@ -18,6 +69,51 @@ class JRPC2:
         self.requests = {}
         self.methods = {}
         self.uuid = str(uuid.uuid4())
+        self.capabilities = {}       # What this side offers, sent during the handshake
+        self.peer_capabilities = {}  # What the remote offered, empty for plain JSON-RPC peers
+        self._bin_seq = 0
+        self._inbound = {}           # Transfer key -> partially received message and its frames
+        self._inbound_bytes = 0      # Bytes of the frames held in _inbound
+        self.max_inbound = 64        # Most messages waiting for their attachment frames at once
+        self.inbound_timeout = 30.0  # Seconds a message waits for its attachment frames
+        self.stream_window = 256     # Items a remote stream may send ahead of consumption
+        self.stream_chunk = 64       # Most items per streamed chunk
+        self.streams_in = weakref.WeakValueDictionary()  # Stream id -> RemoteStream the remote is producing
+        self.streams_out = {}        # Stream id -> StreamProducer we are producing
+        self._stream_seq = 0
+        self.max_transfer = 64 * 2**20  # Most bytes buffered for chunked transfers on this connection
+        self._chunks = {}            # Chunked transfer id -> reassembly buffer
+        self._chunk_bytes = 0
+        self._rejected = {}          # Refused chunked transfer id -> time.monotonic() it was refused
+        self.incremental_threshold = None  # Chunked JSON at least this large is parsed as it arrives, None to buffer it
+        self.slice_threshold = 2**20  # Messages at least this large are encoded and decoded in slices, 0 disables
+        self.slice_time = 0.005      # Seconds of encoding or decoding between returns to the event loop
+        self._decoding = None        # Last queued decode, later messages wait for it to keep their order
+        self.zstd = None             # ZstdCodec compressing small messages for peers which negotiate it
+        self.capture = None          # Called with each JSON text message sent or received, see Zstd.TrafficCapture
+        self._next_id = 0            # Last integer request id, used in the compact profile
+        self._method_ids = {}        # Method name -> index in the remote's method table
+        self._method_names = []      # Our method table, append only so each method keeps its id
+        self._method_index = {}      # Method name -> its id in _method_names
+        self.response_cache = None   # ResponseCache.ResponseCache of the remote's cacheable methods
+        self.idempotency = None      # IdempotencyStore.IdempotencyStore answering retried requests
+        self.admission = None        # Admission.Admission limiting the requests run at once
+        self.method_timeouts = {}    # Method -> seconds to wait for its results instead of remote_timeout
+        self.adaptive_timeouts = None  # Timeouts.AdaptiveTimeouts learning timeouts from latency
+        self._running = {}           # Id of each request being handled -> the task running it, if any
+        self.latency = None          # Moving average of our calls' latency in seconds, see Balancing
+        self.rtt = None              # Moving average of the system.ping round trip in seconds
+        self.last_ping = 0.0         # time.monotonic() of the last ping
+        self.breaker = None          # Breakers.CircuitBreaker failing calls fast while the remote is failing
+        # Internal notifications, handled here rather than exposed as methods
+        self._control = {
+            'system.streamData': self._on_stream_data,
+            'system.streamEnd': self._on_stream_end,
+            'system.streamCredit': self._on_stream_credit,
+            'system.streamCancel': self._on_stream_cancel,
+            'system.invalidate': self._on_invalidate,
+            'system.cancel': self._on_cancel,
+        }
     
     def set_transmitter(self, transmitter: Callable):
         """Set the function used to transmit messages.
@@ -39,13 +135,28 @@ class JRPC2:
         """Initialize capabilities after setup."""
         # Add system.listComponents method - expose method names for discovery
         def list_components(params, next_cb):
-            # Print the methods keys for debugging
-            methods_list = list(self.methods.keys())
-            # Return as a dictionary with method names as keys for compatibility with JS Object.keys()
-            methods_dict = {method: True for method in methods_list}
-            return next_cb(None, methods_dict)
+            # Return as a dictionary with method names as keys for compatibility with JS Object.keys(),
+            # the values are the ids compact requests name the methods by
+            return next_cb(None, self.method_ids())
             
         self.methods["system.listComponents"] = list_components
+
+        def capabilities(params, next_cb):
+            # Answered before taking the remote's capabilities, so the answer is plain JSON-RPC
+            # which the remote reads before it has negotiated anything
+            next_cb(None, self.capabilities)
+            if isinstance(params, dict):
+                self.peer_capabilities = params
+
+        self.methods["system.capabilities"] = capabilities
+
+        def cache_stats(params, next_cb):
+            # Methods exposed with Caching.cached carry their cache
+            return next_cb(None, {name: fn.cache.stats() for name, fn in self.methods.items()
+                                  if hasattr(fn, 'cache')})
+
+        self.methods["system.cacheStats"] = cache_stats
+        self.methods["system.ping"] = lambda params, next_cb: next_cb(None, True)
         
         # Define empty methods dictionary if none exists
         if not hasattr(self, 'rpcs'):
@@ -58,60 +169,796 @@ class JRPC2:
             method: The method name to call.
             params: Parameters to pass to the method.
             callback: Function to call with results or error.
+
+        Returns:
+            The request id, to cancel the call, None if no request was sent.
         """
-        request_id = str(uuid.uuid4())
-        request = {
-            'jsonrpc': '2.0',
-            'method': method,
-            'params': params,
-            'id': request_id
-        }
+        args = params.get('args') if isinstance(params, dict) else None
+        if isinstance(args, list) and any(Streams.is_async_iterable(arg) for arg in args):
+            if not self.streaming():
+                # The remote can't receive a stream, send all the items at once
+                async def collect_and_call():
+                    try:
+                        collected = [await Streams.collect(arg) if Streams.is_async_iterable(arg) else arg
+                                     for arg in args]
+                    except Exception as e:
+                        callback(Exception(f"Failed to read stream argument: {e}"), None)
+                        return
+                    self.call(method, dict(params, args=collected), callback)
+                asyncio.create_task(collect_and_call())
+                return None
+            params, callback = self._stream_args(params, callback)
+        elif self.response_cache is not None and method in self.response_cache and \
+                not isinstance(params, Attachments.RawJSON):
+            key = self.response_cache.key(params)
+            # Params which are not plain JSON, such as attachments, are not cached
+            if key is not None:
+                hit, result = self.response_cache.get(method, key)
+                if hit:
+                    callback(None, result)
+                    return None
+                callback = self.response_cache.filler(method, key, callback)
+
+        # A deadline set in with_options or inherited from the request being handled
+        deadline = Deadlines.for_call(call_options.get())
+        timeout = self.method_timeout(method)
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+            if timeout <= 0:
+                callback(Exception(f"Deadline exceeded before calling {method}"), None)
+                return None
 
-        self.requests[request_id] = callback
+        breaker = self.breaker if not method.startswith('system.') else None
+        if breaker is not None and not breaker.allow():
+            callback(Exception(f"Circuit open, the remote is failing: {method}"), None)
+            return None
+
+        meta = self._request_meta(deadline)
+        if self.compact():
+            self._next_id += 1
+            request_id = self._next_id
+            request = [REQUEST, request_id, self._method_ids.get(method, method), params]
+            if meta:
+                request.append(meta)
+        else:
+            request_id = str(uuid.uuid4())
+            request = {
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params,
+                'id': request_id
+            }
+            if meta:
+                request['meta'] = meta
+
+        system = method.startswith('system.')
+        sent = time.monotonic()
+
+        def answered(err, result):
+            expiry.cancel()
+            if not system:
+                self._observe(method, time.monotonic() - sent)
+            if breaker is not None and Breakers.is_failure(err):
+                breaker.failure()
+            elif breaker is not None:
+                breaker.success()
+            callback(err, result)
+
+        def expire():
+            if request_id in self.requests:
+                del self.requests[request_id]
+                if not system:
+                    # Lengthens a learned timeout which cuts off slow calls
+                    self._observe(method, timeout)
+                if breaker is not None:
+                    breaker.failure()
+                callback(Exception(f"Request timeout after {round(timeout, 3)}s for method: {method}"), None)
+
+        # A timer cancelled by the answer, rather than a task sleeping out the timeout
+        expiry = asyncio.get_running_loop().call_later(timeout, expire)
+        self.requests[request_id] = answered
         
         def next_cb(error):
             if error:
+                expiry.cancel()
                 if request_id in self.requests:
                     del self.requests[request_id]
+                if breaker is not None:
+                    breaker.failure()
                 callback(Exception(f"Failed to send request: {error}"), None)
         
-        asyncio.create_task(self._transmit_message(json.dumps(request), next_cb))
-        
-        # Schedule timeout cleanup
-        async def timeout_handler():
-            await asyncio.sleep(self.remote_timeout)
+        def encode_failed(e):
+            expiry.cancel()
             if request_id in self.requests:
-                cb = self.requests.pop(request_id)
-                cb(Exception(f"Request timeout after {self.remote_timeout}s for method: {method}"), None)
-        
-        asyncio.create_task(timeout_handler())
+                del self.requests[request_id]
+            callback(Exception(f"Failed to encode request: {e}"), None)
+
+        self._send(request, next_cb, encode_failed, {'req': request_id}, method)
+        return request_id
+
+    def ping(self) -> Optional[Any]:
+        """Measure the round trip to the remote with system.ping, updating rtt.
+
+        Returns:
+            The request id of the ping
+        """
+        self.last_ping = sent = time.monotonic()
+
+        def pong(err, result):
+            # A lost ping counts with the time it waited
+            self.rtt = _ewma(self.rtt, time.monotonic() - sent)
+        return self.call('system.ping', [], pong)
+
+    def _observe(self, method, seconds):
+        """Note the latency of a completed or timed out call."""
+        self.latency = _ewma(self.latency, seconds)
+        if self.adaptive_timeouts is not None:
+            self.adaptive_timeouts.record(method, seconds)
+
+    def cancel(self, request_id):
+        """Stop waiting for a call's results and ask the remote to stop running it.
+
+        The call's callback isn't called. Remotes which don't offer cancel
+        run the request to the end.
+
+        Args:
+            request_id: The id returned by call
+        """
+        if self.requests.pop(request_id, None) is not None and self.peer_capabilities.get('cancel'):
+            self.notify('system.cancel', {'id': request_id})
     
-    async def _transmit_message(self, message, next_cb):
+    def notify(self, method: str, params: Any) -> Optional[asyncio.Task]:
+        """Send a notification, a request which expects no response.
+
+        Args:
+            method: The method name to call.
+            params: Parameters to pass to the method.
+
+        Returns:
+            The task sending the notification, await it to know it went out.
+        """
+        if self.compact():
+            notification = [REQUEST, None, self._method_ids.get(method, method), params]
+        else:
+            notification = {
+                'jsonrpc': '2.0',
+                'method': method,
+                'params': params
+            }
+
+        def next_cb(err):
+            if err:
+                print(f"Failed to send notification {method}: {err}")
+
+        def encode_failed(e):
+            print(f"Failed to encode notification {method}: {e}")
+
+        return self._send(notification, next_cb, encode_failed, None, method)
+
+    def method_timeout(self, method: str) -> float:
+        """Seconds to wait for the results of a call to a method.
+
+        The caller's method_timeouts come first, then the timeout the remote
+        offered for the method, then remote_timeout. A timeout learned by
+        adaptive_timeouts may shorten it.
+        """
+        offered = self.peer_capabilities.get('timeouts')
+        timeout = self.method_timeouts.get(method) or \
+            (offered.get(method) if isinstance(offered, dict) else None) or self.remote_timeout
+        if self.adaptive_timeouts is not None:
+            learned = self.adaptive_timeouts.timeout(method)
+            if learned is not None:
+                timeout = min(timeout, learned)
+        return timeout
+
+    def compact(self) -> bool:
+        """Return True if both sides negotiated the compact wire profile."""
+        return bool(self.capabilities.get('compact') and self.peer_capabilities.get('compact'))
+
+    def streaming(self) -> bool:
+        """Return True if both sides negotiated streamed results and arguments."""
+        return bool(self.capabilities.get('streams') and self.peer_capabilities.get('streams'))
+
+    def set_method_ids(self, components: Dict[str, Any]):
+        """Intern the remote's methods to their id in its method table.
+
+        Compact requests then name a method by its id. Peers which list
+        their methods without ids are called by name.
+
+        Args:
+            components: The remote's system.listComponents result, method
+                name -> id
+        """
+        self._method_ids = {name: index for name, index in components.items() if type(index) is int}
+
+    def method_ids(self) -> Dict[str, int]:
+        """Our methods and the ids the remote's compact requests name them by.
+
+        A method keeps its id for the life of the connection, also when it is
+        removed and exposed again, so ids the remote learnt never change meaning.
+        """
+        for name in self.methods:
+            if name not in self._method_index:
+                self._method_index[name] = len(self._method_names)
+                self._method_names.append(name)
+        return {name: self._method_index[name] for name in self.methods}
+
+    def _request_meta(self, deadline: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """The request's meta member from call_options, for peers which take it."""
+        if not self.peer_capabilities.get('meta'):
+            return None
+        options = call_options.get()
+        meta = Deadlines.to_meta(deadline) if deadline is not None else {}
+        if options.get('idempotency_key') is not None:
+            meta['idem'] = str(options['idempotency_key'])
+        if options.get('priority') is not None:
+            meta['prio'] = options['priority']
+        return meta
+
+    def close(self):
+        """Release streams when the connection to the remote is gone."""
+        for stream in list(self.streams_in.values()):
+            stream.end("Remote disconnected")
+        for producer in list(self.streams_out.values()):
+            producer.cancel()
+        self.streams_out.clear()
+        if self._decoding is not None:
+            self._decoding.cancel()
+            self._decoding = None
+        if self.admission is not None:
+            self.admission.drop(self.uuid)
+        for entry in self._inbound.values():
+            entry['timer'].cancel()
+        self._inbound.clear()
+        self._inbound_bytes = 0
+        self._chunks.clear()
+        self._chunk_bytes = 0
+        self._rejected.clear()
+
+    def _stream_args(self, params, callback):
+        """Replace async iterator arguments with streams produced from them.
+
+        Args:
+            params: Request params with an 'args' list
+            callback: The request callback
+
+        Returns:
+            (params, callback) where the callback stops the producers the
+            remote didn't read to the end once the request completes
+        """
+        producers = []
+        args = []
+        for arg in params['args']:
+            if Streams.is_async_iterable(arg):
+                self._stream_seq += 1
+                producer = Streams.StreamProducer(self, self._stream_seq, arg, self.stream_chunk)
+                self.streams_out[producer.stream_id] = producer
+                producer.start()
+                producers.append(producer)
+                arg = {'$stream': producer.stream_id}
+            args.append(arg)
+
+        def stream_callback(err, result):
+            # A method returning without reading its stream, or failing, leaves
+            # the producer waiting for credit which never comes. A streamed
+            # result may still be reading it, the remote cancels it when done.
+            if err or not isinstance(result, Streams.RemoteStream):
+                for producer in producers:
+                    if self.streams_out.get(producer.stream_id) is producer:
+                        del self.streams_out[producer.stream_id]
+                        producer.cancel()
+            callback(err, result)
+
+        return dict(params, args=args), stream_callback
+
+    def _send(self, message, next_cb, encode_failed, transfer=None, method=None) -> Optional[asyncio.Task]:
+        """Encode and transmit a message.
+
+        Messages estimated at slice_threshold bytes or more are encoded a
+        slice at a time, so small messages keep flowing in the meantime.
+
+        Args:
+            message: The JSON-RPC message dict, or a compact message list
+            next_cb: Callback after transmission
+            encode_failed: Called with the TypeError if message can't be encoded
+            transfer: {'req': id} or {'res': id}, see _transmit_message
+            method: The method of the request, or the request a response is for
+
+        Returns:
+            The task sending the message, None if it could not be encoded
+        """
+        if self.slice_threshold and \
+                SlicedJSON.estimate_size(message, self.slice_threshold) >= self.slice_threshold:
+            async def encode_and_transmit():
+                try:
+                    text, frames = await self._encode_sliced(message)
+                except TypeError as e:
+                    encode_failed(e)
+                    return
+                await self._transmit_message(text, next_cb, frames, transfer, method)
+            return asyncio.create_task(encode_and_transmit())
+
+        try:
+            text, frames = self._encode(message)
+        except TypeError as e:
+            encode_failed(e)
+            return None
+        return asyncio.create_task(self._transmit_message(text, next_cb, frames, transfer, method))
+
+    def _encode(self, message):
+        """Encode a message for the wire.
+
+        Attachment types the peer negotiated are moved out of band into binary
+        frames, everything else is plain JSON.
+
+        Args:
+            message: The JSON-RPC message dict
+
+        Returns:
+            (text, frames) where frames are binary frames to send after text
+        """
+        kinds, key = self._attachment_key()
+        text, payloads = Attachments.encode(message, kinds, key)
+        return text, self._frames(key, payloads)
+
+    async def _encode_sliced(self, message):
+        """Like _encode, returning to the event loop between slices."""
+        kinds, key = self._attachment_key()
+        text, payloads = await Attachments.encode_sliced(message, kinds, key, self.slice_time)
+        return text, self._frames(key, payloads)
+
+    def _attachment_key(self):
+        kinds = self.peer_capabilities.get('attachments') or ()
+        key = None
+        if kinds:
+            self._bin_seq += 1
+            key = self._bin_seq
+        return kinds, key
+
+    def _frames(self, key, payloads):
+        return [Attachments.pack_frame({'key': key, 'i': i}, payload) for i, payload in enumerate(payloads)]
+
+    async def _transmit_message(self, message, next_cb, frames=(), transfer=None, method=None):
         """Handle message transmission with proper awaiting for async transmitters.
         
         Args:
             message: The JSON message to send
             next_cb: Callback after transmission
+            frames: Binary attachment frames which follow the message
+            transfer: {'req': id} or {'res': id}, lets the remote reject an
+                oversized chunked transfer against the right request
+            method: The method the message belongs to, see sending_method
         """
+        # Each task has its own context, this only applies to this message
+        sending_method.set(method)
         try:
+            if isinstance(message, str):
+                if self.capture is not None:
+                    self.capture(message)
+                message = self._compress(message)
             if callable(self.transmitter):
-                if inspect.iscoroutinefunction(self.transmitter):
-                    await self.transmitter(message, next_cb)
-                else:
-                    self.transmitter(message, next_cb)
+                failed = False
+
+                def frame_cb(err):
+                    nonlocal failed
+                    failed = failed or bool(err)
+
+                async def send(data):
+                    if inspect.iscoroutinefunction(self.transmitter):
+                        await self.transmitter(data, frame_cb)
+                    else:
+                        self.transmitter(data, frame_cb)
+
+                limit = self._chunk_limit()
+                # permessage-deflate compresses each frame inside the transmitter's
+                # send, return to the event loop between frames once a slice is used
+                clock = SlicedJSON._Clock(self.slice_time)
+                # The message and its frames go out from this one task, in order
+                for data in (message, *frames):
+                    text = isinstance(data, str)
+                    raw = data
+                    if limit and text and len(data) > limit // 4:
+                        # UTF-8 takes up to 4 bytes a character, shorter text can't be over the limit
+                        raw = data.encode('utf-8')
+                    if limit and not isinstance(raw, str) and len(raw) > limit:
+                        await self._send_chunked(raw, text, limit, transfer, send, clock)
+                    else:
+                        await send(data)
+                        await clock.tick()
+                    if failed:
+                        break
+                next_cb(failed)
         except Exception as e:
             print(f"Error in _transmit_message: {e}")
             next_cb(True)
+
+    def _compress(self, text):
+        """zstd compress a JSON text message if the remote negotiated it.
+
+        The dictionary is only used when the remote loaded the same one.
+        """
+        peer = self.peer_capabilities.get('zstd')
+        if self.zstd is None or not isinstance(peer, dict):
+            return text
+        if len(text) > self.zstd.max_size:
+            # Each character is at least a byte, don't encode text zstd won't take
+            return text
+        with_dict = self.zstd.dict_id != 0 and peer.get('dict') == self.zstd.dict_id
+        compressed = self.zstd.compress(text.encode('utf-8'), with_dict)
+        return text if compressed is None else compressed
+
+    def _chunk_limit(self):
+        """Largest frame the remote accepts, None if it doesn't take chunks."""
+        chunks = self.peer_capabilities.get('chunks')
+        if not chunks or not chunks.get('max_frame'):
+            return None
+        # Leave room for the chunk frame header
+        return max(chunks['max_frame'] - 1024, 1024)
+
+    async def _send_chunked(self, data, text, limit, transfer, send, clock):
+        """Send one message or frame as a sequence of chunk frames.
+
+        Args:
+            data: The UTF-8 JSON text or binary frame which is too large
+            text: Whether data is JSON text
+            limit: The largest chunk payload to send
+            transfer: Request or response id the data belongs to
+            send: Coroutine function sending one frame
+            clock: Slice clock ticked after each frame, so compressing a large
+                transfer holds the event loop for one frame at a time
+        """
+        view = memoryview(data)
+        self._bin_seq += 1
+        header = {'chunk': self._bin_seq, 'size': view.nbytes, 'text': text}
+        if transfer:
+            header.update(transfer)
+        for offset in range(0, view.nbytes, limit):
+            header['off'] = offset
+            await send(Attachments.pack_frame(header, view[offset:offset + limit]))
+            await clock.tick()
     
-    def receive(self, message_str: str):
+    def receive(self, message_str: Union[str, bytes]):
         """Process a received message.
         
         Args:
-            message_str: The message string received from remote.
+            message_str: The message string received from remote, a binary
+                frame carrying an attachment or a zstd compressed message.
+        """
+        try:
+            if isinstance(message_str, (bytes, bytearray, memoryview)):
+                if Attachments.is_frame(message_str):
+                    self._receive_frame(message_str)
+                    return
+                if isinstance(message_str, memoryview):
+                    message_str = message_str.tobytes()
+                if Zstd.is_compressed(message_str):
+                    if self.zstd is None:
+                        raise ValueError("zstd message received but zstd was not negotiated")
+                    message_str = self.zstd.decompress(message_str, self.max_transfer)
+
+            if self.capture is not None:
+                self.capture(message_str)
+
+            if self.slice_threshold and len(message_str) >= self.slice_threshold:
+                self._decode_in_order(lambda: SlicedJSON.loads(message_str, self.slice_time))
+                return
+
+            # json.loads reads bytes directly, there is no need to decode them to a str first
+            self._handle_in_order(json.loads(message_str))
+
+        except json.JSONDecodeError:
+            print(f"Error decoding JSON message: {message_str[:200]!r}")
+        except Exception as e:
+            print(f"Error processing message: {e}")
+
+    def _handle_in_order(self, message):
+        """Handle a decoded message which arrived while others may be decoding.
+
+        Requests and responses carry an id and are handled straight away, so
+        small calls are not held up by a large message. Notifications, such as
+        the chunks of a stream, wait for the messages which arrived before them.
+
+        Args:
+            message: The decoded JSON-RPC message.
+        """
+        message = self._expand(message)
+        if self._decoding is not None and isinstance(message, dict) and 'id' not in message:
+            async def decoded():
+                return message
+            self._decode_in_order(decoded)
+        else:
+            self._handle_message(message)
+
+    def _decode_in_order(self, decode):
+        """Decode a message without blocking the event loop.
+
+        Notifications arriving meanwhile are queued behind it, see
+        _handle_in_order.
+
+        Args:
+            decode: Coroutine function returning the decoded message
+        """
+        previous = self._decoding
+
+        async def decode_and_handle():
+            try:
+                if previous is not None:
+                    await previous
+                self._handle_message(self._expand(await decode()))
+            except json.JSONDecodeError as e:
+                print(f"Error decoding JSON message: {e}")
+            except Exception as e:
+                print(f"Error processing message: {e}")
+            finally:
+                if self._decoding is task:
+                    self._decoding = None
+
+        task = asyncio.create_task(decode_and_handle())
+        self._decoding = task
+
+    def _expand(self, message):
+        """Turn a compact message back into a JSON-RPC message dict.
+
+        Compact messages are lists, a request or notification is
+        [0, id, method, params], a response [1, id, result] and an error
+        [2, id, error]. A null id marks a notification and method is an
+        id from our method table, see method_ids, or a method name. A request's meta
+        object may follow its params, and messages with attachments carry
+        their [key, count] as an extra last element.
+
+        Args:
+            message: A decoded message
+
+        Returns:
+            The message dict, other messages are returned unchanged
+
+        Raises:
+            ValueError: A compact message before the profile was negotiated
+        """
+        if not isinstance(message, list) or not message or type(message[0]) is not int:
+            return message
+        if not self.compact():
+            raise ValueError("Compact message received but the compact profile was not negotiated")
+        kind, request_id = message[0], message[1]
+        if kind == REQUEST:
+            method = message[2]
+            if isinstance(method, int):
+                if not 0 <= method < len(self._method_names):
+                    # Methods exposed since the table was last listed
+                    self.method_ids()
+                # An id we don't have is answered with method not found
+                method = self._method_names[method] if 0 <= method < len(self._method_names) else f"#{method}"
+            expanded = {'jsonrpc': '2.0', 'method': method, 'params': message[3]}
+            if request_id is not None:
+                expanded['id'] = request_id
+            extra = message[4:]
+        elif kind in (RESULT, ERROR):
+            expanded = {'jsonrpc': '2.0', 'id': request_id,
+                        'result' if kind == RESULT else 'error': message[2]}
+            extra = message[3:]
+        else:
+            raise ValueError(f"Unknown compact message kind {kind}")
+        for member in extra:
+            expanded['meta' if isinstance(member, dict) else 'bin'] = member
+        return expanded
+
+    def _handle_message(self, message):
+        """Hold a decoded message until its attachments arrive, then dispatch it.
+
+        Args:
+            message: The decoded JSON-RPC message.
+        """
+        if isinstance(message, dict) and 'bin' in message:
+            key, count = message.pop('bin')
+            entry = self._inbound_entry(key)
+            if entry is None:
+                self._fail_inbound(message, "Too many messages waiting for attachment frames")
+                return
+            entry['message'] = message
+            entry['count'] = count
+            self._complete_transfer(key)
+            return
+
+        self._dispatch(message)
+
+    def _receive_frame(self, data):
+        """Store a binary attachment frame until its message is complete.
+
+        Args:
+            data: The received binary frame
+        """
+        header, payload = Attachments.unpack_frame(data)
+        if 'chunk' in header:
+            self._receive_chunk(header, payload)
+            return
+        key = header['key']
+        entry = self._inbound_entry(key)
+        if entry is None:
+            print(f"Dropped attachment frame {key!r}, too many messages waiting for frames")
+            return
+        if self._inbound_bytes + payload.nbytes > self.max_transfer:
+            self._drop_inbound(key, f"Attachments exceed the transfer limit of {self.max_transfer} bytes")
+            return
+        if header['i'] not in entry['frames']:
+            entry['frames'][header['i']] = payload
+            entry['bytes'] += payload.nbytes
+            self._inbound_bytes += payload.nbytes
+        self._complete_transfer(key)
+
+    def _inbound_entry(self, key):
+        """The partially received message for a transfer key, None if there are too many.
+
+        A message whose frames don't all arrive within inbound_timeout, or
+        frames whose message never arrives, are dropped.
+
+        Args:
+            key: The transfer key chosen by the remote
+        """
+        entry = self._inbound.get(key)
+        if entry is None:
+            if len(self._inbound) >= self.max_inbound:
+                return None
+            timer = asyncio.get_running_loop().call_later(
+                self.inbound_timeout, self._drop_inbound, key, "Attachment frames did not arrive in time")
+            entry = self._inbound[key] = {'frames': {}, 'bytes': 0, 'timer': timer}
+        return entry
+
+    def _drop_inbound(self, key, error):
+        """Forget a message waiting for its frames, failing its request or response.
+
+        Args:
+            key: The transfer key of the message
+            error: Why it was dropped
+        """
+        entry = self._inbound.pop(key, None)
+        if entry is None:
+            return
+        entry['timer'].cancel()
+        self._inbound_bytes -= entry['bytes']
+        print(f"Dropped attachment transfer {key!r}: {error}")
+        if 'message' in entry:
+            self._fail_inbound(entry['message'], error)
+
+    def _fail_inbound(self, message, error):
+        """Answer a request, or fail our call, whose attachments were dropped."""
+        if 'method' in message and message.get('id') is not None:
+            self._send_error(message['id'], error)
+        elif message.get('id') in self.requests:
+            self.requests.pop(message['id'])(Exception(error), None)
+
+    def _receive_chunk(self, header, payload):
+        """Reassemble a message which was too large for one frame.
+
+        Transfers are refused on their first chunk if they would take this
+        connection's reassembly buffers past max_transfer bytes.
+
+        Args:
+            header: The chunk frame header
+            payload: The chunk's part of the message
+        """
+        xid = header['chunk']
+        if xid in self._rejected:
+            if header['off'] + payload.nbytes >= header['size']:
+                del self._rejected[xid]
+            return
+
+        entry = self._chunks.get(xid)
+        size = header['size']
+        if entry is None:
+            if self._chunk_bytes + size > self.max_transfer:
+                if header['off'] + payload.nbytes < size:
+                    self._reject_rest(xid)
+                self._reject_transfer(header)
+                return
+            if header['text']:
+                # JSON text is decoded as it arrives rather than buffered whole
+                incremental = self.incremental_threshold is not None and size >= self.incremental_threshold
+                entry = IncrementalDecoder(size, incremental=incremental)
+            else:
+                entry = {'buffer': bytearray(size), 'received': 0}
+            self._chunks[xid] = entry
+            self._chunk_bytes += size
+
+        if isinstance(entry, IncrementalDecoder):
+            try:
+                if header['off'] != entry.received:
+                    raise ValueError(f"chunk at {header['off']} arrived out of order")
+                entry.feed(payload)
+            except Exception as e:
+                print(f"Error decoding chunked message: {e}")
+                self._drop_transfer(xid, header)
+                if header['off'] + payload.nbytes < size:
+                    self._reject_rest(xid)
+                return
+            if not entry.complete:
+                return
+            self._drop_transfer(xid, header)
+            if self.slice_threshold and size >= self.slice_threshold:
+                self._decode_in_order(lambda: entry.aclose(self.slice_time))
+            else:
+                self._handle_in_order(entry.close())
+            return
+
+        offset = header['off']
+        if not (isinstance(offset, int) and 0 <= offset and offset + payload.nbytes <= size):
+            # Slice assignment past the end would grow the buffer beyond size
+            print(f"Chunk at {offset} of {payload.nbytes} bytes is outside its {size} byte transfer")
+            self._drop_transfer(xid, header)
+            self._reject_rest(xid)
+            return
+        entry['buffer'][offset:offset + payload.nbytes] = payload
+        entry['received'] += payload.nbytes
+        if entry['received'] < size:
+            return
+
+        self._drop_transfer(xid, header)
+        # An attachment frame, or a compressed message
+        self.receive(entry['buffer'])
+
+    def _reject_rest(self, xid):
+        """Drop the remaining chunks of a transfer.
+
+        Refused transfers are remembered for inbound_timeout seconds, at most
+        max_inbound of them, in case their last chunk never arrives.
+
+        Args:
+            xid: The chunked transfer id
+        """
+        now = time.monotonic()
+        self._rejected[xid] = now
+        while self._rejected and (len(self._rejected) > self.max_inbound or
+                                  next(iter(self._rejected.values())) < now - self.inbound_timeout):
+            del self._rejected[next(iter(self._rejected))]
+
+    def _drop_transfer(self, xid, header):
+        """Forget a chunked transfer which completed or failed.
+
+        Args:
+            xid: The chunked transfer id
+            header: A chunk header of the transfer
+        """
+        if self._chunks.pop(xid, None) is not None:
+            self._chunk_bytes -= header['size']
+
+    def _reject_transfer(self, header):
+        """Refuse a chunked transfer which exceeds the reassembly limit.
+
+        Args:
+            header: The first received chunk header of the transfer
+        """
+        error = (f"Message of {header['size']} bytes exceeds the transfer limit "
+                 f"of {self.max_transfer} bytes")
+        print(error)
+        if 'req' in header:
+            self._send_error(header['req'], error)
+        elif 'res' in header and header['res'] in self.requests:
+            self.requests.pop(header['res'])(Exception(error), None)
+
+    def _complete_transfer(self, key):
+        """Dispatch a message once all of its attachment frames have arrived.
+
+        Args:
+            key: The transfer key of the message
+        """
+        entry = self._inbound[key]
+        if 'message' not in entry or len(entry['frames']) < entry['count']:
+            return
+        del self._inbound[key]
+        entry['timer'].cancel()
+        self._inbound_bytes -= entry['bytes']
+        message = entry['message']
+        for field in ('params', 'result'):
+            if field in message:
+                message[field] = Attachments.splice(message[field], entry['frames'])
+        self._dispatch(message)
+
+    def _dispatch(self, message):
+        """Act on a decoded message, either a response or a request.
+
+        Args:
+            message: The decoded JSON-RPC message.
         """
         try:
-            message = json.loads(message_str)
-            
             # Handle response (need parentheses for correct operator precedence)
             if 'id' in message and ('result' in message or 'error' in message):
                 request_id = message.get('id')
@@ -122,7 +969,10 @@ class JRPC2:
                     if 'error' in message:
                         callback(message['error'], None)
                     else:
-                        callback(None, message['result'])
+                        result = message['result']
+                        if isinstance(result, dict) and '$stream' in result and self.streaming():
+                            result = Streams.RemoteStream(self, result['$stream'], self.stream_window)
+                        callback(None, result)
             
             # Handle request
             elif 'method' in message:
@@ -130,66 +980,199 @@ class JRPC2:
                 params = message.get('params', {})
                 request_id = message.get('id')  # May be None for notifications
                 
+                if method in self._control and request_id is None:
+                    self._control[method](params)
+                    return
+
+                # Streamed arguments arrive as async iterators
+                streams = []
+                if isinstance(params, dict) and isinstance(params.get('args'), list) and self.streaming():
+                    params['args'] = [
+                        Streams.RemoteStream(self, arg['$stream'], self.stream_window)
+                        if isinstance(arg, dict) and '$stream' in arg and len(arg) == 1 else arg
+                        for arg in params['args']
+                    ]
+                    streams = [arg for arg in params['args'] if isinstance(arg, Streams.RemoteStream)]
+
                 if method in self.methods:
                     try:
                         # Create callback for sending response
                         # Only respond if request_id is present (not a notification)
                         def response_callback(err, res):
                             if request_id is not None:
-                                self._send_response(request_id, err, res)
+                                self._running.pop(request_id, None)
+                            # Also closes the streamed arguments the method is done with
+                            self._send_response(request_id, err, res, method, streams)
                             
-                        # Call method with parameters and callback
-                        self.methods[method](params, response_callback)
+                        meta = message.get('meta')
+                        deadline = Deadlines.from_meta(meta)
+                        if deadline is not None and deadline <= time.monotonic():
+                            # Nobody is waiting for the result any more
+                            response_callback(Deadlines.deadline_error(), None)
+                            return
+
+                        if request_id is not None:
+                            self._running[request_id] = None
+
+                        def execute(done):
+                            if request_id is not None and self._running.get(request_id) is CANCELLED:
+                                done("Request cancelled", None)
+                                return
+                            # The method and the tasks it starts see its deadline
+                            token = Deadlines.current_deadline.set(deadline)
+                            try:
+                                task = self.methods[method](params, done)
+                            finally:
+                                Deadlines.current_deadline.reset(token)
+                            # Async methods run in a task system.cancel can cancel
+                            if isinstance(task, asyncio.Task) and request_id in self._running:
+                                self._running[request_id] = task
+
+                        if self.admission is not None and request_id is not None and \
+                                not method.startswith('system.'):
+                            # The caller's priority wins over the method's
+                            lane = (meta.get('prio') if isinstance(meta, dict) else None) or \
+                                getattr(self.methods[method], 'priority', None)
+
+                            # Run when there is capacity, or answer that the server is overloaded
+                            def admit(done, run=execute):
+                                self.admission.admit(self.uuid, method, run, done, lane, deadline)
+                            execute = admit
+
+                        idem = meta.get('idem') if isinstance(meta, dict) and request_id is not None else None
+                        if idem is not None and self.idempotency is not None:
+                            # Retries of the request are answered without running it again
+                            def execute_once(done, run=execute):
+                                try:
+                                    run(done)
+                                except Exception as e:
+                                    done(str(e), None)
+                            # Keys are the caller's own, clients name themselves in the handshake
+                            caller = self.peer_capabilities.get('caller')
+                            key = (caller if isinstance(caller, str) else self.uuid, method, str(idem))
+                            self.idempotency.run(key, params, response_callback, execute_once)
+                        else:
+                            # Call method with parameters and callback
+                            execute(response_callback)
                     except Exception as e:
                         if request_id is not None:
                             self._send_error(request_id, str(e))
                 else:
+                    for stream in streams:
+                        stream.close()
                     if request_id is not None:
                         self._send_error(request_id, f"Method not found: {method}")
         
-        except json.JSONDecodeError:
-            print(f"Error decoding JSON message: {message_str}")
         except Exception as e:
             print(f"Error processing message: {e}")
     
-    def _send_response(self, request_id, error, result):
+    def _send_response(self, request_id, error, result, method=None, streams=()):
         """Send a response for a request.
         
         Args:
             request_id: The ID of the original request.
             error: Error information or None.
             result: Result data or None.
+            method: The method of the original request.
+            streams: The request's streamed arguments, closed once a streamed
+                result, which may still be reading them, is done
         """
         if not request_id:
+            for stream in streams:
+                stream.close()
             return
+
+        if not error and Streams.is_stream_source(result):
+            if not self.streaming():
+                # The remote can't receive a stream, send all the items at once
+                async def collect_and_respond():
+                    items, failure = None, None
+                    try:
+                        items = await Streams.collect(result)
+                    except Exception as e:
+                        failure = str(e)
+                    finally:
+                        for stream in streams:
+                            stream.close()
+                    self._send_response(request_id, failure, items, method)
+                asyncio.create_task(collect_and_respond())
+                return
+            self._stream_seq += 1
+            producer = Streams.StreamProducer(self, self._stream_seq, result, self.stream_chunk, streams)
+            self.streams_out[producer.stream_id] = producer
+            producer.start()
+            result = {'$stream': producer.stream_id}
+        else:
+            for stream in streams:
+                stream.close()
             
-        response = {
-            'jsonrpc': '2.0',
-            'id': request_id
-        }
-        
         if error:
-            response['error'] = {
-                'code': -32000,
-                'message': str(error)
-            }
+            # A complete JSON-RPC error object, such as Admission's, is sent as it is
+            if not (isinstance(error, dict) and 'code' in error):
+                error = {'code': -32000, 'message': str(error)}
+
+        if self.compact():
+            if error:
+                response = [ERROR, request_id, error]
+            else:
+                response = [RESULT, request_id, result]
         else:
-            response['result'] = result
+            response = {
+                'jsonrpc': '2.0',
+                'id': request_id
+            }
+
+            if error:
+                response['error'] = error
+            else:
+                response['result'] = result
             
         def next_cb(err):
             if err:
                 print(f"Failed to send response: {err}")
         
-        try:
-            json_response = json.dumps(response)
-        except TypeError as e:
+        def encode_failed(e):
             # Handle non-serializable objects
             print(f"JSON serialization error: {e}")
             self._send_error(request_id, "Internal error: Result not serializable")
-            return
-                
-        asyncio.create_task(self._transmit_message(json_response, next_cb))
+
+        self._send(response, next_cb, encode_failed, {'res': request_id}, method)
     
+    def _on_stream_data(self, params):
+        stream = self.streams_in.get(params.get('stream'))
+        if stream is not None:
+            stream.feed(params.get('items', []))
+
+    def _on_stream_end(self, params):
+        stream = self.streams_in.get(params.get('stream'))
+        if stream is not None:
+            stream.end(params.get('error'))
+
+    def _on_stream_credit(self, params):
+        producer = self.streams_out.get(params.get('stream'))
+        if producer is not None:
+            producer.add_credit(params.get('credit', 0))
+
+    def _on_stream_cancel(self, params):
+        producer = self.streams_out.pop(params.get('stream'), None)
+        if producer is not None:
+            producer.cancel()
+
+    def _on_invalidate(self, params):
+        if self.response_cache is not None and isinstance(params, dict):
+            self.response_cache.invalidate(params.get('method'), params.get('args'))
+
+    def _on_cancel(self, params):
+        request_id = params.get('id') if isinstance(params, dict) else None
+        if request_id not in self._running:
+            return
+        task = self._running[request_id]
+        if isinstance(task, asyncio.Task):
+            task.cancel()
+        else:
+            # Queued for admission, it answers as soon as it would start
+            self._running[request_id] = CANCELLED
+
     def _send_error(self, request_id, message, code=-32000):
         """Send an error response.
         
@@ -198,14 +1181,17 @@ class JRPC2:
             message: Error message.
             code: Error code.
         """
-        response = {
-            'jsonrpc': '2.0',
-            'error': {
-                'code': code,
-                'message': message
-            },
-            'id': request_id
-        }
+        if self.compact():
+            response = [ERROR, request_id, {'code': code, 'message': message}]
+        else:
+            response = {
+                'jsonrpc': '2.0',
+                'error': {
+                    'code': code,
+                    'message': message
+                },
+                'id': request_id
+            }
         
         def next_cb(err):
             if err:
@@ -3,25 +3,38 @@ Client implementation for JRPC over WebSockets.
 """
 import asyncio
 import websockets
-from typing import Optional
+from typing import Optional, Union
 
 
+from .Compression import Compression, websocket_options
 from .JRPCCommon import JRPCCommon
 
 
 class JRPCClient(JRPCCommon):
     """Client implementation for JRPC over WebSockets."""
     
-    def __init__(self, server_uri: str, remote_timeout: int = 60):
+    def __init__(self, server_uri: str, remote_timeout: int = 60,
+                 max_size: Optional[int] = 2**20, max_transfer: int = 64 * 2**20,
+                 compression: Union[None, bool, Compression] = None):
         """Initialize the JRPC client.
         
         Args:
             server_uri: URI of the server to connect to (ws://host:port)
             remote_timeout: Timeout for remote connections in seconds
+            max_size: Largest WebSocket frame accepted, peers which negotiate
+                chunking split larger messages
+            max_transfer: Most bytes buffered to reassemble chunked messages,
+                larger transfers are rejected
+            compression: permessage-deflate settings, a Compression, True for
+                its defaults, False to send everything uncompressed or None
+                for the websockets default
         """
         super().__init__()
         self.server_uri = server_uri
         self.remote_timeout = remote_timeout
+        self.max_size = max_size
+        self.max_transfer = max_transfer
+        self.compression = compression
         self.ws = None
         self.connected = False
         self._message_task = None
@@ -32,7 +45,8 @@ class JRPCClient(JRPCCommon):
     async def connect(self):
         """Connect to the WebSocket server."""
         try:
-            self.ws = await websockets.connect(self.server_uri)
+            self.ws = await websockets.connect(self.server_uri, max_size=self.max_size,
+                                               **websocket_options(self.compression, server=False))
             self.connected = True
             print(f"Connected to {self.server_uri}")
             
@@ -41,8 +55,7 @@ class JRPCClient(JRPCCommon):
             
             # Define message handler
             async def on_message_handler(message):
-                if isinstance(message, bytes):
-                    message = message.decode('utf-8')
+                # Binary frames are passed through, JRPC2 tells attachments from JSON text
                 remote.receive(message)
             
             # Handle incoming messages
@@ -83,6 +96,7 @@ class JRPCClient(JRPCCommon):
         
     async def disconnect(self):
         """Disconnect from the WebSocket server."""
+        self._stop_pinging()
         if self.ws and self.connected:
             await self.ws.close()
             self.connected = False
@@ -2,6 +2,7 @@
 Common functionality for JRPC clients and servers.
 """
 import asyncio
+import time
 import uuid
 from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 import importlib.util
@@ -14,8 +15,14 @@ except ImportError:
     IS_BROWSER = True
 
 # Import our modules
+from . import Attachments
+from . import Balancing
+from .Breakers import CircuitBreaker
 from .ExposeClass import ExposeClass
+from .FanOut import FanOut, shared_params
 from .JRPC2 import JRPC2
+from .ResponseCache import ResponseCache
+from .Timeouts import AdaptiveTimeouts
 
 
 class RPCMethodNotFoundError(Exception):
@@ -33,8 +40,32 @@ class JRPCCommon:
         self.remotes = {}  # Maps UUID to remote
         self.classes = []  # List of exposed class objects
         self.call = {}     # Function to call all remotes with the same method
+        self.call_one = {} # Function to call the least loaded remote with the method, see balance
         self.server = {}   # Legacy: Functions mapped to a particular remote (deprecated)
         self.remote_timeout = 60
+        self.attachments = True  # Offer binary attachments (ndarray ...) to peers which negotiate them
+        self.streams = True      # Stream generator results to peers which negotiate them
+        self.max_size = 2**20    # Largest WebSocket frame accepted, bigger messages arrive chunked
+        self.max_transfer = 64 * 2**20  # Most bytes buffered per connection to reassemble chunks
+        self.incremental_threshold = None  # Chunked JSON at least this large is parsed with ijson as it arrives, None to buffer it
+        self.zstd = None         # Zstd.ZstdCodec offered to peers, small messages are compressed when both sides have it
+        self.capture = None      # Called with each JSON text message, set a Zstd.TrafficCapture to record traffic
+        self.compact = True      # Numeric method ids and a positional envelope with peers which negotiate it
+        self.cache_responses = True  # Keep results of methods the remote marks cacheable
+        self.idempotency = None  # IdempotencyStore.IdempotencyStore answering retried requests, None to run every retry
+        self.caller_id = str(uuid.uuid4())  # Names us to servers, so our retries over a new connection match
+        self.admission = None    # Admission.Admission limiting the requests run at once, None for no limits
+        self.method_timeouts = {}  # Method -> seconds to wait for its results instead of remote_timeout
+        self.adaptive_timeouts = None  # Timeouts.AdaptiveTimeouts learning per method timeouts, None to not learn
+        self.hedge_after = None  # Seconds before call_any sends a hedged copy, None for the learned p95 latency
+        self.hedge_latencies = AdaptiveTimeouts(multiple=1, percentile=95, min_timeout=0.001, samples=20)
+        self._any_turn = 0
+        self.balance = Balancing.LEAST  # How call_one chooses a remote, 'least', 'p2c' or 'rtt'
+        self.ping_interval = 5.0  # Seconds between the pings measuring round trips for the 'rtt' balance
+        self._pinger = None       # Task pinging the remotes while the balance is 'rtt'
+        self.breaker_failures = 5  # Consecutive failed calls which trip a remote's circuit breaker, None for no breakers
+        self.breaker_reset = 5.0   # Seconds a tripped breaker fails calls before letting a probe through
+        self.fan_out_window = 1000  # Most requests of a call[fn] waiting for answers at once, None for no limit
         self._setup_lock = asyncio.Lock()
         
     def new_remote(self) -> JRPC2:
@@ -45,6 +76,16 @@ class JRPCCommon:
         """
         remote = JRPC2(remote_timeout=self.remote_timeout)
         remote.uuid = str(uuid.uuid4())
+        remote.max_transfer = self.max_transfer
+        remote.incremental_threshold = self.incremental_threshold
+        remote.zstd = self.zstd
+        remote.capture = self.capture
+        remote.idempotency = self.idempotency
+        remote.admission = self.admission
+        remote.method_timeouts = self.method_timeouts
+        remote.adaptive_timeouts = self.adaptive_timeouts
+        if self.breaker_failures:
+            remote.breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset)
         
         if not hasattr(self, 'remotes') or self.remotes is None:
             self.remotes = {}
@@ -113,6 +154,7 @@ class JRPCCommon:
         
         # Remove the remote
         if hasattr(self, 'remotes') and self.remotes and uuid in self.remotes:
+            self.remotes[uuid].close()
             del self.remotes[uuid]
         
         # Update call methods
@@ -127,8 +169,10 @@ class JRPCCommon:
                 for fn in existing_fns:
                     if fn not in remaining_fns:
                         del self.call[fn]
+                        self.call_one.pop(fn, None)
         else:
             self.call = {}
+            self.call_one = {}
         
         self.remote_disconnected(uuid)
     
@@ -151,13 +195,80 @@ class JRPCCommon:
             for cls_obj in self.classes:
                 remote.expose(cls_obj)
         
+        remote.capabilities = self.capabilities()
         remote.upgrade()
+
+        # Negotiate wire extensions, peers which don't know system.capabilities stay plain JSON-RPC
+        remote.call('system.capabilities', remote.capabilities,
+                    lambda err, result: self.handle_capabilities(err, result, remote))
         
         # List available components
         # Using create_task to handle async properly
         remote.call('system.listComponents', [], lambda err, result: 
             asyncio.create_task(self._handle_list_components_async(err, result, remote)))
     
+    def capabilities(self):
+        """The wire extensions this side offers to its peers.
+
+        Returns:
+            A dict sent to the remote with system.capabilities
+        """
+        caps = {}
+        if self.attachments:
+            caps['attachments'] = Attachments.available_kinds()
+        if self.streams:
+            caps['streams'] = True
+        if self.max_size:
+            caps['chunks'] = {'max_frame': self.max_size}
+        if self.zstd is not None:
+            caps['zstd'] = {'dict': self.zstd.dict_id}
+        if self.compact:
+            caps['compact'] = True
+        cacheable = {name: fn.cacheable for jrpc_obj in self.classes for name, fn in jrpc_obj.items()
+                     if getattr(fn, 'cacheable', None)}
+        if cacheable:
+            caps['cacheable'] = cacheable
+        timeouts = {name: fn.timeout for jrpc_obj in self.classes for name, fn in jrpc_obj.items()
+                    if getattr(fn, 'timeout', None)}
+        if timeouts:
+            caps['timeouts'] = timeouts
+        if self.cache_responses:
+            caps['responseCache'] = True
+        caps['meta'] = True
+        caps['cancel'] = True
+        caps['caller'] = self.caller_id
+        return caps
+
+    def handle_capabilities(self, err, result, remote):
+        """Handle the response from system.capabilities.
+
+        Args:
+            err: Error object if any, a plain JSON-RPC peer answers method not found
+            result: The capabilities offered by the remote
+            remote: The remote that was called
+        """
+        if err or not isinstance(result, dict):
+            remote.peer_capabilities = {}
+            return
+        remote.peer_capabilities = result
+        if self.cache_responses and isinstance(result.get('cacheable'), dict):
+            remote.response_cache = ResponseCache(result['cacheable'])
+
+    def invalidate(self, method: str, args: Optional[list] = None):
+        """Tell remotes caching method's results that they changed.
+
+        Cached and encoded methods marked cacheable do this when they are
+        invalidated, call it for other cacheable methods.
+
+        Args:
+            method: The method name, 'ClassName.methodName'
+            args: Arguments of the changed result, None when every result
+                of the method changed
+        """
+        for remote in list(self.remotes.values()):
+            if remote.peer_capabilities.get('responseCache'):
+                remote.notify('system.invalidate', {'method': method, 'args': args})
+
     async def _handle_list_components_async(self, err, result, remote):
         """Async wrapper for handle_list_components.
         
@@ -190,6 +301,10 @@ class JRPCCommon:
         else:
             print(f"Unexpected result type from system.listComponents: {type(result)}")
             fn_names = []
+
+        # Compact requests name methods by the ids the remote listed them with
+        if isinstance(result, dict):
+            remote.set_method_ids(result)
         
         # Use async-safe setup
         asyncio.create_task(self._setup_fns_safe(fn_names, remote))
@@ -241,29 +356,24 @@ class JRPCCommon:
                 
             if fn_name not in self.call:
                 async def call_all_remotes(*args, fn_name=fn_name):
-                    """Call the function on all remotes."""
-                    promises = []
-                    rems = []
-                    
-                    for r_uuid, r in self.remotes.items():
-                        if hasattr(r, 'rpcs') and fn_name in r.rpcs:
-                            rems.append(r_uuid)
-                            promises.append(r.rpcs[fn_name](*args))
+                    """Call the function on all remotes, returning a dict of uuid: result."""
+                    remotes = [r for r in self.remotes.values() if fn_name in getattr(r, 'rpcs', {})]
                     
                     # If no remote has this function, raise a specific error
-                    if not promises:
+                    if not remotes:
                         raise RPCMethodNotFoundError(fn_name)
                     
-                    results = await asyncio.gather(*promises, return_exceptions=True)
-                    
-                    # Create a dict of uuid: result
-                    result_dict = {}
-                    for i, res in enumerate(results):
-                        result_dict[rems[i]] = res
-                        
-                    return result_dict
+                    # The arguments are encoded once for all the remotes
+                    return await FanOut(fn_name, shared_params(args), remotes, self.fan_out_window).run()
                 
                 self.call[fn_name] = call_all_remotes
+
+            if fn_name not in self.call_one:
+                async def call_one_remote(*args, fn_name=fn_name):
+                    """Call the function on one remote, chosen by self.balance."""
+                    return await self.choose_remote(fn_name).rpcs[fn_name](*args)
+
+                self.call_one[fn_name] = call_one_remote
             
             # For backwards compatibility - setup server functions
             # Ensure server is a dictionary
@@ -305,9 +415,109 @@ class JRPCCommon:
             self.classes = [jrpc_obj]
         else:
             self.classes.append(jrpc_obj)
+
+        # Invalidating a cacheable cached method reaches the remotes' caches
+        for fn_name, fn in jrpc_obj.items():
+            if getattr(fn, 'cacheable', None) and hasattr(fn, 'cache'):
+                fn.cache.on_invalidate(lambda args, fn_name=fn_name: self.invalidate(fn_name, args))
         
         # Update existing remotes
         if hasattr(self, 'remotes') and self.remotes:
             for remote in self.remotes.values():
                 remote.expose(jrpc_obj)
                 remote.upgrade()
+
+    def breaker_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Remote uuid -> the state of its circuit breaker, for monitoring."""
+        return {uuid: remote.breaker.stats() for uuid, remote in self.remotes.items()
+                if remote.breaker is not None}
+
+    def _remotes_with(self, fn_name: str) -> List[JRPC2]:
+        """The remotes exposing fn_name, leaving out those with an open circuit if others are healthy."""
+        remotes = [r for r in self.remotes.values() if fn_name in getattr(r, 'rpcs', {})]
+        if not remotes:
+            raise RPCMethodNotFoundError(fn_name)
+        healthy = [r for r in remotes if r.breaker is None or r.breaker.available()]
+        return healthy or remotes
+
+    def choose_remote(self, fn_name: str) -> JRPC2:
+        """The remote call_one sends a call of fn_name to, chosen by self.balance."""
+        remotes = self._remotes_with(fn_name)
+        if self.balance == Balancing.RTT and (self._pinger is None or self._pinger.done()):
+            # Round trips are measured in the background, not as calls are made
+            self._pinger = asyncio.ensure_future(self._ping_remotes())
+        return Balancing.choose(remotes, self.balance)
+
+    async def _ping_remotes(self):
+        """Ping every remote each ping_interval seconds while the balance is 'rtt'."""
+        while self.balance == Balancing.RTT and self.remotes:
+            for remote in list(self.remotes.values()):
+                remote.ping()
+            await asyncio.sleep(self.ping_interval)
+
+    def _stop_pinging(self):
+        if self._pinger is not None:
+            self._pinger.cancel()
+            self._pinger = None
+
+    async def call_any(self, fn_name: str, *args, hedge_after: Optional[float] = None, hedges: int = 1):
+        """Call a method on one of the remotes exposing it, hedging slow calls.
+
+        The remotes take turns. If no answer arrives within hedge_after
+        seconds, a copy of the call goes to the next remote, up to hedges
+        copies. The first result wins and the other copies are cancelled. An
+        error only wins once no other copy is still running.
+
+        Args:
+            fn_name: The method to call
+            *args: Its arguments
+            hedge_after: Seconds to wait before each copy, defaults to
+                self.hedge_after, then to the method's learned p95 latency.
+                Until that is learned no copies are sent
+            hedges: Most extra copies to send
+
+        Returns:
+            The method's result
+        """
+        remotes = self._remotes_with(fn_name)
+        self._any_turn += 1
+        first = self._any_turn % len(remotes)
+        remotes = remotes[first:] + remotes[:first]
+        if hedge_after is None:
+            hedge_after = self.hedge_after
+        if hedge_after is None:
+            hedge_after = self.hedge_latencies.timeout(fn_name)
+
+        future = asyncio.get_running_loop().create_future()
+        sent = {}  # Remote -> request id of the copies still running
+
+        def send(remote):
+            started = time.monotonic()
+
+            def callback(err, result):
+                sent.pop(remote, None)
+                if future.done():
+                    return
+                if not err:
+                    self.hedge_latencies.record(fn_name, time.monotonic() - started)
+                    future.set_result(result)
+                elif not sent:
+                    future.set_exception(Exception(str(err)))
+            request_id = remote.call(fn_name, {'args': list(args)}, callback)
+            if request_id is not None and not future.done():
+                sent[remote] = request_id
+
+        try:
+            send(remotes[0])
+            for remote in remotes[1:hedges + 1]:
+                if hedge_after is None:
+                    break
+                await asyncio.wait([future], timeout=hedge_after)
+                if future.done():
+                    break
+                send(remote)
+            return await future
+        finally:
+            # The losers, or every copy if the caller gave up
+            for remote, request_id in list(sent.items()):
+                remote.cancel(request_id)
@@ -4,31 +4,46 @@ Server implementation for JRPC over WebSockets.
 import asyncio
 import websockets
 import ssl
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union
 
+from .Compression import Compression, websocket_options
 from .JRPCCommon import JRPCCommon
 
 
 class JRPCServer(JRPCCommon):
     """Server implementation for JRPC over WebSockets."""
     
-    def __init__(self, port: int = 9000, remote_timeout: int = 60, ssl_context: Optional[ssl.SSLContext] = None):
+    def __init__(self, port: int = 9000, remote_timeout: int = 60, ssl_context: Optional[ssl.SSLContext] = None,
+                 max_size: Optional[int] = 2**20, max_transfer: int = 64 * 2**20,
+                 compression: Union[None, bool, Compression] = None):
         """Initialize the JRPC server.
         
         Args:
             port: Port to listen on
             remote_timeout: Timeout for remote connections in seconds
             ssl_context: Optional SSL context for secure connections
+            max_size: Largest WebSocket frame accepted, peers which negotiate
+                chunking split larger messages
+            max_transfer: Most bytes buffered per connection to reassemble
+                chunked messages, larger transfers are rejected
+            compression: permessage-deflate settings, a Compression, True for
+                its defaults, False to send everything uncompressed or None
+                for the websockets default
         """
         super().__init__()
         self.port = port
         self.remote_timeout = remote_timeout
+        self.max_size = max_size
+        self.max_transfer = max_transfer
+        self.compression = compression
         self.ws_server = None  # WebSocket server instance (renamed to avoid collision with parent's self.server dict)
         self.ssl_context = ssl_context
         
     async def start(self):
         """Start the WebSocket server."""
-        self.ws_server = await websockets.serve(self.handle_connection, "0.0.0.0", self.port, ssl=self.ssl_context)
+        self.ws_server = await websockets.serve(self.handle_connection, "0.0.0.0", self.port, ssl=self.ssl_context,
+                                                max_size=self.max_size,
+                                                **websocket_options(self.compression, server=True))
         protocol = "WSS" if self.ssl_context else "WS"
         print(f"JRPC Server started on port {self.port} with {protocol} protocol")
         
@@ -43,8 +58,7 @@ class JRPCServer(JRPCCommon):
         
         # Define message handler function
         async def on_message_handler(message):
-            if isinstance(message, bytes):
-                message = message.decode('utf-8')
+            # Binary frames are passed through, JRPC2 tells attachments from JSON text
             remote.receive(message)
         
         try:
@@ -75,6 +89,7 @@ class JRPCServer(JRPCCommon):
         
     async def stop(self):
         """Stop the WebSocket server."""
+        self._stop_pinging()
         if self.ws_server:
             self.ws_server.close()
             await self.ws_server.wait_closed()
@@ -0,0 +1,95 @@
+"""
+Results of a remote's cacheable methods, kept by the caller.
+
+Peers offer the methods they marked with Caching.cacheable during the
+handshake. Calls of those methods are answered from this cache until the
+result expires or the peer pushes system.invalidate.
+"""
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .Caching import _Store, canonical_key
+
+
+class ResponseCache:
+    """Results of the remote's cacheable methods, kept by the caller.
+
+    Args:
+        methods: Method name -> {'ttl': seconds or None, 'maxsize': n} as
+            offered by the remote
+    """
+
+    def __init__(self, methods: Dict[str, Dict[str, Any]]):
+        self.methods = {}
+        for name, spec in methods.items():
+            spec = spec if isinstance(spec, dict) else {}
+            self.methods[name] = {'ttl': spec.get('ttl'), 'maxsize': max(int(spec.get('maxsize') or 256), 1),
+                                  'store': _Store()}
+
+    def __contains__(self, method):
+        return method in self.methods
+
+    def key(self, params) -> Optional[str]:
+        """The cache key of a call's params, None if they are not plain JSON."""
+        try:
+            if isinstance(params, dict) and isinstance(params.get('args'), list) and len(params) == 1:
+                return canonical_key(*params['args'])
+            return canonical_key(params)
+        except TypeError:
+            return None
+
+    def get(self, method: str, key: str):
+        """Return (True, result) for a cached result, else (False, None)."""
+        entry = self.methods[method]
+        store = entry['store']
+        cached = store.entries.get(key)
+        if cached is not None:
+            if cached[1] is None or cached[1] > time.monotonic():
+                store.entries.move_to_end(key)
+                store.hits += 1
+                return True, cached[0]
+            del store.entries[key]
+            store.evictions += 1
+        store.misses += 1
+        return False, None
+
+    def filler(self, method: str, key: str, callback: Callable) -> Callable:
+        """Wrap a call's callback to keep its result.
+
+        A result is not kept if the method was invalidated while the call
+        was in flight.
+        """
+        entry = self.methods[method]
+        store = entry['store']
+        generation = store.generation
+
+        def fill(err, result):
+            # Streamed results can only be read once
+            if not err and store.generation == generation and not hasattr(result, '__aiter__'):
+                ttl = entry['ttl']
+                store.entries[key] = (result, None if ttl is None else time.monotonic() + ttl)
+                store.entries.move_to_end(key)
+                while len(store.entries) > entry['maxsize']:
+                    store.entries.popitem(last=False)
+                    store.evictions += 1
+            callback(err, result)
+
+        return fill
+
+    def invalidate(self, method: str, args: Optional[list] = None):
+        """Drop the result for args, or every result of method when args is None."""
+        entry = self.methods.get(method)
+        if entry is None:
+            return
+        store = entry['store']
+        store.generation += 1
+        if args is None:
+            store.entries.clear()
+        else:
+            store.entries.pop(canonical_key(*args), None)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Hit, miss and eviction counts per method."""
+        return {name: {'hits': entry['store'].hits, 'misses': entry['store'].misses,
+                       'evictions': entry['store'].evictions, 'size': len(entry['store'].entries)}
+                for name, entry in self.methods.items()}
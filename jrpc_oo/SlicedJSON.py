@@ -0,0 +1,238 @@
+"""
+Time-sliced JSON encoding and decoding of large messages.
+
+The json module holds the GIL while it works, so moving a 50 MB dumps or
+loads to a worker thread still stalls the event loop for its whole
+duration. Instead large containers are encoded and decoded a slice of
+members at a time, with the C codec doing each slice, and control is
+returned to the event loop between slices.
+
+Compression is sliced by frame. permessage-deflate compresses each frame
+inside the websockets send, large messages go out as chunk frames no longer
+than the peer's max_frame and JRPC2 returns to the event loop between them
+on the same clock, and zstd only takes messages small enough to compress in
+microseconds, see Zstd.
+"""
+import asyncio
+import json
+import time
+from json.decoder import WHITESPACE, scanstring
+
+_scan_once = json.JSONDecoder().scan_once
+_WS = ' \t\n\r'
+
+# Small members decoded between checks of the slice clock
+_RUN = 256
+
+# Members which encode or decode larger than this are themselves sliced
+_SMALL = 64 * 1024
+
+
+class _Clock:
+    """Yields to the event loop once a slice has used its time."""
+
+    def __init__(self, slice_time: float):
+        self.slice_time = slice_time
+        self.start = time.perf_counter()
+
+    async def tick(self):
+        if time.perf_counter() - self.start >= self.slice_time:
+            await asyncio.sleep(0)
+            self.start = time.perf_counter()
+
+
+def estimate_size(value, limit: int, sample: int = 16) -> int:
+    """Cheaply estimate the encoded size of value.
+
+    Long containers are extrapolated from their first few members, fewer at
+    each level of nesting, and the estimate stops growing at limit.
+
+    Args:
+        value: The value to be encoded
+        limit: Size at which the caller's decision is made
+        sample: Members looked at in the outermost container
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    if isinstance(value, (dict, list, tuple)):
+        if isinstance(value, dict):
+            members = [v for _, v in zip(range(sample), value.values())]
+            overhead = 16  # Quoted key and separators
+        else:
+            members = value[:sample]
+            overhead = 2
+        inner = max(sample // 2, 1)
+        size = sum(estimate_size(v, limit, inner) + overhead for v in members)
+        return min(limit, size * len(value) // max(len(members), 1)) + 2
+    from .Attachments import RawJSON  # Attachments imports this module
+    if isinstance(value, RawJSON):
+        return len(value.text)
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, int):
+        return nbytes
+    return 8
+
+
+async def dumps(value, default=None, slice_time: float = 0.005) -> str:
+    """json.dumps which returns to the event loop every slice_time seconds.
+
+    Produces the same text as json.dumps(value, default=default).
+    """
+    parts = []
+    await _dump(value, default, parts, _Clock(slice_time))
+    return ''.join(parts)
+
+
+async def _dump(value, default, parts, clock):
+    if isinstance(value, dict):
+        if not all(isinstance(k, str) for k in value):
+            parts.append(json.dumps(value, default=default))
+            return
+        members = list(value.items())
+        brackets = '{}'
+    elif isinstance(value, (list, tuple)):
+        members = value
+        brackets = '[]'
+    else:
+        parts.append(json.dumps(value, default=default))
+        return
+
+    is_dict = brackets == '{}'
+    nested = (list, tuple, dict)
+    parts.append(brackets[0])
+    walk = True  # Walk nested members until they turn out to be small
+    batch = 1
+    i = 0
+    while i < len(members):
+        member = members[i][1] if is_dict else members[i]
+        if walk and isinstance(member, nested):
+            if is_dict:
+                parts.append(json.dumps(members[i][0]) + ': ')
+            start = len(parts)
+            await _dump(member, default, parts, clock)
+            walk = sum(len(p) for p in parts[start:]) >= _SMALL
+            i += 1
+        else:
+            # A batch of small members goes to the C encoder in one call
+            end = min(i + batch, len(members))
+            if walk:
+                end = next((j for j in range(i + 1, end)
+                            if isinstance(members[j][1] if is_dict else members[j], nested)), end)
+            chunk = dict(members[i:end]) if is_dict else list(members[i:end])
+            parts.append(json.dumps(chunk, default=default)[1:-1])
+            batch = min(batch * 2, _RUN)
+            i = end
+        if i < len(members):
+            parts.append(', ')
+        await clock.tick()
+    parts.append(brackets[1])
+
+
+async def loads(text, slice_time: float = 0.005, max_depth: int = 8):
+    """json.loads which returns to the event loop every slice_time seconds.
+
+    Containers are walked member by member while their members are large,
+    small members are decoded whole by the C scanner.
+    """
+    if isinstance(text, (bytes, bytearray, memoryview)):
+        text = bytes(text).decode('utf-8')
+    clock = _Clock(slice_time)
+    value, end = await _load(text, _skip(text, 0), max_depth, clock)
+    end = _skip(text, end)
+    if end != len(text):
+        raise json.JSONDecodeError("Extra data", text, end)
+    return value
+
+
+def _skip(text, idx):
+    if text[idx:idx + 1] in _WS:
+        return WHITESPACE.match(text, idx).end()
+    return idx
+
+
+def _scan(text, idx):
+    """Decode one value at idx with the C scanner."""
+    try:
+        return _scan_once(text, idx)
+    except StopIteration as e:
+        raise json.JSONDecodeError("Expecting value", text, e.value) from None
+
+
+def _member_end(text, idx, close):
+    """Step over the separator after a member, return (idx, last)."""
+    char = text[idx:idx + 1]
+    if char in _WS:
+        idx = WHITESPACE.match(text, idx).end()
+        char = text[idx:idx + 1]
+    if char == close:
+        return idx + 1, True
+    if char != ',':
+        raise json.JSONDecodeError("Expecting ',' delimiter", text, idx)
+    return _skip(text, idx + 1), False
+
+
+def _key(text, idx):
+    """Decode an object key and step over the colon after it."""
+    if text[idx:idx + 1] != '"':
+        raise json.JSONDecodeError("Expecting property name enclosed in double quotes", text, idx)
+    key, idx = scanstring(text, idx + 1)
+    idx = _skip(text, idx)
+    if text[idx:idx + 1] != ':':
+        raise json.JSONDecodeError("Expecting ':' delimiter", text, idx)
+    return key, _skip(text, idx + 1)
+
+
+async def _load(text, idx, depth, clock):
+    char = text[idx:idx + 1]
+    if depth <= 0 or char not in ('[', '{'):
+        return _scan(text, idx)
+
+    is_list = char == '['
+    close = ']' if is_list else '}'
+    result = [] if is_list else {}
+    idx = _skip(text, idx + 1)
+    if text[idx:idx + 1] == close:
+        return result, idx + 1
+
+    walk = True  # Walk nested members until they turn out to be small
+    last = False
+    while not last:
+        if not walk:
+            # A run of small members goes straight to the C scanner
+            try:
+                for _ in range(_RUN):
+                    if is_list:
+                        value, idx = _scan_once(text, idx)
+                        result.append(value)
+                    else:
+                        key, idx = _key(text, idx)
+                        result[key], idx = _scan_once(text, idx)
+                    if text[idx:idx + 2] == ', ':
+                        idx += 2
+                    else:
+                        idx, last = _member_end(text, idx, close)
+                        if last:
+                            break
+            except StopIteration as e:
+                raise json.JSONDecodeError("Expecting value", text, e.value) from None
+            await clock.tick()
+            continue
+
+        if not is_list:
+            key, idx = _key(text, idx)
+        start = idx
+        nested = text[idx:idx + 1] in ('[', '{')
+        if nested:
+            value, idx = await _load(text, idx, depth - 1, clock)
+            walk = idx - start >= _SMALL
+        else:
+            value, idx = _scan(text, idx)
+        if is_list:
+            result.append(value)
+        else:
+            result[key] = value
+        idx, last = _member_end(text, idx, close)
+        await clock.tick()
+    return result, idx
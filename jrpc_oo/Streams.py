@@ -0,0 +1,227 @@
+"""
+Streaming of generator results and iterator arguments between JRPC peers.
+
+An exposed method which returns a generator or async generator does not have
+its items collected into one response, and an async iterator passed as an
+argument is not collected into the request. The message carries a
+``$stream`` placeholder instead and the items follow as chunked
+``system.streamData`` notifications. The consumer grants credit with
+``system.streamCredit`` as it iterates, the producer never runs more than
+that many items ahead, so a slow consumer can't make the producing side
+buffer the whole stream. A RemoteStream dropped before its end cancels
+the stream when it is garbage collected, releasing the producer.
+"""
+import asyncio
+import collections
+import inspect
+import weakref
+from typing import Any, List
+
+
+def is_stream_source(value) -> bool:
+    """Return True for values which are streamed rather than sent whole."""
+    return inspect.isasyncgen(value) or inspect.isgenerator(value)
+
+
+def is_async_iterable(value) -> bool:
+    """Return True for arguments which are streamed rather than sent whole."""
+    return hasattr(value, '__aiter__')
+
+
+async def collect(source) -> List[Any]:
+    """Materialize a stream source for peers which can't receive streams."""
+    if is_async_iterable(source):
+        return [item async for item in source]
+    return list(source)
+
+
+class StreamProducer:
+    """Sends the items of a generator or async iterator as credit allows.
+
+    Args:
+        remote: The JRPC2 instance which sends the chunks
+        stream_id: The id the remote knows this stream by
+        source: The generator or async iterable to drain
+        chunk_size: Most items sent in one message
+        inputs: RemoteStreams the source reads, closed when it is done
+    """
+
+    def __init__(self, remote, stream_id, source, chunk_size: int = 64, inputs=()):
+        self.remote = remote
+        self.stream_id = stream_id
+        self.source = source
+        self.chunk_size = chunk_size
+        self.inputs = inputs
+        self.credit = 0
+        self._credit_event = asyncio.Event()
+        # Items read ahead of the credit, bounded to one chunk
+        self._queue = asyncio.Queue(maxsize=chunk_size)
+        self._pump_task = None
+        self._task = None
+
+    def start(self):
+        """Start draining the source."""
+        self._pump_task = asyncio.create_task(self._pump())
+        self._task = asyncio.create_task(self._run())
+
+    def add_credit(self, credit: int):
+        """The consumer is ready for credit more items."""
+        self.credit += credit
+        self._credit_event.set()
+
+    def cancel(self):
+        """Stop producing, the consumer went away."""
+        for task in (self._pump_task, self._task):
+            if task is not None:
+                task.cancel()
+
+    async def _pump(self):
+        """Read items from the source into the bounded queue."""
+        done = ('end', None)
+        try:
+            if is_async_iterable(self.source):
+                async for item in self.source:
+                    await self._queue.put(('item', item))
+            else:
+                for item in self.source:
+                    await self._queue.put(('item', item))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Stream source failed: {e}")
+            done = ('end', str(e))
+        await self._queue.put(done)
+
+    async def _run(self):
+        """Send queued items in chunks no larger than the granted credit."""
+        try:
+            while True:
+                while self.credit <= 0:
+                    self._credit_event.clear()
+                    await self._credit_event.wait()
+
+                kind, value = await self._queue.get()
+                items = []
+                while kind == 'item':
+                    items.append(value)
+                    if len(items) >= min(self.credit, self.chunk_size) or self._queue.empty():
+                        break
+                    kind, value = self._queue.get_nowait()
+
+                if items:
+                    self.credit -= len(items)
+                    await self._send('system.streamData', {'stream': self.stream_id, 'items': items})
+                if kind == 'end':
+                    # Nothing left to take credit or a cancel for
+                    self.remote.streams_out.pop(self.stream_id, None)
+                    params = {'stream': self.stream_id}
+                    if value is not None:
+                        params['error'] = value
+                    await self._send('system.streamEnd', params)
+                    return
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.remote.streams_out.pop(self.stream_id, None)
+            if self._pump_task is not None:
+                self._pump_task.cancel()
+            for stream in self.inputs:
+                stream.close()
+
+    async def _send(self, method, params):
+        # Waiting for each chunk to go out keeps large chunks, which are
+        # encoded in slices, ahead of the ones after them
+        sending = self.remote.notify(method, params)
+        if sending is not None:
+            await asyncio.shield(sending)
+
+
+def _cancel_dropped(remote, stream_id):
+    """Tell the producer of a RemoteStream which was dropped before its end to stop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return  # Collected after the loop, the connection is gone too
+    remote.notify('system.streamCancel', {'stream': stream_id})
+
+
+class RemoteStream:
+    """Async iterator over a stream produced by the remote.
+
+    Credit for window items is granted up front and topped up as items are
+    consumed, so at most window items are buffered here.
+
+    Args:
+        remote: The JRPC2 instance the stream arrives on
+        stream_id: The id the remote assigned to the stream
+        window: Most items the remote may send ahead of consumption
+    """
+
+    def __init__(self, remote, stream_id, window: int = 256):
+        self.remote = remote
+        self.stream_id = stream_id
+        self.window = window
+        self._items = collections.deque()
+        self._consumed = 0
+        self._done = False
+        self._error = None
+        self._waiter = None
+        # The remote only holds a weak reference, the finalizer cancels the
+        # stream if nothing else does
+        remote.streams_in[stream_id] = self
+        self._finalizer = weakref.finalize(self, _cancel_dropped, remote, stream_id)
+        self._finalizer.atexit = False
+        remote.notify('system.streamCredit', {'stream': stream_id, 'credit': window})
+
+    def feed(self, items: List[Any]):
+        """Items arrived from the remote."""
+        self._items.extend(items)
+        self._wake()
+
+    def end(self, error=None):
+        """The remote finished the stream, optionally with an error."""
+        self._done = True
+        self._error = error
+        self._finalizer.detach()
+        self.remote.streams_in.pop(self.stream_id, None)
+        self._wake()
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._items:
+            if self._done:
+                if self._error is not None:
+                    raise Exception(self._error)
+                raise StopAsyncIteration
+            self._waiter = asyncio.get_running_loop().create_future()
+            await self._waiter
+
+        item = self._items.popleft()
+        self._consumed += 1
+        # Top up the credit in batches rather than per item
+        if not self._done and self._consumed >= max(1, self.window // 2):
+            self.remote.notify('system.streamCredit', {'stream': self.stream_id, 'credit': self._consumed})
+            self._consumed = 0
+        return item
+
+    def close(self):
+        """Stop the stream early and tell the producer to stop, if it hasn't ended."""
+        if not self._done:
+            self.remote.notify('system.streamCancel', {'stream': self.stream_id})
+            self.end()
+
+    async def aclose(self):
+        """Stop the stream early and tell the producer to stop."""
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
@@ -0,0 +1,97 @@
+"""
+Timeouts for calls to remote methods.
+
+remote_timeout applies to every method, which is far too long to notice a
+lost reply to a method answering in milliseconds and can be too short for a
+slow one. A method can carry its own timeout, set where it is defined with
+the timeout decorator and offered to callers in the capabilities handshake,
+or set by the caller in method_timeouts. AdaptiveTimeouts learns a timeout
+for each method from the latency of its calls.
+"""
+import collections
+import math
+from typing import Any, Dict, Optional
+
+
+def timeout(seconds: float):
+    """Set how long callers wait for a method's results.
+
+    Args:
+        seconds: The timeout callers use instead of their remote_timeout
+    """
+    def mark(fn):
+        fn.jrpc_timeout = seconds
+        return fn
+
+    return mark
+
+
+class _Latencies:
+    """Recent latencies of one method."""
+
+    __slots__ = ('samples', 'stale', 'percentile')
+
+    def __init__(self, window):
+        self.samples = collections.deque(maxlen=window)
+        self.stale = 0
+        self.percentile = None
+
+
+class AdaptiveTimeouts:
+    """Timeouts of a multiple of each method's recent p99 latency.
+
+    Until a method has enough samples its calls use the configured timeout,
+    and the learned timeout is never longer than that. Calls which time out
+    count with the timeout as their latency, so a timeout that is too short
+    grows until it stops cutting off slow calls.
+
+    Args:
+        multiple: The timeout is this multiple of the percentile
+        percentile: The latency percentile, 99 for p99
+        min_timeout: Shortest timeout in seconds, to allow for jitter
+        samples: Latencies needed before a method's timeout is learned
+        window: Most recent latencies kept per method
+    """
+
+    def __init__(self, multiple: float = 3.0, percentile: float = 99, min_timeout: float = 0.05,
+                 samples: int = 50, window: int = 500):
+        self.multiple = multiple
+        self.percentile = percentile
+        self.min_timeout = min_timeout
+        self.samples = samples
+        self.window = window
+        self.methods = {}  # Method -> _Latencies
+
+    def record(self, method: str, seconds: float):
+        """Note the latency of a call."""
+        latencies = self.methods.get(method)
+        if latencies is None:
+            latencies = self.methods[method] = _Latencies(self.window)
+        latencies.samples.append(seconds)
+        latencies.stale += 1
+        # A slower call may raise the percentile, don't wait to recompute it
+        if latencies.percentile is not None and seconds > latencies.percentile:
+            latencies.percentile = None
+
+    def timeout(self, method: str) -> Optional[float]:
+        """The learned timeout of a method, None until it has enough samples."""
+        latencies = self.methods.get(method)
+        if latencies is None or len(latencies.samples) < self.samples:
+            return None
+        # Sorting the window is the expensive part, do it every few calls
+        if latencies.percentile is None or latencies.stale >= 8:
+            ordered = sorted(latencies.samples)
+            index = min(len(ordered) - 1, math.ceil(len(ordered) * self.percentile / 100) - 1)
+            latencies.percentile = ordered[index]
+            latencies.stale = 0
+        return max(self.min_timeout, latencies.percentile * self.multiple)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Method -> its sample count, percentile latency and learned timeout."""
+        result = {}
+        for method, latencies in self.methods.items():
+            learned = self.timeout(method)
+            result[method] = {'samples': len(latencies.samples),
+                              'percentile': latencies.percentile if learned is not None else None,
+                              'timeout': learned}
+        return result
@@ -0,0 +1,162 @@
+"""
+zstd compression of small JSON-RPC messages with a trained dictionary.
+
+Most JSON-RPC messages are a few hundred bytes which repeat the same
+envelope, method names and keys. That is too little text for deflate to
+find repeats in, but a dictionary trained from captured traffic already
+holds them. Peers which load the same dictionary find that out during the
+handshake and send small messages as zstd compressed binary frames.
+
+Record traffic with TrafficCapture and train a dictionary with
+``python -m jrpc_oo.ZstdTrain``.
+"""
+import json
+import os
+import zlib
+from typing import Iterable, List, Optional, Union
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# First byte of a compressed message, apart from attachment frames (0x00)
+# and JSON text. The zstd frame magic which would follow is left out.
+WITH_DICT = 0x01
+PLAIN = 0x02
+_FRAME_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def zstd_available() -> bool:
+    """Return True if the zstandard package is installed."""
+    return zstandard is not None
+
+
+def is_compressed(data) -> bool:
+    """Return True for binary messages compressed by ZstdCodec."""
+    return len(data) > 0 and data[0] in (WITH_DICT, PLAIN)
+
+
+class ZstdCodec:
+    """Compresses JSON text messages for peers which negotiated zstd.
+
+    Args:
+        dictionary: A dictionary made by the ZstdTrain tool, as bytes or a
+            file path. Peers only use it when they loaded the same one.
+        level: zstd compression level
+        min_size: Smaller messages are sent as they are
+        max_size: Larger messages are sent as they are, permessage-deflate
+            handles those well
+    """
+
+    def __init__(self, dictionary: Union[bytes, str, os.PathLike, None] = None, level: int = 3,
+                 min_size: int = 32, max_size: int = 2**16):
+        if zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package, pip install -e .[zstd]")
+        if isinstance(dictionary, (str, os.PathLike)):
+            with open(dictionary, 'rb') as f:
+                dictionary = f.read()
+        self.level = level
+        self.min_size = min_size
+        self.max_size = max_size
+        # Peers compare dictionaries by checksum, the ids zstd writes are optional
+        self.dict_id = zlib.crc32(dictionary) if dictionary else 0
+        self._compressors = {PLAIN: zstandard.ZstdCompressor(level=level, write_checksum=False)}
+        self._decompressors = {PLAIN: zstandard.ZstdDecompressor()}
+        if dictionary:
+            zdict = zstandard.ZstdCompressionDict(dictionary)
+            zdict.precompute_compress(level=level)
+            self._compressors[WITH_DICT] = zstandard.ZstdCompressor(
+                level=level, dict_data=zdict, write_dict_id=False, write_checksum=False)
+            self._decompressors[WITH_DICT] = zstandard.ZstdDecompressor(dict_data=zdict)
+
+    def compress(self, data: bytes, with_dict: bool = True) -> Optional[bytes]:
+        """Compress one message.
+
+        Args:
+            data: The UTF-8 encoded JSON text
+            with_dict: Use the dictionary, only when the peer has the same one
+
+        Returns:
+            The compressed message, None if it is not worth compressing
+        """
+        if not self.min_size <= len(data) <= self.max_size:
+            return None
+        kind = WITH_DICT if with_dict and WITH_DICT in self._compressors else PLAIN
+        frame = self._compressors[kind].compress(data)
+        if len(frame) - len(_FRAME_MAGIC) + 1 >= len(data):
+            return None
+        return bytes((kind,)) + frame[len(_FRAME_MAGIC):]
+
+    def decompress(self, data, max_size: int) -> bytes:
+        """Decompress one message.
+
+        Args:
+            data: A message made by compress
+            max_size: Largest decompressed size accepted
+        """
+        decompressor = self._decompressors.get(data[0])
+        if decompressor is None:
+            raise ValueError("zstd message uses a dictionary this side doesn't have")
+        frame = _FRAME_MAGIC + bytes(data[1:])
+        size = zstandard.get_frame_parameters(frame).content_size
+        if size > max_size:
+            raise ValueError(f"zstd message of {size} bytes exceeds the limit of {max_size} bytes")
+        return decompressor.decompress(frame, max_output_size=max_size)
+
+
+class TrafficCapture:
+    """Records small JSON text messages to train a dictionary from.
+
+    Set it as the capture of a JRPCServer or JRPCClient. Each line of the
+    file holds one message, JSON string encoded.
+
+    Args:
+        path: File the messages are appended to
+        max_messages: Recording stops after this many messages
+        max_size: Larger messages are not recorded, the dictionary is for small ones
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], max_messages: int = 100000, max_size: int = 4096):
+        self.path = path
+        self.max_messages = max_messages
+        self.max_size = max_size
+        self.count = 0
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def __call__(self, message: Union[str, bytes]):
+        if self._file is None or len(message) > self.max_size:
+            return
+        if isinstance(message, (bytes, bytearray)):
+            message = bytes(message).decode('utf-8', errors='replace')
+        self._file.write(json.dumps(message) + '\n')
+        self.count += 1
+        if self.count >= self.max_messages:
+            self.close()
+
+    def close(self):
+        """Stop recording and close the file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_capture(paths: Iterable[Union[str, os.PathLike]]) -> List[bytes]:
+    """Read the messages recorded by TrafficCapture, as UTF-8 bytes."""
+    samples = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            samples.extend(json.loads(line).encode('utf-8') for line in f if line.strip())
+    return samples
+
+
+def train_dictionary(samples: List[bytes], size: int = 16384) -> bytes:
+    """Train a zstd dictionary from sample messages.
+
+    Args:
+        samples: Messages typical of the traffic, a few thousand or more
+        size: Dictionary size in bytes
+    """
+    if zstandard is None:
+        raise ImportError("zstd compression needs the zstandard package, pip install -e .[zstd]")
+    return zstandard.train_dictionary(size, samples).as_bytes()
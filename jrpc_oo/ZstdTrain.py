@@ -0,0 +1,50 @@
+"""
+Train a zstd dictionary for JRPC messages from a traffic capture.
+
+Usage:
+    python -m jrpc_oo.ZstdTrain capture.jsonl [more.jsonl ...] -o jrpc.dict
+
+Captures are recorded with jrpc_oo.Zstd.TrafficCapture. A tenth of the
+messages are held back to report the compression the dictionary achieves.
+"""
+import argparse
+import sys
+
+from .Zstd import ZstdCodec, read_capture, train_dictionary
+
+
+def evaluate(dictionary: bytes, samples) -> float:
+    """Return the compression ratio the dictionary gives on samples."""
+    codec = ZstdCodec(dictionary, min_size=0)
+    raw = sum(len(sample) for sample in samples)
+    compressed = sum(len(codec.compress(sample) or sample) for sample in samples)
+    return raw / max(compressed, 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m jrpc_oo.ZstdTrain', description=__doc__.split('\n\n')[0])
+    parser.add_argument('captures', nargs='+', help="Files recorded by TrafficCapture")
+    parser.add_argument('-o', '--output', required=True, help="Where to write the dictionary")
+    parser.add_argument('--size', type=int, default=16384, help="Dictionary size in bytes (default 16384)")
+    args = parser.parse_args(argv)
+
+    samples = read_capture(args.captures)
+    held_back = samples[::10]
+    training = [sample for i, sample in enumerate(samples) if i % 10]
+    if len(training) < 100:
+        print(f"Only {len(samples)} messages captured, record more traffic first", file=sys.stderr)
+        return 1
+
+    dictionary = train_dictionary(training, args.size)
+    with open(args.output, 'wb') as f:
+        f.write(dictionary)
+
+    average = sum(len(sample) for sample in held_back) / max(len(held_back), 1)
+    print(f"Trained a {len(dictionary)} byte dictionary from {len(training)} messages")
+    print(f"Held back messages: {average:.0f} bytes on average, "
+          f"{evaluate(dictionary, held_back):.2f}x with the dictionary, {evaluate(b'', held_back):.2f}x without")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
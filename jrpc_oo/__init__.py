@@ -5,16 +5,35 @@ This package provides classes for JSON-RPC 2.0 over WebSockets with
 an object-oriented approach for both client and server implementations.
 """
 
+from .Admission import Admission, priority
+from .Attachments import Columnar, RawJSON
+from .Caching import cacheable, cached, encoded, single_flight
+from .Compression import Compression
+from .Deadlines import time_remaining
 from .ExposeClass import ExposeClass
-from .JRPC2 import JRPC2
+from .JRPC2 import JRPC2, with_options
 from .JRPCCommon import JRPCCommon
 from .JRPCClient import JRPCClient
 from .JRPCServer import JRPCServer
+from .Timeouts import AdaptiveTimeouts, timeout
 
 __all__ = [
+    'AdaptiveTimeouts',
+    'Admission',
+    'Columnar',
+    'Compression',
     'ExposeClass',
     'JRPC2',
     'JRPCCommon',
     'JRPCClient',
-    'JRPCServer'
+    'JRPCServer',
+    'RawJSON',
+    'cacheable',
+    'cached',
+    'encoded',
+    'priority',
+    'single_flight',
+    'time_remaining',
+    'timeout',
+    'with_options'
 ]
@@ -30,3 +30,101 @@ def expose_class_instance():
     """Create a fresh ExposeClass instance for testing."""
     from jrpc_oo.ExposeClass import ExposeClass
     return ExposeClass()
+
+
+class Wire:
+    """The messages sent between the two sides of a pair, see make_pair."""
+
+    def __init__(self):
+        self.sent = {'a': [], 'b': []}  # Side -> the messages it sent, in order
+        self.messages = []              # Everything sent by either side, in order
+
+
+@pytest.fixture
+def wire():
+    """Record of the traffic of the pairs made by make_pair."""
+    return Wire()
+
+
+@pytest.fixture
+def make_pair(wire):
+    """Return a function wiring two JRPC2 instances back to back.
+
+    make_pair(caps=None, b_caps=None, expose=None, a=None, b=None, max_frame=None,
+    a_expose=None) returns (a, b). Both sides offer caps, b offers b_caps
+    instead when it is given, and each side takes what the other offers as
+    its peer's capabilities. b exposes the methods of the expose object and a
+    learns their method ids, likewise a exposes a_expose to b. Frames longer
+    than max_frame fail the test. What each side sends is recorded in wire.
+    """
+    from jrpc_oo.ExposeClass import ExposeClass
+    from jrpc_oo.JRPC2 import JRPC2
+
+    def make_pair(caps=None, b_caps=None, expose=None, a=None, b=None, max_frame=None, a_expose=None):
+        a = a if a is not None else JRPC2()
+        b = b if b is not None else JRPC2()
+
+        def connect(name, receiver):
+            async def transmit(msg, next_cb):
+                size = len(msg.encode('utf-8')) if isinstance(msg, str) else len(msg)
+                assert not max_frame or size <= max_frame, "Frame over the negotiated limit"
+                wire.sent[name].append(msg)
+                wire.messages.append(msg)
+                receiver.receive(msg)
+                next_cb(False)
+            return transmit
+
+        a.set_transmitter(connect('a', b))
+        b.set_transmitter(connect('b', a))
+        b_caps = caps if b_caps is None else b_caps
+        for side, offered, peer in ((a, caps, b_caps), (b, b_caps, caps)):
+            side.capabilities = dict(offered or {})
+            side.peer_capabilities = dict(peer or {})
+            side.upgrade()
+        if expose is not None:
+            b.expose(ExposeClass().expose_all_fns(expose))
+            a.set_method_ids(b.method_ids())
+        if a_expose is not None:
+            a.expose(ExposeClass().expose_all_fns(a_expose))
+            b.set_method_ids(a.method_ids())
+        return a, b
+
+    return make_pair
+
+
+@pytest.fixture
+def start():
+    """Return a function calling a method on a remote without waiting.
+
+    start(remote, method, *args) returns a future of (err, result).
+    """
+    def start(remote, method, *args):
+        future = asyncio.get_running_loop().create_future()
+        remote.call(method, {'args': list(args)}, lambda err, res: future.set_result((err, res)))
+        return future
+
+    return start
+
+
+@pytest.fixture
+def call(start):
+    """Return a coroutine function calling a method on a remote.
+
+    call(remote, method, *args, timeout=2) returns (err, result).
+    """
+    async def call(remote, method, *args, timeout=2):
+        return await asyncio.wait_for(start(remote, method, *args), timeout)
+
+    return call
+
+
+@pytest.fixture
+def result(call):
+    """Like call, returning the result and raising the error instead."""
+    async def result(remote, method, *args, timeout=2):
+        err, res = await call(remote, method, *args, timeout=timeout)
+        if err:
+            raise Exception(str(err))
+        return res
+
+    return result
@@ -0,0 +1,230 @@
+"""
+Tests for admission control and load shedding.
+"""
+import pytest
+import asyncio
+
+from jrpc_oo import Admission, priority, with_options
+from jrpc_oo.Admission import OVERLOADED
+
+
+class Work:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.running = 0
+        self.peak = 0
+
+    async def slow(self, n=0):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        await self.gate.wait()
+        self.running -= 1
+        return n
+
+    def fast(self, n=0):
+        return n
+
+    @priority('high')
+    async def urgent(self, n=0):
+        return await self.slow(n)
+
+
+class TestAdmission:
+    """Tests for the limits on running requests."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('caps', [{}, {'compact': True}])
+    async def test_global_limit_and_queue(self, caps, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=2, max_queue=2, retry_after=3)
+        a, b = make_pair(caps, expose=work)
+        b.admission = admission
+
+        calls = [start(a, 'Work.slow', i) for i in range(5)]
+        await asyncio.sleep(0.01)
+        assert work.running == 2 and admission.stats()['queued'] == 2
+
+        # The fifth request is refused straight away
+        err, res = calls[4].result()
+        assert err == {'code': OVERLOADED, 'message': 'Server overloaded', 'data': {'retry_after': 3}}
+
+        # Calls to system methods are not limited
+        err, methods = await start(a, 'system.listComponents')
+        assert 'Work.slow' in methods
+
+        work.gate.set()
+        assert [await call for call in calls[:4]] == [(None, i) for i in range(4)]
+        assert work.peak == 2
+        assert admission.stats() == {'inflight': 0, 'queued': 0, 'queued_high': 0, 'admitted': 4, 'rejected': 1, 'expired': 0}
+
+    @pytest.mark.asyncio
+    async def test_queue_time_limit(self, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1, max_queue_time=0.05)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+
+        first, second = start(a, 'Work.slow'), start(a, 'Work.slow')
+        err, res = await asyncio.wait_for(second, 1)
+        assert err['code'] == OVERLOADED and not first.done()
+        work.gate.set()
+        assert await first == (None, 0)
+
+    @pytest.mark.asyncio
+    async def test_per_remote_and_method_limits(self, make_pair, start):
+        work = Work()
+        admission = Admission(per_remote=2, methods={'Work.slow': 3})
+        a, b = make_pair(expose=work)
+        b.admission = admission
+        c, d = make_pair(expose=work)
+        d.admission = admission
+
+        calls = [start(a, 'Work.slow') for _ in range(3)] + [start(c, 'Work.slow') for _ in range(3)]
+        await asyncio.sleep(0.01)
+        assert work.running == 3
+        assert admission.by_remote == {b.uuid: 2, d.uuid: 1}
+
+        # Other methods have slots left on c's connection only
+        fast_a, fast_c = start(a, 'Work.fast', 1), start(c, 'Work.fast', 2)
+        await asyncio.sleep(0.01)
+        assert fast_c.result() == (None, 2) and not fast_a.done()
+
+        work.gate.set()
+        await asyncio.gather(*calls, fast_a)
+        assert work.peak == 3 and admission.inflight == 0
+
+    @pytest.mark.asyncio
+    async def test_closed_remote_leaves_queue(self, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+        start(a, 'Work.slow')
+        start(a, 'Work.slow')
+        await asyncio.sleep(0.01)
+        b.close()
+        assert admission.stats()['queued'] == 0
+        work.gate.set()
+        await asyncio.sleep(0.01)
+        assert admission.inflight == 0 and work.peak == 1
+
+
+class TestPriority:
+    """Tests for the high and low priority lanes."""
+
+    @staticmethod
+    async def finish_in_turn(work, calls):
+        """Let the running request finish, one at a time, returning their order."""
+        finished = []
+        for _ in calls:
+            await asyncio.sleep(0.01)
+            # Requests started after this wait on the new gate
+            gate, work.gate = work.gate, asyncio.Event()
+            gate.set()
+            await asyncio.sleep(0.01)
+            finished += [call.result()[1] for call in calls
+                         if call.done() and call.result()[1] not in finished]
+        return finished
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('caps', [{'meta': True}, {'meta': True, 'compact': True}])
+    async def test_high_lane_first(self, caps, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1)
+        a, b = make_pair(caps, expose=work)
+        b.admission = admission
+
+        blocker = start(a, 'Work.slow', 'blocker')
+        low = start(a, 'Work.slow', 'low')
+        high = start(a, 'Work.urgent', 'high')
+        with with_options(priority='high'):
+            caller_high = start(a, 'Work.slow', 'caller')
+        with with_options(priority='low'):
+            caller_low = start(a, 'Work.urgent', 'demoted')
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queued_high'] == 2
+
+        finished = await self.finish_in_turn(work, [blocker, low, high, caller_high, caller_low])
+        assert finished == ['blocker', 'high', 'caller', 'low', 'demoted']
+
+    @pytest.mark.asyncio
+    async def test_low_lane_is_not_starved(self, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1, high_share=2)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+
+        calls = [start(a, 'Work.slow', 'low0'), start(a, 'Work.slow', 'low1')]
+        calls += [start(a, 'Work.urgent', f'high{i}') for i in range(4)]
+        finished = await self.finish_in_turn(work, calls)
+        assert finished == ['low0', 'high0', 'high1', 'low1', 'high2', 'high3']
+
+    @pytest.mark.asyncio
+    async def test_reserved_slots(self, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=3, reserved=1)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+
+        lows = [start(a, 'Work.slow', i) for i in range(3)]
+        await asyncio.sleep(0.01)
+        assert work.running == 2 and admission.stats()['queued'] == 1
+
+        # The reserved slot takes a high priority request straight away
+        high = start(a, 'Work.urgent', 'high')
+        await asyncio.sleep(0.01)
+        assert work.running == 3
+        work.gate.set()
+        assert await high == (None, 'high')
+        assert [await call for call in lows] == [(None, i) for i in range(3)]
+
+
+class TestFairShare:
+    """Tests for sharing the queued slots between connections."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('weight, expected', [
+        (1, ['a0', 'a1', 'c0', 'a2', 'c1', 'a3', 'c2', 'a4', 'a5']),
+        (2, ['a0', 'a1', 'a2', 'c0', 'a3', 'a4', 'c1', 'a5', 'c2']),
+        (0.5, ['a0', 'c0', 'a1', 'c1', 'c2', 'a2', 'a3', 'a4', 'a5']),
+    ])
+    async def test_round_robin_by_weight(self, weight, expected, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+        c, d = make_pair(expose=work)
+        d.admission = admission
+        admission.weights[b.uuid] = weight
+
+        # The noisy connection queues all of its requests first
+        calls = [start(a, 'Work.slow', f'a{i}') for i in range(6)]
+        calls += [start(c, 'Work.slow', f'c{i}') for i in range(3)]
+        assert await TestPriority.finish_in_turn(work, calls) == expected
+
+        b.close()
+        assert b.uuid not in admission.weights
+
+    @pytest.mark.asyncio
+    async def test_remote_queue_limit(self, make_pair, start):
+        work = Work()
+        admission = Admission(max_inflight=1, remote_queue=2)
+        a, b = make_pair(expose=work)
+        b.admission = admission
+        c, d = make_pair(expose=work)
+        d.admission = admission
+
+        noisy = [start(a, 'Work.slow', i) for i in range(5)]
+        quiet = start(c, 'Work.slow', 'c')
+        await asyncio.sleep(0.01)
+        assert [call.result()[0]['code'] for call in noisy[3:]] == [OVERLOADED] * 2
+        assert admission.queued(b.uuid) == 2 and admission.queued(d.uuid) == 1
+
+        work.gate.set()
+        assert await quiet == (None, 'c')
+        await asyncio.gather(*noisy)
+        assert admission.queued() == 0 and not admission.lanes['low'].turns
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
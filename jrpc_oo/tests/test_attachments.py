@@ -0,0 +1,211 @@
+"""
+Tests for out-of-band binary attachments and capability negotiation.
+"""
+import pytest
+import asyncio
+import json
+import os
+
+from jrpc_oo import Attachments, Columnar
+
+np = pytest.importorskip("numpy")
+
+
+class TestFrames:
+    """Tests for the binary frame layout."""
+
+    def test_pack_unpack_roundtrip(self):
+        frame = Attachments.pack_frame({'key': 3, 'i': 1}, b'payload')
+        assert Attachments.is_frame(frame)
+        header, payload = Attachments.unpack_frame(frame)
+        assert header == {'key': 3, 'i': 1}
+        assert bytes(payload) == b'payload'
+
+    def test_payload_is_aligned(self):
+        for key in ('k', 'kk', 'kkk', 12345):
+            frame = Attachments.pack_frame({'key': key, 'i': 0}, b'x')
+            assert (len(frame) - 1) % 8 == 0, "Payload should start on an 8 byte boundary"
+
+    def test_json_text_is_not_a_frame(self):
+        assert not Attachments.is_frame(b'{"jsonrpc": "2.0"}')
+        assert not Attachments.is_frame('{"jsonrpc": "2.0"}')
+
+
+class TestNDArrayEncoding:
+    """Tests for ndarray extraction and splicing."""
+
+    def test_encode_extracts_array(self):
+        arr = np.arange(12, dtype=np.float32).reshape(3, 4)
+        text, payloads = Attachments.encode({'id': 'x', 'result': arr}, ['ndarray'], key=1)
+        message = json.loads(text)
+        assert message['bin'] == [1, 1]
+        assert message['result'] == {'$ndarray': {'dtype': '<f4', 'shape': [3, 4], 'frame': 0}}
+        assert len(payloads) == 1
+
+    def test_encode_without_negotiation_falls_back_to_lists(self):
+        arr = np.arange(4, dtype=np.int64)
+        text, payloads = Attachments.encode({'result': [arr, np.int64(7)]}, [], key=None)
+        assert json.loads(text)['result'] == [[0, 1, 2, 3], 7]
+        assert payloads == []
+
+    def test_decode_is_zero_copy(self):
+        arr = np.linspace(0, 1, 10)
+        _, payloads = Attachments.encode({'result': arr}, ['ndarray'], key=1)
+        frame = Attachments.pack_frame({'key': 1, 'i': 0}, payloads[0])
+        _, view = Attachments.unpack_frame(frame)
+        decoded = Attachments.splice({'$ndarray': {'dtype': '<f8', 'shape': [10], 'frame': 0}}, {0: view})
+        assert np.array_equal(decoded, arr)
+        assert not decoded.flags.owndata, "Decoded array should share the frame buffer"
+
+
+class TestNDArrayTransport:
+    """Tests for ndarrays travelling through JRPC2."""
+
+    @pytest.mark.asyncio
+    async def test_result_arrives_as_ndarray(self, make_pair, call, wire):
+        a, b = make_pair({'attachments': ['ndarray']})
+        arr = np.random.rand(64, 32)
+        b.methods['Data.get'] = lambda params, next_cb: next_cb(None, arr)
+
+        err, res = await call(a, 'Data.get')
+
+        assert err is None
+        assert isinstance(res, np.ndarray)
+        assert np.array_equal(res, arr)
+        assert any(isinstance(m, bytes) for m in wire.sent['b']), "Array should travel in a binary frame"
+
+    @pytest.mark.asyncio
+    async def test_params_arrive_as_ndarray(self, make_pair, result):
+        a, b = make_pair({'attachments': ['ndarray']})
+        received = {}
+
+        def method(params, next_cb):
+            received['arg'] = params['args'][0]
+            next_cb(None, float(params['args'][0].sum()))
+
+        b.methods['Data.sum'] = method
+        assert await result(a, 'Data.sum', np.ones(100, dtype=np.int16)) == 100.0
+        assert received['arg'].dtype == np.int16
+
+    @pytest.mark.asyncio
+    async def test_plain_peer_gets_json(self, make_pair, result, wire):
+        a, b = make_pair({'attachments': ['ndarray']})
+        b.peer_capabilities = {}
+        b.methods['Data.get'] = lambda params, next_cb: next_cb(None, np.arange(3))
+
+        assert await result(a, 'Data.get') == [0, 1, 2]
+        assert all(isinstance(m, str) for m in wire.sent['b'])
+
+    @pytest.mark.asyncio
+    async def test_capabilities_handshake(self, make_pair):
+        a, b = make_pair({'attachments': ['ndarray']})
+        b.peer_capabilities = {}
+        future = asyncio.get_running_loop().create_future()
+        a.call('system.capabilities', {'attachments': ['ndarray']}, lambda err, res: future.set_result(res))
+
+        assert await asyncio.wait_for(future, 1) == {'attachments': ['ndarray']}
+        assert b.peer_capabilities == {'attachments': ['ndarray']}
+
+
+class TestInboundLimits:
+    """Messages and frames which never complete don't stay in memory."""
+
+    @pytest.mark.asyncio
+    async def test_orphan_frames_expire(self, make_pair):
+        a, b = make_pair({'attachments': ['bytes']})
+        a.inbound_timeout = 0.02
+        a.receive(Attachments.pack_frame({'key': 'x', 'i': 0}, b'abc'))
+        assert a._inbound_bytes == 3
+        await asyncio.sleep(0.05)
+        assert not a._inbound and a._inbound_bytes == 0
+
+    @pytest.mark.asyncio
+    async def test_too_many_waiting_messages(self, make_pair):
+        a, b = make_pair({'attachments': ['bytes']})
+        a.max_inbound = 2
+        for key in range(3):
+            a.receive(Attachments.pack_frame({'key': key, 'i': 0}, b'abc'))
+        assert list(a._inbound) == [0, 1]
+
+        # A request whose frames can't be held is answered with an error
+        errors = []
+        b.requests['r'] = lambda err, res: errors.append(err)
+        a.receive(json.dumps({'jsonrpc': '2.0', 'method': 'Blob.get', 'params': {'args': []},
+                              'id': 'r', 'bin': [5, 1]}))
+        await asyncio.sleep(0.01)
+        assert 'Too many' in errors[0]['message']
+
+        a.close()
+        assert not a._inbound and a._inbound_bytes == 0
+
+    @pytest.mark.asyncio
+    async def test_frames_over_transfer_limit(self, make_pair):
+        a, b = make_pair({'attachments': ['bytes']})
+        a.max_transfer = 4
+        a.receive(Attachments.pack_frame({'key': 1, 'i': 0}, b'abc'))
+        a.receive(Attachments.pack_frame({'key': 1, 'i': 1}, b'abc'))
+        assert not a._inbound and a._inbound_bytes == 0
+
+
+class TestBytesTransport:
+    """Tests for bytes-like values sent as binary frames."""
+
+    @pytest.mark.asyncio
+    async def test_bytes_roundtrip_without_base64(self, make_pair, result, wire):
+        a, b = make_pair({'attachments': ['bytes']})
+        payload = os.urandom(4096)
+        received = {}
+
+        def method(params, next_cb):
+            received['args'] = params['args']
+            next_cb(None, bytearray(params['args'][0])[::-1])
+
+        b.methods['Blob.reverse'] = method
+        res = await result(a, 'Blob.reverse', payload, memoryview(np.arange(4.0)))
+
+        assert isinstance(received['args'][0], memoryview), "Args should be views on the frame"
+        assert bytes(received['args'][1]) == np.arange(4.0).tobytes()
+        assert bytes(res) == payload[::-1]
+        assert all(len(m) < 200 for m in wire.sent['a'] if isinstance(m, str)), "No base64 in the JSON text"
+
+    def test_fallback_is_base64(self):
+        text, payloads = Attachments.encode({'result': b'\x00\x01'}, [], key=None)
+        assert json.loads(text)['result'] == 'AAE='
+
+
+class TestArrowTransport:
+    """Tests for tabular results sent as Arrow IPC streams."""
+
+    @pytest.mark.asyncio
+    async def test_table_arrives_lazily(self, make_pair, result):
+        pa = pytest.importorskip("pyarrow")
+        a, b = make_pair({'attachments': ['ndarray', 'arrow']})
+        table = pa.table({'x': np.arange(1000), 'name': [f"n{i}" for i in range(1000)]})
+        b.methods['Data.table'] = lambda params, next_cb: next_cb(None, table)
+
+        res = await result(a, 'Data.table')
+
+        assert isinstance(res, Attachments.LazyTable)
+        assert res._table is None, "Table should not be decoded until used"
+        assert len(res) == 1000
+        assert res.table.equals(table)
+
+    @pytest.mark.asyncio
+    async def test_columnar_dict(self, make_pair, result):
+        pytest.importorskip("pyarrow")
+        a, b = make_pair({'attachments': ['arrow']})
+        b.methods['Data.cols'] = lambda params, next_cb: next_cb(None, Columnar({'a': [1, 2], 'b': [3.0, 4.0]}))
+
+        res = await result(a, 'Data.cols')
+
+        assert res.to_pydict() == {'a': [1, 2], 'b': [3.0, 4.0]}
+
+    def test_fallback_stays_columnar(self):
+        pa = pytest.importorskip("pyarrow")
+        table = pa.table({'a': [1, 2], 'b': ['x', 'y']})
+        text, payloads = Attachments.encode({'result': table}, [], key=None)
+        assert json.loads(text)['result'] == {'a': [1, 2], 'b': ['x', 'y']}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
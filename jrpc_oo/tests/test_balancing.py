@@ -0,0 +1,108 @@
+"""
+Tests for choosing one of several remotes for a call.
+"""
+import pytest
+import asyncio
+import random
+from types import SimpleNamespace
+
+from jrpc_oo import Balancing
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+def fake(waiting, latency=None, rtt=None):
+    return SimpleNamespace(requests=dict.fromkeys(range(waiting)), latency=latency, rtt=rtt)
+
+
+class Worker:
+    def __init__(self, name):
+        self.name = name
+        self.started = 0
+        self.gate = asyncio.Event()
+
+    async def run(self):
+        self.started += 1
+        await self.gate.wait()
+        return self.name
+
+
+class TestChoose:
+    """Tests for the balancing strategies."""
+
+    def test_least_outstanding(self):
+        remotes = [fake(3), fake(1, latency=0.2), fake(1, latency=0.1)]
+        assert Balancing.choose(remotes) is remotes[2]
+
+    def test_power_of_two_choices(self):
+        remotes = [fake(n) for n in range(10)]
+        rng = random.Random(1)
+        picks = {id(Balancing.choose(remotes, 'p2c', rng)) for _ in range(200)}
+        # The most loaded remote always loses its comparison
+        assert id(remotes[9]) not in picks and len(picks) > 5
+
+    def test_round_trip(self):
+        near, far = fake(0, rtt=0.001), fake(0, rtt=0.05)
+        assert Balancing.choose([far, near], 'rtt') is near
+        near.requests = dict.fromkeys(range(100))
+        assert Balancing.choose([far, near], 'rtt') is far
+
+    def test_unmeasured_round_trip_is_the_mean(self):
+        new, near, far = fake(0), fake(0, rtt=0.001), fake(0, rtt=0.05)
+        assert Balancing.choose([new, far, near], 'rtt') is near
+        assert Balancing.choose([new, far], 'rtt') is new
+
+    def test_unknown_strategy(self):
+        with pytest.raises(ValueError):
+            Balancing.choose([fake(0), fake(0)], 'fastest')
+
+
+class TestCallOne:
+    """Tests for call_one between a server and its worker clients."""
+
+    @pytest.mark.asyncio
+    async def test_balanced_pool(self):
+        workers = [Worker('one'), Worker('two')]
+        server = JRPCServer(port=19190)
+        await server.start()
+        clients = [JRPCClient("ws://127.0.0.1:19190") for _ in workers]
+        tasks = []
+        for client, worker in zip(clients, workers):
+            client.add_class(worker)
+            tasks.append(asyncio.create_task(client.connect()))
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if len(server.remotes) == 2 and 'Worker.run' in server.call_one and \
+                        all('Worker.run' in getattr(r, 'rpcs', {}) for r in server.remotes.values()):
+                    break
+
+            calls = [asyncio.create_task(server.call_one['Worker.run']()) for _ in range(6)]
+            await asyncio.sleep(0.1)
+            assert [w.started for w in workers] == [3, 3]
+            for worker in workers:
+                worker.gate.set()
+            assert sorted(await asyncio.gather(*calls)) == ['one'] * 3 + ['two'] * 3
+            assert all(r.latency is not None and not r.requests for r in server.remotes.values())
+
+            # The rtt balance pings the remotes in the background
+            server.balance = 'rtt'
+            server.ping_interval = 0.05
+            assert await server.call_one['Worker.run']() in ('one', 'two')
+            await asyncio.sleep(0.1)
+            assert all(r.rtt is not None for r in server.remotes.values())
+            pings = [r.last_ping for r in server.remotes.values()]
+            await asyncio.sleep(0.1)
+            assert all(r.last_ping > ping for r, ping in zip(server.remotes.values(), pings))
+            server.balance = 'least'
+            await asyncio.sleep(0.1)
+            assert server._pinger.done()
+        finally:
+            for client, task in zip(clients, tasks):
+                await client.disconnect()
+                task.cancel()
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,126 @@
+"""
+Tests for the circuit breakers of calls to remotes.
+"""
+import pytest
+import asyncio
+import time
+
+from jrpc_oo.Admission import overloaded_error
+from jrpc_oo.Breakers import CircuitBreaker
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+class Worker:
+    def __init__(self, name, hang=False):
+        self.name = name
+        self.hang = hang
+
+    async def run(self):
+        if self.hang:
+            await asyncio.sleep(10)
+        return self.name
+
+    def fail(self):
+        raise ValueError("bad input")
+
+
+class TestCircuitBreaker:
+    """Tests for the breaker states."""
+
+    def test_trip_probe_and_close(self):
+        breaker = CircuitBreaker(failures=3, reset_after=0.02)
+        for _ in range(2):
+            breaker.failure()
+        breaker.success()
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.failure()
+        assert breaker.state == 'open' and not breaker.allow() and not breaker.available()
+
+        time.sleep(0.03)
+        assert breaker.available() and breaker.allow()
+        # One probe at a time
+        assert breaker.state == 'half_open' and not breaker.allow()
+        breaker.failure()
+        assert breaker.state == 'open' and breaker.trips == 2
+
+        time.sleep(0.03)
+        assert breaker.allow()
+        breaker.success()
+        assert breaker.stats() == {'state': 'closed', 'failures': 0, 'trips': 2, 'rejected': 2}
+
+
+class TestBreakerCalls:
+    """Tests for calls through a remote's breaker."""
+
+    @pytest.mark.asyncio
+    async def test_timeouts_trip_and_calls_fail_fast(self, make_pair, call):
+        a, b = make_pair(expose=Worker('b', hang=True))
+        a.breaker = CircuitBreaker(failures=2, reset_after=0.1)
+        a.method_timeouts = {'Worker.run': 0.02}
+        for _ in range(2):
+            err, _ = await call(a, 'Worker.run')
+            assert 'timeout' in str(err)
+        assert a.breaker.state == 'open'
+
+        started = time.monotonic()
+        err, _ = await call(a, 'Worker.run')
+        assert 'Circuit open' in str(err) and time.monotonic() - started < 0.01
+        assert not a.requests
+
+        # System calls aren't refused, and the method's own errors show the remote works
+        assert await call(a, 'system.ping') == (None, True)
+        await asyncio.sleep(0.1)
+        err, _ = await call(a, 'Worker.fail')
+        assert 'bad input' in err['message'] and a.breaker.state == 'closed'
+
+    @pytest.mark.asyncio
+    async def test_overloaded_answers_count_as_failures(self, make_pair, call):
+        a, b = make_pair(expose=Worker('b', hang=True))
+        a.breaker = CircuitBreaker(failures=1)
+        a.method_timeouts = {'Worker.run': 0.02}
+        b.methods['Worker.run'] = lambda params, next_cb: next_cb(overloaded_error(1), None)
+        await call(a, 'Worker.run')
+        assert a.breaker.state == 'open'
+
+
+class TestFanOut:
+    """A hung remote doesn't hold up calls to all the remotes."""
+
+    @pytest.mark.asyncio
+    async def test_fan_out_skips_wait_for_tripped_remote(self):
+        server = JRPCServer(port=19200)
+        server.breaker_failures = 1
+        server.method_timeouts = {'Worker.run': 0.1}
+        await server.start()
+        clients = [JRPCClient("ws://127.0.0.1:19200") for _ in range(2)]
+        tasks = []
+        for client, worker in zip(clients, [Worker('ok'), Worker('hung', hang=True)]):
+            client.add_class(worker)
+            tasks.append(asyncio.create_task(client.connect()))
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if len(server.remotes) == 2 and \
+                        all('Worker.run' in getattr(r, 'rpcs', {}) for r in server.remotes.values()):
+                    break
+
+            results = await server.call['Worker.run']()
+            assert sorted(str(r) for r in results.values())[1] == 'ok'
+            assert sorted(s['state'] for s in server.breaker_stats().values()) == ['closed', 'open']
+
+            started = time.monotonic()
+            results = await server.call['Worker.run']()
+            assert time.monotonic() - started < 0.05
+            assert any('Circuit open' in str(r) for r in results.values())
+            assert [await server.call_one['Worker.run']() for _ in range(3)] == ['ok'] * 3
+        finally:
+            for client, task in zip(clients, tasks):
+                await client.disconnect()
+                task.cancel()
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,241 @@
+"""
+Tests for pre-encoded results and cached methods.
+"""
+import pytest
+import asyncio
+import json
+
+from jrpc_oo import Attachments, RawJSON, cached, encoded, single_flight
+from jrpc_oo.ExposeClass import ExposeClass
+
+
+class Catalog:
+    def __init__(self):
+        self.items = {'a': 1}
+        self.runs = 0
+
+    @encoded
+    def get(self, prefix=''):
+        self.runs += 1
+        return {k: v for k, v in self.items.items() if k.startswith(prefix)}
+
+    @encoded(key=lambda *args: 'all')
+    async def fetch(self, delay=0):
+        self.runs += 1
+        await asyncio.sleep(delay)
+        return dict(self.items)
+
+    def raw(self):
+        return RawJSON('{"pre": [1, 2]}')
+
+
+class TestRawJSON:
+    """Tests for splicing pre-encoded fragments into messages."""
+
+    def test_fragments_are_spliced(self):
+        raw = RawJSON.encode({'a': [1, 'ü']})
+        text, payloads = Attachments.encode({'id': 1, 'result': [raw, raw, 'x']}, (), None)
+        assert json.loads(text) == {'id': 1, 'result': [{'a': [1, 'ü']}] * 2 + ['x']}
+
+    def test_with_attachments(self):
+        text, payloads = Attachments.encode([1, 7, {'r': RawJSON(b'[true]'), 'b': b'xy'}], ['bytes'], 3)
+        assert json.loads(text) == [1, 7, {'r': [True], 'b': {'$bytes': {'frame': 0}}}, [3, 1]]
+
+    @pytest.mark.asyncio
+    async def test_sliced_encoding(self):
+        raw = RawJSON.encode(list(range(10)))
+        message = {'result': [{'row': i, 'raw': raw} for i in range(2000)]}
+        text, _ = await Attachments.encode_sliced(message, (), None)
+        assert text == Attachments.encode(message, (), None)[0]
+
+
+class TestEncoded:
+    """Tests for the encoded decorator."""
+
+    def test_results_are_cached_per_arguments(self):
+        catalog = Catalog()
+        first = catalog.get()
+        assert isinstance(first, RawJSON) and json.loads(first.text) == {'a': 1}
+        assert catalog.get() is first and catalog.runs == 1
+
+        catalog.items['b'] = 2
+        assert json.loads(catalog.get('b').text) == {'b': 2}
+        assert catalog.get() is first and catalog.runs == 2
+
+        assert catalog.get.invalidate() is True
+        assert json.loads(catalog.get().text) == {'a': 1, 'b': 2}
+        catalog.get.clear()
+        catalog.get()
+        assert catalog.runs == 4
+        assert Catalog().get() is not first, "Instances keep their own results"
+
+    @pytest.mark.asyncio
+    async def test_async_methods(self):
+        catalog = Catalog()
+        first = await catalog.fetch()
+        assert await catalog.fetch(5) is first and catalog.runs == 1
+
+        # A result computed before an invalidation is not kept
+        catalog.fetch.clear()
+        pending = asyncio.create_task(catalog.fetch(0.05))
+        await asyncio.sleep(0.01)
+        catalog.fetch.invalidate()
+        await pending
+        await catalog.fetch()
+        assert catalog.runs == 3
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('caps', [{}, {'compact': True}])
+    async def test_exposed(self, caps, make_pair, call):
+        catalog = Catalog()
+        a, b = make_pair(caps, expose=catalog)
+        a.set_method_ids(b.method_ids())
+
+        assert await call(a, 'Catalog.get') == (None, {'a': 1})
+        assert await call(a, 'Catalog.get') == (None, {'a': 1})
+        assert await call(a, 'Catalog.fetch') == (None, {'a': 1})
+        assert await call(a, 'Catalog.raw') == (None, {'pre': [1, 2]})
+        assert catalog.runs == 2
+
+
+class Prices:
+    def __init__(self):
+        self.runs = 0
+
+    @cached(maxsize=2)
+    def quote(self, symbol, options=None):
+        self.runs += 1
+        return {'symbol': symbol, 'options': options}
+
+    @cached(ttl=0.05)
+    async def rate(self, pair):
+        self.runs += 1
+        return 1.5
+
+
+class TestCached:
+    """Tests for the cached decorator."""
+
+    def test_lru_eviction(self):
+        prices = Prices()
+        first = prices.quote('A')
+        prices.quote('B')
+        assert prices.quote('A') is first
+        prices.quote('C')  # Evicts B, the least recently used
+        prices.quote('A')
+        assert prices.runs == 3
+        prices.quote('B')
+        assert prices.runs == 4
+        assert prices.quote.stats() == {'hits': 2, 'misses': 4, 'evictions': 2,
+                                        'size': 2, 'maxsize': 2, 'ttl': None}
+
+    def test_canonical_arguments(self):
+        prices = Prices()
+        prices.quote('A', {'x': 1, 'y': [2]})
+        prices.quote('A', options={'y': [2], 'x': 1})
+        prices.quote('A', {'y': [2], 'x': 1})
+        assert prices.runs == 2, "Keyword and positional calls are cached separately"
+        with pytest.raises(TypeError):
+            prices.quote(object())
+
+    @pytest.mark.asyncio
+    async def test_ttl_expiry(self):
+        prices = Prices()
+        assert await prices.rate('EURUSD') == 1.5
+        assert await prices.rate('EURUSD') == 1.5
+        assert prices.runs == 1
+        await asyncio.sleep(0.06)
+        await prices.rate('EURUSD')
+        assert prices.runs == 2 and prices.rate.stats()['evictions'] == 1
+
+    def test_invalid_maxsize(self):
+        with pytest.raises(ValueError):
+            cached(maxsize=0)(lambda self: None)
+
+    @pytest.mark.asyncio
+    async def test_cache_stats(self, make_pair, call):
+        a, b = make_pair(expose=Prices())
+        b.expose(ExposeClass().expose_all_fns(Catalog()))
+
+        await call(a, 'Prices.quote', 'A')
+        await call(a, 'Prices.quote', 'A')
+        err, stats = await call(a, 'system.cacheStats')
+        assert set(stats) == {'Prices.quote', 'Prices.rate', 'Catalog.get', 'Catalog.fetch'}
+        assert stats['Prices.quote'] == {'hits': 1, 'misses': 1, 'evictions': 0,
+                                         'size': 1, 'maxsize': 2, 'ttl': None}
+
+
+class Report:
+    def __init__(self):
+        self.runs = 0
+
+    @single_flight
+    async def build(self, date, fail=False):
+        self.runs += 1
+        await asyncio.sleep(0.02)
+        if fail:
+            raise ValueError(f"no data for {date}")
+        return {'date': date, 'run': self.runs}
+
+    @cached(single_flight=True)
+    async def summary(self, date):
+        self.runs += 1
+        await asyncio.sleep(0.02)
+        return self.runs
+
+
+class TestSingleFlight:
+    """Tests for sharing one execution between concurrent calls."""
+
+    @pytest.mark.asyncio
+    async def test_thundering_herd(self, make_pair, call):
+        report = Report()
+        a, b = make_pair(expose=report)
+
+        results = await asyncio.gather(*[call(a, 'Report.build', '2024-01-01') for _ in range(500)])
+        assert report.runs == 1
+        assert all(r == (None, {'date': '2024-01-01', 'run': 1}) for r in results)
+
+        # Once finished, nothing is kept
+        await call(a, 'Report.build', '2024-01-01')
+        assert report.runs == 2
+        assert report.build.stats()['coalesced'] == 499
+
+    @pytest.mark.asyncio
+    async def test_errors_and_arguments(self):
+        report = Report()
+        results = await asyncio.gather(report.build('a', True), report.build('a', True), report.build('b'),
+                                       return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError, dict]
+        assert report.runs == 2
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter(self):
+        report = Report()
+        first = asyncio.ensure_future(report.build('a'))
+        second = asyncio.ensure_future(report.build('a'))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == {'date': 'a', 'run': 1}
+
+    @pytest.mark.asyncio
+    async def test_invalidate_starts_fresh_execution(self):
+        report = Report()
+        first = asyncio.ensure_future(report.build('a'))
+        await asyncio.sleep(0)
+        report.build.invalidate('a')
+        second = asyncio.ensure_future(report.build('a'))
+        await asyncio.gather(first, second)
+        assert report.runs == 2
+
+    @pytest.mark.asyncio
+    async def test_cached(self):
+        report = Report()
+        assert await asyncio.gather(*[report.summary('a') for _ in range(50)]) == [1] * 50
+        assert await report.summary('a') == 1
+        stats = report.summary.stats()
+        assert (stats['misses'], stats['coalesced'], stats['hits']) == (1, 49, 1)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,125 @@
+"""
+Tests for cancelling requests and hedged calls across remotes.
+"""
+import pytest
+import asyncio
+
+from jrpc_oo import Admission
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+class Worker:
+    def __init__(self, name, delay=0):
+        self.name = name
+        self.delay = delay
+        self.started = 0
+        self.cancelled = 0
+
+    async def run(self, x):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return [self.name, x]
+
+
+class TestCancel:
+    """Tests for system.cancel."""
+
+    @pytest.mark.asyncio
+    async def test_cancel_running_request(self, make_pair):
+        worker = Worker('w', delay=5)
+        a, b = make_pair({'cancel': True}, expose=worker)
+        answers = []
+        request_id = a.call('Worker.run', {'args': [1]}, lambda err, res: answers.append(err))
+        await asyncio.sleep(0.01)
+        assert worker.started == 1 and request_id in b._running
+
+        a.cancel(request_id)
+        await asyncio.sleep(0.01)
+        assert worker.cancelled == 1 and not b._running
+        assert answers == [] and not a.requests
+
+    @pytest.mark.asyncio
+    async def test_cancel_queued_request(self, make_pair):
+        worker = Worker('w', delay=0.05)
+        admission = Admission(max_inflight=1)
+        a, b = make_pair({'cancel': True}, expose=worker)
+        b.admission = admission
+        a.call('Worker.run', {'args': [1]}, lambda err, res: None)
+        second = a.call('Worker.run', {'args': [2]}, lambda err, res: None)
+        await asyncio.sleep(0.01)
+        a.cancel(second)
+        await asyncio.sleep(0.1)
+        # The cancelled request gave its place up without running
+        assert worker.started == 1 and admission.inflight == 0 and not b._running
+
+
+async def serve(port, workers):
+    server = JRPCServer(port=port)
+    await server.start()
+    clients, tasks = [], []
+    for worker in workers:
+        client = JRPCClient(f"ws://127.0.0.1:{port}")
+        client.add_class(worker)
+        clients.append(client)
+        tasks.append(asyncio.create_task(client.connect()))
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if len(server.remotes) == len(workers) and \
+                all('Worker.run' in getattr(r, 'rpcs', {}) for r in server.remotes.values()):
+            break
+
+    async def close():
+        for client, task in zip(clients, tasks):
+            await client.disconnect()
+            task.cancel()
+        await server.stop()
+    return server, close
+
+
+class TestCallAny:
+    """Tests for call_any between a server and its worker clients."""
+
+    @pytest.mark.asyncio
+    async def test_remotes_take_turns(self):
+        one, two = Worker('one'), Worker('two')
+        server, close = await serve(19180, [one, two])
+        try:
+            results = [await server.call_any('Worker.run', i) for i in range(4)]
+            names = [name for name, _ in results]
+            assert names[0] != names[1] and names[:2] == names[2:]
+            assert one.started == two.started == 2
+            assert len(server.hedge_latencies.methods['Worker.run'].samples) == 4
+        finally:
+            await close()
+
+    @pytest.mark.asyncio
+    async def test_hedged_copy_wins(self):
+        slow, fast = Worker('slow', delay=5), Worker('fast')
+        server, close = await serve(19181, [slow, fast])
+        try:
+            results = [await asyncio.wait_for(server.call_any('Worker.run', i, hedge_after=0.05), 1)
+                       for i in range(4)]
+            assert results == [['fast', i] for i in range(4)]
+            await asyncio.sleep(0.1)
+            # The slow copies were cancelled on the slow worker
+            assert slow.started == 2 and slow.cancelled == 2 and fast.started == 4
+        finally:
+            await close()
+
+    @pytest.mark.asyncio
+    async def test_learned_hedge_delay(self):
+        server = JRPCServer(port=19182)
+        for _ in range(20):
+            server.hedge_latencies.record('Worker.run', 0.01)
+        assert server.hedge_latencies.timeout('Worker.run') == pytest.approx(0.01)
+        with pytest.raises(Exception, match='not found'):
+            await server.call_any('Worker.run')
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,178 @@
+"""
+Tests for chunked transfer of messages larger than the WebSocket frame limit.
+"""
+import pytest
+import asyncio
+import os
+
+from jrpc_oo import Attachments
+from jrpc_oo.Attachments import RawJSON
+from jrpc_oo.IncrementalDecoder import IncrementalDecoder, incremental_available
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+CHUNKS = {'attachments': ['bytes'], 'chunks': {'max_frame': 4096}}
+
+
+class TestChunkedTransfer:
+    """Tests for splitting and reassembling oversized messages."""
+
+    @pytest.mark.asyncio
+    async def test_large_text_is_chunked(self, make_pair, call, wire):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+
+        text = 'x' * 50000
+        err, res = await call(a, 'Echo.echo', text)
+
+        assert err is None and res == text
+        assert len(wire.messages) > 20, "Message should have been split"
+        assert not a._chunks and not b._chunks
+
+    @pytest.mark.asyncio
+    async def test_large_attachment_is_chunked(self, make_pair, call):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        b.methods['Blob.size'] = lambda params, next_cb: next_cb(None, len(params['args'][0]))
+
+        err, res = await call(a, 'Blob.size', os.urandom(30000))
+        assert (err, res) == (None, 30000)
+
+    @pytest.mark.asyncio
+    async def test_event_loop_runs_between_chunk_frames(self, make_pair, call, wire):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        a.slice_time = 0
+        b.methods['Echo.size'] = lambda params, next_cb: next_cb(None, len(params['args'][0]))
+        turns = []
+
+        async def other_task():
+            while True:
+                turns.append(len(wire.sent['a']))
+                await asyncio.sleep(0)
+
+        other = asyncio.create_task(other_task())
+        await asyncio.sleep(0)
+        try:
+            assert await call(a, 'Echo.size', 'x' * 50000) == (None, 50000)
+        finally:
+            other.cancel()
+        # The other task ran after every frame the request went out in
+        assert set(range(1, len(wire.sent['a']))) <= set(turns)
+
+    @pytest.mark.asyncio
+    async def test_oversized_request_rejected(self, make_pair, call):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        b.max_transfer = 10000
+        called = []
+        b.methods['Echo.echo'] = lambda params, next_cb: called.append(1)
+
+        err, res = await call(a, 'Echo.echo', 'x' * 50000)
+
+        assert err is not None and 'transfer limit' in err['message']
+        assert not called
+        assert b._chunk_bytes == 0 and not b._rejected
+
+    @pytest.mark.asyncio
+    async def test_oversized_response_fails_request(self, make_pair, call):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        a.max_transfer = 10000
+        b.methods['Big.get'] = lambda params, next_cb: next_cb(None, 'y' * 50000)
+
+        err, res = await call(a, 'Big.get')
+        assert 'transfer limit' in str(err)
+        assert not a.requests
+
+    @pytest.mark.asyncio
+    async def test_limit_counts_bytes(self, make_pair, call):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        # Spliced JSON isn't ASCII escaped, 3000 characters are 6000 bytes
+        b.methods['Text.get'] = lambda params, next_cb: next_cb(None, RawJSON('"' + 'ü' * 3000 + '"'))
+
+        assert await call(a, 'Text.get') == (None, 'ü' * 3000)
+
+    @pytest.mark.asyncio
+    async def test_chunk_outside_transfer_is_dropped(self, make_pair):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        header = {'chunk': 1, 'size': 10, 'text': False}
+        b.receive(Attachments.pack_frame(dict(header, off=0), b'abcd'))
+        b.receive(Attachments.pack_frame(dict(header, off=8), b'efghij'))
+
+        assert not b._chunks and b._chunk_bytes == 0 and 1 in b._rejected
+        b.receive(Attachments.pack_frame(dict(header, off=4), b'efghij'))
+        assert not b._chunks and not b._rejected
+
+    @pytest.mark.asyncio
+    async def test_refused_transfers_are_bounded(self, make_pair):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        b.max_transfer = 100
+        b.max_inbound = 2
+        for xid in range(5):
+            b.receive(Attachments.pack_frame({'chunk': xid, 'size': 1000, 'text': False, 'off': 0}, b'x'))
+        assert list(b._rejected) == [3, 4]
+
+
+class TestIncrementalDecoding:
+    """Tests for decoding chunked JSON as it arrives."""
+
+    DOC = b'{"jsonrpc": "2.0", "id": "1", "result": {"values": [1, 2.5, "three", null, true]}}'
+
+    def feed_in_chunks(self, decoder, size=7):
+        for offset in range(0, len(self.DOC), size):
+            decoder.feed(memoryview(self.DOC)[offset:offset + size])
+        assert decoder.complete
+        return decoder.close()
+
+    def test_incremental_decode(self):
+        if not incremental_available():
+            pytest.skip("ijson with a C backend is not installed")
+        decoder = IncrementalDecoder(len(self.DOC))
+        assert decoder._buffer is None, "Chunks should not be buffered"
+        message = self.feed_in_chunks(decoder)
+        assert message['result']['values'] == [1, 2.5, 'three', None, True]
+        assert isinstance(message['result']['values'][1], float)
+
+    def test_buffered_decode(self):
+        decoder = IncrementalDecoder(len(self.DOC), incremental=False)
+        assert self.feed_in_chunks(decoder)['id'] == '1'
+
+    @pytest.mark.asyncio
+    async def test_chunked_request_above_threshold(self, make_pair, call):
+        a, b = make_pair(CHUNKS, max_frame=4096)
+        b.incremental_threshold = 1000
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, sum(params['args'][0]))
+
+        err, res = await call(a, 'Echo.echo', [0.5] * 20000)
+        assert (err, res) == (None, 10000.0)
+        assert not b._chunks
+
+
+class TestChunkedWebSocket:
+    """Large messages over a real connection with the default frame limit."""
+
+    @pytest.mark.asyncio
+    async def test_message_above_max_size(self):
+        class Big:
+            def make(self, n):
+                return 'z' * n
+
+        server = JRPCServer(port=19110)
+        server.add_class(Big())
+        await server.start()
+        client = JRPCClient("ws://127.0.0.1:19110")
+        task = asyncio.create_task(client.connect())
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if client.server and all(r.peer_capabilities for r in client.remotes.values()):
+                    break
+            result = await client.server['Big.make'](3 * 2**20)
+            assert len(result) == 3 * 2**20
+            assert client.connected, "Connection should survive the large message"
+        finally:
+            await client.disconnect()
+            task.cancel()
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
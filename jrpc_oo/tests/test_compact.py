@@ -0,0 +1,137 @@
+"""
+Tests for the compact wire profile.
+"""
+import pytest
+import asyncio
+import json
+
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+class Calc:
+    def add(self, a, b):
+        return a + b
+
+    def fail(self):
+        raise ValueError("broken")
+
+    def blob(self, n):
+        return bytes(i % 256 for i in range(n))
+
+    async def count(self, n):
+        for i in range(n):
+            yield i
+
+
+def sent(wire):
+    """The JSON text messages a sent, decoded."""
+    return [json.loads(msg) for msg in wire.sent['a'] if isinstance(msg, str)]
+
+
+class TestCompactProfile:
+    """Tests for compact messages between JRPC2 peers."""
+
+    @pytest.mark.asyncio
+    async def test_requests_use_method_ids(self, make_pair, call, wire):
+        caps = {'compact': True, 'streams': True}
+        a, b = make_pair(caps, expose=Calc())
+
+        assert await call(a, 'Calc.add', 2, 3) == (None, 5)
+        assert sent(wire) == [[0, 1, b.method_ids()['Calc.add'], {'args': [2, 3]}]]
+
+        err, res = await call(a, 'Calc.fail')
+        assert 'broken' in err['message'] and res is None
+
+        err, stream = await call(a, 'Calc.count', 5)
+        assert [i async for i in stream] == list(range(5))
+        assert all(isinstance(msg, list) for msg in sent(wire))
+
+    @pytest.mark.asyncio
+    async def test_unknown_methods(self, make_pair, call, wire):
+        caps = {'compact': True}
+        a, b = make_pair(caps, expose=Calc())
+
+        # Methods missing from the table are sent by name
+        err, res = await call(a, 'Calc.missing')
+        assert sent(wire)[-1][2] == 'Calc.missing' and 'Method not found' in err['message']
+
+        a.set_method_ids({'Calc.gone': 100})
+        err, res = await call(a, 'Calc.gone')
+        assert 'Method not found: #100' in err['message']
+
+    @pytest.mark.asyncio
+    async def test_method_ids_are_stable(self, make_pair, call):
+        a, b = make_pair({'compact': True}, expose=Calc())
+        ids = b.method_ids()
+
+        # Removing a method and exposing it again doesn't renumber the others
+        add = b.methods.pop('Calc.add')
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+        b.methods['Calc.add'] = add
+        assert {name: b.method_ids()[name] for name in ids} == ids
+        assert await call(a, 'Calc.add', 2, 3) == (None, 5)
+        err, res = await call(a, 'Calc.fail')
+        assert 'broken' in err['message']
+
+        # A method exposed after the table was listed is found by its new id
+        b.methods['Late.get'] = lambda params, next_cb: next_cb(None, 'late')
+        a._method_ids['Late.get'] = len(b._method_names)
+        assert await call(a, 'Late.get') == (None, 'late')
+
+    @pytest.mark.asyncio
+    async def test_compact_needs_negotiation(self, make_pair, wire):
+        a, b = make_pair({}, expose=Calc())
+        b.receive(json.dumps([0, 1, b.method_ids()['Calc.add'], {'args': [2, 3]}]))
+        await asyncio.sleep(0.01)
+        assert wire.sent['b'] == []
+
+    @pytest.mark.asyncio
+    async def test_attachments(self, make_pair, call, wire):
+        caps = {'compact': True, 'attachments': ['bytes']}
+        a, b = make_pair(caps, expose=Calc())
+
+        err, res = await call(a, 'Calc.blob', 300)
+        assert bytes(res) == bytes(range(256)) + bytes(range(44))
+
+        b.methods['Echo.len'] = lambda params, next_cb: next_cb(None, len(params['args'][0]))
+        err, res = await call(a, 'Echo.len', b'abcd')
+        assert res == 4 and sent(wire)[-1][-1] == [a._bin_seq, 1]
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('a_caps, b_caps', [({'compact': True}, {}), ({}, {'compact': True})])
+    async def test_one_side_stays_plain(self, a_caps, b_caps, make_pair, call, wire):
+        a, b = make_pair(a_caps, b_caps, expose=Calc())
+
+        assert await call(a, 'Calc.add', 2, 3) == (None, 5)
+        assert sent(wire)[0]['jsonrpc'] == '2.0' and sent(wire)[0]['method'] == 'Calc.add'
+
+
+class TestCompactConnection:
+    """The compact profile negotiated over a real connection."""
+
+    @pytest.mark.asyncio
+    async def test_negotiated_after_handshake(self):
+        server = JRPCServer(port=19140)
+        server.add_class(Calc())
+        await server.start()
+        client = JRPCClient("ws://127.0.0.1:19140")
+        task = asyncio.create_task(client.connect())
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if 'Calc.add' in client.server:
+                    break
+            remote = next(iter(client.remotes.values()))
+            assert remote.compact()
+            assert await client.server['Calc.add'](2, 3) == 5
+            with pytest.raises(Exception, match='broken'):
+                await client.server['Calc.fail']()
+        finally:
+            await client.disconnect()
+            task.cancel()
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
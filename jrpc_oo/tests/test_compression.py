@@ -0,0 +1,118 @@
+"""
+Tests for permessage-deflate settings and the size threshold.
+"""
+import pytest
+import asyncio
+import contextvars
+
+from websockets.extensions.permessage_deflate import PerMessageDeflate
+from websockets.frames import Frame, Opcode
+
+from jrpc_oo.Compression import Compression, _ThresholdDeflate, websocket_options
+from jrpc_oo.Context import sending_method
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+def deflate_pair(policy):
+    """A thresholded encoder and a plain permessage-deflate decoder."""
+    encoder = _ThresholdDeflate(PerMessageDeflate(False, False, 12, 12), policy)
+    decoder = PerMessageDeflate(False, False, 12, 12)
+    return encoder, decoder
+
+
+def text_frame(data: bytes, fin=True):
+    return Frame(Opcode.TEXT, data, fin)
+
+
+class TestThreshold:
+    """Tests for sending small messages uncompressed."""
+
+    def test_small_messages_skip_compression(self):
+        encoder, decoder = deflate_pair(Compression(min_size=100))
+        small, large = b'{"id": 1}', b'{"result": "' + b'x' * 1000 + b'"}'
+
+        frames = [encoder.encode(text_frame(data)) for data in (large, small, large)]
+
+        assert [f.rsv1 for f in frames] == [True, False, True]
+        assert frames[1].data == small
+        assert len(frames[2].data) < 100, "Window should carry over the skipped message"
+        assert [decoder.decode(f).data for f in frames] == [large, small, large]
+
+    def test_fragments_follow_first_frame(self):
+        encoder, decoder = deflate_pair(Compression(min_size=100))
+        first = encoder.encode(text_frame(b'a' * 10, fin=False))
+        rest = encoder.encode(Frame(Opcode.CONT, b'b' * 1000))
+
+        assert not first.rsv1 and rest.data == b'b' * 1000
+
+    def test_method_overrides_threshold(self):
+        policy = Compression(min_size=100, methods={'Big.get': False, 'Tiny.get': True})
+
+        def compressed(method, size):
+            sending_method.set(method)
+            return policy.should_compress(size)
+
+        assert contextvars.copy_context().run(compressed, 'Big.get', 10000) is False
+        assert contextvars.copy_context().run(compressed, 'Tiny.get', 10) is True
+        assert contextvars.copy_context().run(compressed, 'Other.get', 10) is False
+        assert contextvars.copy_context().run(compressed, None, 1000) is True
+
+    def test_options(self):
+        assert websocket_options(None, server=True) == {}
+        assert websocket_options(False, server=True) == {'compression': None}
+        options = websocket_options(Compression(window_bits=10), server=False)
+        assert options['compression'] is None and len(options['extensions']) == 1
+        with pytest.raises(ValueError):
+            Compression(window_bits=8)
+
+
+class Echo:
+    def echo(self, value):
+        return value
+
+
+async def roundtrip(port, server_compression, client_compression):
+    server = JRPCServer(port=port, compression=server_compression)
+    server.add_class(Echo())
+    await server.start()
+    client = JRPCClient(f"ws://127.0.0.1:{port}", compression=client_compression)
+    task = asyncio.create_task(client.connect())
+    try:
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if 'Echo.echo' in client.server:
+                break
+        extensions = [type(ext).__name__ for ext in client.ws.protocol.extensions]
+        for value in ('small', 'large ' * 10000):
+            assert await client.server['Echo.echo'](value) == value
+        return extensions
+    finally:
+        await client.disconnect()
+        task.cancel()
+        await server.stop()
+
+
+class TestCompressedConnection:
+    """Compression settings over a real connection."""
+
+    @pytest.mark.asyncio
+    async def test_thresholded_compression(self):
+        policy = Compression(level=1, window_bits=10, min_size=512)
+        assert await roundtrip(19120, policy, policy) == ['_ThresholdDeflate']
+
+    @pytest.mark.asyncio
+    async def test_websockets_default(self):
+        assert await roundtrip(19123, None, None) == ['PerMessageDeflate']
+
+    @pytest.mark.asyncio
+    async def test_compression_off(self):
+        assert await roundtrip(19121, False, False) == []
+
+    @pytest.mark.asyncio
+    async def test_one_side_off(self):
+        assert await roundtrip(19122, True, False) == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,99 @@
+"""
+Tests for deadlines carried by requests.
+"""
+import pytest
+import asyncio
+import json
+import time
+
+from jrpc_oo import Admission, time_remaining, with_options
+from jrpc_oo.Deadlines import DEADLINE_EXCEEDED
+
+
+class Work:
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.runs = 0
+        self.peer = None
+
+    async def slow(self):
+        self.runs += 1
+        await self.gate.wait()
+        return self.runs
+
+    def budget(self):
+        return time_remaining()
+
+    async def relay(self):
+        # Calls made while handling a request inherit its deadline
+        await asyncio.sleep(0.05)
+        own = time_remaining()
+        future = asyncio.get_running_loop().create_future()
+        self.peer.call('Work.budget', {'args': []}, lambda err, res: future.set_result(res))
+        return [own, await future]
+
+
+class TestDeadlines:
+    """Tests for sending, enforcing and inheriting deadlines."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('caps', [{'meta': True}, {'meta': True, 'compact': True}])
+    async def test_budget_is_inherited(self, caps, make_pair, start):
+        work = Work()
+        a, b = make_pair(caps, expose=work, a_expose=Work())
+        work.peer = b
+        err, res = await start(a, 'Work.budget')
+        assert err is None and res is None
+
+        with with_options(timeout=5):
+            err, (own, nested) = await start(a, 'Work.relay')
+        assert 4 < own < 4.96 and nested <= own
+
+        with with_options(deadline=time.time() + 10):
+            err, res = await start(a, 'Work.budget')
+        assert 9 < res <= 10
+
+    @pytest.mark.asyncio
+    async def test_expired_request_is_not_run(self, make_pair):
+        work = Work()
+        a, b = make_pair({'meta': True}, expose=work)
+        sent = []
+        b.set_transmitter(lambda msg, next_cb: (sent.append(json.loads(msg)), next_cb(False)))
+        b.receive(json.dumps({'jsonrpc': '2.0', 'id': 'x', 'method': 'Work.slow', 'params': {'args': []},
+                              'meta': {'dl': time.time() - 1}}))
+        await asyncio.sleep(0.01)
+        assert work.runs == 0
+        assert sent[0]['error']['code'] == DEADLINE_EXCEEDED
+
+    @pytest.mark.asyncio
+    async def test_expired_before_sending(self, make_pair, start):
+        work = Work()
+        a, b = make_pair({'meta': True}, expose=work)
+        with with_options(timeout=5):
+            with with_options(deadline=time.time() - 1):
+                err, res = await start(a, 'Work.slow')
+        assert 'Deadline exceeded' in str(err) and work.runs == 0
+
+    @pytest.mark.asyncio
+    async def test_request_expires_in_admission_queue(self, make_pair, start):
+        admission = Admission(max_inflight=1, max_queue_time=5)
+        work = Work()
+        a, b = make_pair({'meta': True}, expose=work)
+        b.admission = admission
+        first = start(a, 'Work.slow')
+        with with_options(timeout=0.05):
+            second = start(a, 'Work.slow')
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queued'] == 1
+
+        await asyncio.wait_for(second, 1)
+        await asyncio.sleep(0.01)
+        assert admission.stats()['queued'] == 0 and admission.expired == 1
+        work.gate.set()
+        assert await first == (None, 1)
+        await asyncio.sleep(0.01)
+        assert work.runs == 1 and admission.rejected == 0
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,129 @@
+"""
+Tests for calling one method on many remotes.
+"""
+import pytest
+import asyncio
+import json
+
+from jrpc_oo.Attachments import RawJSON
+from jrpc_oo.Breakers import CircuitBreaker
+from jrpc_oo.FanOut import FanOut, RemoteError, shared_params
+from jrpc_oo.ResponseCache import ResponseCache
+from jrpc_oo.JRPC2 import JRPC2, with_options
+
+
+def make_remotes(count, sent):
+    """Remotes whose transmitter records each request, to be answered by answer()."""
+    remotes = []
+    for _ in range(count):
+        remote = JRPC2()
+        remote.set_transmitter(lambda msg, next_cb, remote=remote: (sent.append((remote, json.loads(msg))),
+                                                                    next_cb(False)))
+        remotes.append(remote)
+    return remotes
+
+
+def answer(remote, request, **response):
+    remote.receive(json.dumps({'jsonrpc': '2.0', 'id': request['id'], **response}))
+
+
+class TestSharedParams:
+    """Tests for encoding the params once."""
+
+    def test_plain_arguments_are_encoded_once(self):
+        params = shared_params([1, {'a': 'b'}])
+        assert isinstance(params, RawJSON)
+        assert json.loads(params.text) == {'args': [1, {'a': 'b'}]}
+
+    def test_attachments_and_streams_are_left_alone(self):
+        async def stream():
+            yield 1
+        assert shared_params([b'\x00\x01']) == {'args': [b'\x00\x01']}
+        assert not isinstance(shared_params([stream()]), RawJSON)
+
+
+class TestFanOut:
+    """Tests for the window and the answers table."""
+
+    @pytest.mark.asyncio
+    async def test_window_bounds_waiting_requests(self):
+        sent = []
+        remotes = make_remotes(5, sent)
+        call = asyncio.create_task(FanOut('Worker.run', shared_params(['x']), remotes, 2).run())
+        await asyncio.sleep(0.01)
+        assert len(sent) == 2
+
+        answered = 0
+        while answered < len(sent):
+            remote, request = sent[answered]
+            assert request['params'] == {'args': ['x']}
+            answer(remote, request, result=remote.uuid)
+            answered += 1
+            await asyncio.sleep(0.01)
+            assert len(sent) - answered <= 2
+        results = await asyncio.wait_for(call, 1)
+        assert list(results.items()) == [(r.uuid, r.uuid) for r in remotes]
+        assert not any(r.requests for r in remotes)
+
+    @pytest.mark.asyncio
+    async def test_later_windows_keep_the_call_options(self):
+        sent = []
+        remotes = make_remotes(5, sent)
+        for remote in remotes:
+            remote.peer_capabilities = {'meta': True}
+        with with_options(timeout=30, idempotency_key='job-1', priority='high'):
+            call = asyncio.create_task(FanOut('Worker.run', shared_params([]), remotes, 2).run())
+        await asyncio.sleep(0.01)
+
+        answered = 0
+        while answered < len(sent):
+            answer(*sent[answered], result=None)
+            answered += 1
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(call, 1)
+        assert len(sent) == 5
+        for _, request in sent:
+            meta = request['meta']
+            assert meta['idem'] == 'job-1' and meta['prio'] == 'high' and 0 < meta['budget'] <= 30
+
+    @pytest.mark.asyncio
+    async def test_errors_and_open_breakers(self):
+        sent = []
+        remotes = make_remotes(3, sent)
+        remotes[2].breaker = CircuitBreaker(failures=1)
+        remotes[2].breaker.failure()
+        call = asyncio.create_task(FanOut('Worker.run', {'args': []}, remotes).run())
+        await asyncio.sleep(0.01)
+        # The open breaker answers without sending
+        assert [remote for remote, _ in sent] == remotes[:2]
+
+        answer(*sent[0], error={'code': -32000, 'message': 'bad input'})
+        answer(*sent[1], result=1)
+        results = await asyncio.wait_for(call, 1)
+        assert isinstance(results[remotes[0].uuid], RemoteError)
+        assert results[remotes[0].uuid].code == -32000 and str(results[remotes[0].uuid]) == 'bad input'
+        assert results[remotes[1].uuid] == 1
+        assert 'Circuit open' in str(results[remotes[2].uuid])
+
+    @pytest.mark.asyncio
+    async def test_response_caches_are_used(self):
+        sent = []
+        remotes = make_remotes(2, sent)
+        remotes[0].response_cache = ResponseCache({'Worker.run': {}})
+        for expected in (2, 1):
+            call = asyncio.create_task(FanOut('Worker.run', shared_params(['x']), remotes).run())
+            await asyncio.sleep(0.01)
+            assert len(sent) == expected
+            for remote, request in sent:
+                answer(remote, request, result=request['params']['args'])
+            sent.clear()
+            assert list((await asyncio.wait_for(call, 1)).values()) == [['x'], ['x']]
+        assert remotes[0].response_cache.stats()['Worker.run']['hits'] == 1
+
+    @pytest.mark.asyncio
+    async def test_no_remotes(self):
+        assert await FanOut('Worker.run', {'args': []}, []).run() == {}
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
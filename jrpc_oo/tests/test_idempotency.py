@@ -0,0 +1,168 @@
+"""
+Tests for answering retried requests from their first result.
+"""
+import pytest
+import asyncio
+
+from jrpc_oo import with_options
+from jrpc_oo.IdempotencyStore import KEY_REUSED, IdempotencyStore
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+class Orders:
+    def __init__(self):
+        self.placed = []
+
+    async def place(self, item, fail=False):
+        await asyncio.sleep(0.02)
+        if fail:
+            raise ValueError("out of stock")
+        self.placed.append(item)
+        return len(self.placed)
+
+    def rows(self):
+        yield 1
+
+
+class TestIdempotency:
+    """Tests for requests sent with an idempotency key."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('caps', [{'meta': True}, {'meta': True, 'compact': True, 'attachments': ['bytes']}])
+    async def test_retries_run_once(self, caps, make_pair, call):
+        orders = Orders()
+        a, b = make_pair(caps, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+
+        with with_options(idempotency_key='order-1'):
+            first = await call(a, 'Orders.place', b'book')
+            # Retries get the first result without running it again
+            results = await asyncio.gather(*[call(a, 'Orders.place', b'book') for _ in range(10)])
+        assert first == (None, 1) and all(r == first for r in results)
+        assert len(orders.placed) == 1
+        if 'attachments' in caps:
+            assert bytes(orders.placed[0]) == b'book', "meta and attachments travel together"
+
+        assert await call(a, 'Orders.place', b'pen') == (None, 2)
+        assert await call(a, 'Orders.place', b'pen') == (None, 3)
+        assert b.idempotency.stats() == {'hits': 10, 'joined': 0, 'misses': 1, 'evictions': 0,
+                                         'reused': 0, 'expired': 0, 'size': 1, 'running': 0}
+
+    @pytest.mark.asyncio
+    async def test_concurrent_duplicates_join(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            results = await asyncio.gather(*[call(a, 'Orders.place', 'x') for _ in range(20)])
+        assert results == [(None, 1)] * 20
+        assert b.idempotency.joined == 19
+
+    @pytest.mark.asyncio
+    async def test_errors_are_not_kept(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            err, _ = await call(a, 'Orders.place', 'x', True)
+            assert 'out of stock' in err['message']
+            assert await call(a, 'Orders.place', 'x') == (None, 1)
+
+    @pytest.mark.asyncio
+    async def test_keys_are_per_method_and_bounded(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True, 'streams': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            await call(a, 'Orders.place', 'x')
+            err, stream = await call(a, 'Orders.rows')
+            assert [i async for i in stream] == [1]
+        for key in ('k2', 'k3'):
+            with with_options(idempotency_key=key):
+                await call(a, 'Orders.place', key)
+        assert b.idempotency.evictions == 1 and len(b.idempotency.entries) == 2
+
+    @pytest.mark.asyncio
+    async def test_key_reused_with_other_params(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            first = asyncio.ensure_future(call(a, 'Orders.place', 'x'))
+            await asyncio.sleep(0)
+            # Refused while the first attempt runs and once its result is kept
+            while_running = await call(a, 'Orders.place', 'y')
+            assert await first == (None, 1)
+            once_kept = await call(a, 'Orders.place', 'z')
+        assert while_running[0]['code'] == KEY_REUSED and once_kept[0]['code'] == KEY_REUSED
+        assert orders.placed == ['x']
+
+    @pytest.mark.asyncio
+    async def test_keys_are_per_caller(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            for caller in ('alice', 'bob', 'alice'):
+                b.peer_capabilities['caller'] = caller
+                await call(a, 'Orders.place', 'x')
+        assert orders.placed == ['x', 'x']
+
+    @pytest.mark.asyncio
+    async def test_running_attempts_expire(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({'meta': True}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        b.idempotency.running_ttl = 0.001
+        with with_options(idempotency_key='k'):
+            first = asyncio.ensure_future(call(a, 'Orders.place', 'x'))
+            await asyncio.sleep(0.01)
+            results = [await call(a, 'Orders.place', 'x'), await first]
+        assert sorted(results) == [(None, 1), (None, 2)]
+        assert b.idempotency.expired == 2 and not b.idempotency.inflight
+
+    @pytest.mark.asyncio
+    async def test_peer_without_meta(self, make_pair, call):
+        orders = Orders()
+        a, b = make_pair({}, expose=orders)
+        b.idempotency = IdempotencyStore(maxsize=2)
+        with with_options(idempotency_key='k'):
+            await call(a, 'Orders.place', 'x')
+            await call(a, 'Orders.place', 'x')
+        assert len(orders.placed) == 2
+
+
+class TestRetryOverNewConnection:
+    """The store is shared by all the connections to a server."""
+
+    @pytest.mark.asyncio
+    async def test_retry_from_another_connection(self):
+        orders = Orders()
+        server = JRPCServer(port=19160)
+        server.idempotency = IdempotencyStore()
+        server.add_class(orders)
+        await server.start()
+        clients = [JRPCClient("ws://127.0.0.1:19160") for _ in range(3)]
+        # The second connects as the first again, the third is another caller
+        clients[1].caller_id = clients[0].caller_id
+        results = []
+        try:
+            for caller in clients:
+                task = asyncio.create_task(caller.connect())
+                for _ in range(50):
+                    await asyncio.sleep(0.1)
+                    if 'Orders.place' in caller.server:
+                        break
+                with with_options(idempotency_key='blip'):
+                    results.append(await caller.server['Orders.place']('lamp'))
+                await caller.disconnect()
+                await task
+            # The retry over a new connection finds its result, another caller's key is its own
+            assert results == [1, 1, 2] and orders.placed == ['lamp', 'lamp']
+        finally:
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
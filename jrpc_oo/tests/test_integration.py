@@ -331,6 +331,27 @@ class TestMultipleClients:
                 pass
 
 
+class TestBinaryAttachments:
+    """Tests for ndarrays negotiated between Python peers."""
+    
+    @pytest.mark.asyncio
+    async def test_ndarray_roundtrip(self, server, client):
+        """ndarray args and results should survive the trip as ndarrays."""
+        np = pytest.importorskip("numpy")
+        
+        # Wait for both sides to negotiate capabilities
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if all(r.peer_capabilities for r in client.remotes.values()):
+                break
+        
+        arr = np.arange(1000, dtype=np.float64).reshape(10, 100)
+        result = await client.server['TestClass.add'](arr, arr)
+        
+        assert isinstance(result, np.ndarray), "Result should arrive as an ndarray"
+        assert np.array_equal(result, arr * 2), "Array contents should be preserved"
+
+
 class TestConcurrentCalls:
     """Tests for concurrent RPC calls."""
     
@@ -142,6 +142,37 @@ async def run_interop_test():
         print(f"  ✗ FAILED: {e}")
         all_passed = False
     print()
+
+    # Test 4: numpy arrays travel to JS as typed arrays in binary frames and back
+    print("Test 4: Calling TestClass.scale(numpy.arange(4.0), 2)...")
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is None:
+        print("  - SKIPPED: numpy is not installed")
+    else:
+        try:
+            remote = next(iter(client.remotes.values()))
+            scale_method = next((m for m in client.server.keys() if m.endswith('.scale')), None)
+            if 'ndarray' not in (remote.peer_capabilities.get('attachments') or ()):
+                print(f"  ✗ FAILED: JS server didn't negotiate ndarray attachments: {remote.peer_capabilities}")
+                all_passed = False
+            elif scale_method:
+                result = await client.server[scale_method](np.arange(4.0), 2)
+                print(f"  Result: {result!r}")
+                if isinstance(result, np.ndarray) and result.tolist() == [0.0, 2.0, 4.0, 6.0]:
+                    print("  ✓ PASSED")
+                else:
+                    print("  ✗ FAILED: Expected a float64 ndarray back")
+                    all_passed = False
+            else:
+                print("  ✗ FAILED: scale method not found")
+                all_passed = False
+        except Exception as e:
+            print(f"  ✗ FAILED: {e}")
+            all_passed = False
+    print()
     
     # Summary
     print("=" * 60)
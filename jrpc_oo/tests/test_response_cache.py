@@ -0,0 +1,144 @@
+"""
+Tests for caching results on the calling side.
+"""
+import pytest
+import asyncio
+
+from jrpc_oo import cacheable, cached
+from jrpc_oo.ResponseCache import ResponseCache
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+
+
+class Lookup:
+    def __init__(self):
+        self.runs = 0
+        self.names = {1: 'one'}
+
+    @cacheable(ttl=None)
+    def name(self, n):
+        self.runs += 1
+        return self.names.get(n)
+
+    @cacheable
+    @cached
+    def names_list(self):
+        self.runs += 1
+        return sorted(self.names.values())
+
+    @cacheable(ttl=0.05)
+    async def slow(self):
+        self.runs += 1
+        return self.runs
+
+    def now(self):
+        self.runs += 1
+        return self.runs
+
+
+class TestResponseCache:
+    """Tests for the ResponseCache bounds."""
+
+    def test_lru_and_ttl(self):
+        cache = ResponseCache({'A.get': {'ttl': None, 'maxsize': 2}, 'A.tmp': {'ttl': -1}})
+        results = []
+        for n in (1, 2, 3):
+            cache.filler('A.get', cache.key({'args': [n]}), lambda err, res: results.append(res))(None, n)
+        assert cache.get('A.get', cache.key({'args': [1]})) == (False, None)
+        assert cache.get('A.get', cache.key({'args': [3]})) == (True, 3)
+
+        cache.filler('A.tmp', 'k', lambda err, res: None)(None, 'x')
+        assert cache.get('A.tmp', 'k') == (False, None)
+        assert cache.stats()['A.get'] == {'hits': 1, 'misses': 1, 'evictions': 1, 'size': 2}
+        assert results == [1, 2, 3]
+
+    def test_invalidated_in_flight_result_is_not_kept(self):
+        cache = ResponseCache({'A.get': {}})
+        key = cache.key({'args': [1]})
+        fill = cache.filler('A.get', key, lambda err, res: None)
+        cache.invalidate('A.get', [1])
+        fill(None, 'stale')
+        assert cache.get('A.get', key) == (False, None)
+
+    def test_binary_params_are_not_cached(self):
+        cache = ResponseCache({'A.get': {}})
+        assert cache.key({'args': [b'\x00']}) is None
+
+
+async def connect(port, lookup, cache_responses=True):
+    server = JRPCServer(port=port)
+    server.add_class(lookup)
+    await server.start()
+    client = JRPCClient(f"ws://127.0.0.1:{port}")
+    client.cache_responses = cache_responses
+    task = asyncio.create_task(client.connect())
+    for _ in range(50):
+        await asyncio.sleep(0.1)
+        if 'Lookup.name' in client.server:
+            break
+
+    async def close():
+        await client.disconnect()
+        task.cancel()
+        await server.stop()
+    return server, client, close
+
+
+class TestCachedCalls:
+    """The cache between a server and a client."""
+
+    @pytest.mark.asyncio
+    async def test_hot_reads_are_local(self):
+        lookup = Lookup()
+        server, client, close = await connect(19150, lookup)
+        try:
+            remote = next(iter(client.remotes.values()))
+            assert set(remote.response_cache.methods) == {'Lookup.name', 'Lookup.names_list', 'Lookup.slow'}
+
+            for _ in range(3):
+                assert await client.server['Lookup.name'](1) == 'one'
+                await client.server['Lookup.now']()
+            assert lookup.runs == 4
+
+            # The server pushes the invalidation
+            lookup.names[1] = 'uno'
+            server.invalidate('Lookup.name', [1])
+            await asyncio.sleep(0.1)
+            assert await client.server['Lookup.name'](1) == 'uno'
+
+            assert await client.server['Lookup.slow']() == await client.server['Lookup.slow']()
+            await asyncio.sleep(0.06)
+            assert await client.server['Lookup.slow']() == 7
+        finally:
+            await close()
+
+    @pytest.mark.asyncio
+    async def test_cached_methods_push_invalidation(self):
+        lookup = Lookup()
+        server, client, close = await connect(19151, lookup)
+        try:
+            assert await client.server['Lookup.names_list']() == ['one']
+            lookup.names[2] = 'two'
+            lookup.names_list.clear()
+            await asyncio.sleep(0.1)
+            assert await client.server['Lookup.names_list']() == ['one', 'two']
+            assert await client.server['Lookup.names_list']() == ['one', 'two']
+            assert lookup.runs == 2
+        finally:
+            await close()
+
+    @pytest.mark.asyncio
+    async def test_caching_off(self):
+        lookup = Lookup()
+        server, client, close = await connect(19152, lookup, cache_responses=False)
+        try:
+            await client.server['Lookup.name'](1)
+            await client.server['Lookup.name'](1)
+            assert lookup.runs == 2
+            assert next(iter(client.remotes.values())).response_cache is None
+        finally:
+            await close()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,148 @@
+"""
+Tests for encoding and decoding large messages without blocking the event loop.
+"""
+import pytest
+import asyncio
+import json
+
+from jrpc_oo import SlicedJSON
+from jrpc_oo.Attachments import RawJSON
+from jrpc_oo.ExposeClass import ExposeClass
+
+
+DOCS = [
+    {'jsonrpc': '2.0', 'id': '1', 'result': [{'name': f'n{i}', 'value': i / 3, 'tags': [1, 'ü']} for i in range(500)]},
+    [list(range(50)), {'a': {'b': [None, True, False, 'x"y']}}, (1, 2), []],
+    {'nested': {'deep': [[[i] for i in range(100)]]}, 'empty': {}, 'n': 1e300},
+    {1: 'int key', 'two': [1, 2]},
+    'plain', 42, None,
+]
+
+
+@pytest.fixture
+def small_members(monkeypatch):
+    """Make every member count as large so all the walking paths are taken."""
+    monkeypatch.setattr(SlicedJSON, '_SMALL', 64)
+
+
+@pytest.fixture
+def pair(make_pair):
+    """Two JRPC2 instances wired back to back, slicing messages over 10 kB."""
+    a, b = make_pair({'streams': True})
+    for side in (a, b):
+        side.slice_threshold = 10000
+    return a, b
+
+
+class TestSlicedJSON:
+    """Tests that sliced encoding and decoding match the json module."""
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('doc', DOCS)
+    async def test_dumps_matches_json(self, small_members, doc):
+        assert await SlicedJSON.dumps(doc) == json.dumps(doc)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('doc', DOCS)
+    async def test_loads_matches_json(self, small_members, doc):
+        for text in (json.dumps(doc), json.dumps(doc, indent=2), json.dumps(doc, separators=(',', ':'))):
+            assert await SlicedJSON.loads(text) == json.loads(text)
+        assert await SlicedJSON.loads(json.dumps(doc).encode('utf-8')) == json.loads(json.dumps(doc))
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize('text', ['[1,', '{"a" 1}', '[1 2]', '{"a": 1,}', '[1] x', '', '{1: 2}'])
+    async def test_invalid_json_raises(self, small_members, text):
+        with pytest.raises(json.JSONDecodeError):
+            await SlicedJSON.loads(text)
+
+    @pytest.mark.asyncio
+    async def test_default_hook_is_used(self):
+        class Point:
+            pass
+        assert await SlicedJSON.dumps([Point()] * 3, default=lambda p: 'pt') == '["pt", "pt", "pt"]'
+
+    @pytest.mark.asyncio
+    async def test_event_loop_keeps_running(self):
+        doc = {'result': [{'row': i, 'values': list(range(20))} for i in range(50000)]}
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await asyncio.sleep(0)
+        text = await SlicedJSON.dumps(doc, slice_time=0.001)
+        encoded = ticks
+        assert await SlicedJSON.loads(text, slice_time=0.001) == doc
+        task.cancel()
+
+        assert encoded > 5, "Encoding should have yielded to the loop"
+        assert ticks - encoded > 5, "Decoding should have yielded to the loop"
+
+    def test_estimate_size(self):
+        doc = [{'name': 'x' * 10, 'value': 1}] * 10000
+        estimate = SlicedJSON.estimate_size(doc, 2**30)
+        assert len(json.dumps(doc)) / 2 < estimate < len(json.dumps(doc)) * 2
+        assert SlicedJSON.estimate_size(doc, 1000) <= 1002
+
+    def test_estimate_size_of_raw_json(self):
+        raw = RawJSON(json.dumps(list(range(100000))))
+        assert SlicedJSON.estimate_size({'args': [raw]}, 2**30) > len(raw.text)
+
+
+class TestLargeMessages:
+    """Tests for large messages between JRPC2 peers."""
+
+    @pytest.mark.asyncio
+    async def test_large_request_and_response(self, pair, call):
+        a, b = pair
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+        rows = [{'row': i, 'name': f'row {i}'} for i in range(5000)]
+
+        assert await call(a, 'Echo.echo', rows) == (None, rows)
+
+    @pytest.mark.asyncio
+    async def test_notifications_are_handled_in_order(self, pair):
+        a, b = pair
+        handled = []
+        b.methods['Log.add'] = lambda params, next_cb: handled.append(len(params['args'][0]))
+
+        for text in ('x' * 50000, 'y', 'z' * 20000, 'w'):
+            b.receive(json.dumps({'jsonrpc': '2.0', 'method': 'Log.add', 'params': {'args': [text]}}))
+        assert handled == [], "Notifications should wait for the large one"
+
+        # A request has an id and does not need to wait
+        b.receive(json.dumps({'jsonrpc': '2.0', 'method': 'Log.add', 'params': {'args': ['id']}, 'id': '1'}))
+        assert handled == [2]
+        await asyncio.sleep(0.1)
+
+        assert handled == [2, 50000, 1, 20000, 1]
+        assert b._decoding is None
+
+    @pytest.mark.asyncio
+    async def test_large_stream_chunks_stay_in_order(self, pair, call):
+        a, b = pair
+
+        class Big:
+            async def rows(self, n):
+                for i in range(n):
+                    yield 'r' * (i % 7) * 1000
+
+        b.expose(ExposeClass().expose_all_fns(Big()))
+        err, stream = await call(a, 'Big.rows', 300)
+        assert [len(r) async for r in stream] == [(i % 7) * 1000 for i in range(300)]
+
+    @pytest.mark.asyncio
+    async def test_unencodable_large_result(self, pair, call):
+        a, b = pair
+        b.methods['Bad.get'] = lambda params, next_cb: next_cb(None, ['x' * 20000, object()])
+
+        err, res = await call(a, 'Bad.get')
+        assert 'not serializable' in err['message']
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,211 @@
+"""
+Tests for streaming generator results with credit-based flow control.
+"""
+import pytest
+import asyncio
+import gc
+
+from jrpc_oo.Streams import RemoteStream
+
+
+STREAMS = {'streams': True}
+
+
+class Rows:
+    """Exposed class with generator methods."""
+
+    def __init__(self):
+        self.produced = 0
+
+    async def arows(self, n):
+        for i in range(n):
+            self.produced += 1
+            yield {'row': i}
+
+    def rows(self, n):
+        for i in range(n):
+            self.produced += 1
+            yield i
+
+    async def failing(self):
+        yield 1
+        raise ValueError("broken source")
+
+    async def total(self, label, values):
+        count = 0
+        async for value in values:
+            count += value
+        return f"{label}={count}"
+
+    def size(self, values):
+        return len(values)
+
+    async def first(self, values):
+        async for value in values:
+            return value
+
+    async def doubled(self, values):
+        async for value in values:
+            yield value * 2
+
+
+class TestStreamResults:
+    """Tests for generator results arriving as async iterators."""
+
+    @pytest.mark.asyncio
+    async def test_async_generator_streams(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+
+        stream = await result(a, 'Rows.arows', 1000)
+        assert isinstance(stream, RemoteStream)
+        rows = [row async for row in stream]
+
+        assert rows == [{'row': i} for i in range(1000)]
+        assert not b.streams_out, "Producer should be released at the end"
+
+    @pytest.mark.asyncio
+    async def test_sync_generator_streams(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+
+        stream = await result(a, 'Rows.rows', 10)
+        assert [i async for i in stream] == list(range(10))
+
+    @pytest.mark.asyncio
+    async def test_slow_consumer_bounds_producer(self, make_pair, result):
+        rows = Rows()
+        a, b = make_pair(STREAMS, expose=rows)
+        a.stream_window = 16
+
+        stream = await result(a, 'Rows.arows', 100000)
+        await stream.__anext__()
+        await asyncio.sleep(0.05)
+
+        # window in flight plus one chunk read ahead, not the whole result
+        assert rows.produced <= a.stream_window + b.stream_chunk + 1
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+        assert not b.streams_out, "Cancel should stop the producer"
+
+    @pytest.mark.asyncio
+    async def test_dropped_stream_releases_producer(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+        a.stream_window = 16
+
+        stream = await result(a, 'Rows.arows', 100000)
+        await stream.__anext__()
+        assert b.streams_out
+        del stream
+        gc.collect()
+        await asyncio.sleep(0.01)
+
+        assert not a.streams_in and not b.streams_out, "The producer should be cancelled"
+
+    @pytest.mark.asyncio
+    async def test_source_error_reaches_consumer(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+
+        stream = await result(a, 'Rows.failing')
+        assert await stream.__anext__() == 1
+        with pytest.raises(Exception, match="broken source"):
+            await stream.__anext__()
+
+    @pytest.mark.asyncio
+    async def test_plain_peer_gets_list(self, make_pair, result):
+        a, b = make_pair(expose=Rows())
+
+        assert await result(a, 'Rows.arows', 3) == [{'row': 0}, {'row': 1}, {'row': 2}]
+
+    @pytest.mark.asyncio
+    async def test_close_ends_streams(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+        a.stream_window = 2
+
+        stream = await result(a, 'Rows.arows', 100)
+        a.close()
+        with pytest.raises(Exception, match="disconnected"):
+            async for _ in stream:
+                pass
+
+
+async def numbers(n, progress):
+    for i in range(n):
+        progress['sent'] = i + 1
+        yield 1
+
+
+class TestStreamArguments:
+    """Tests for async iterators passed as arguments."""
+
+    @pytest.mark.asyncio
+    async def test_async_iterator_argument_streams(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+        progress = {}
+
+        assert await result(a, 'Rows.total', 'n', numbers(5000, progress)) == "n=5000"
+        assert not a.streams_out and not b.streams_in
+
+    @pytest.mark.asyncio
+    async def test_upload_is_flow_controlled(self, make_pair, result):
+        progress = {}
+        gate = asyncio.Event()
+
+        class Slow:
+            async def consume(self, values):
+                await gate.wait()
+                return [v async for v in values]
+
+        a, b = make_pair(STREAMS, expose=Slow())
+        b.stream_window = 8
+        task = asyncio.create_task(result(a, 'Slow.consume', numbers(100000, progress)))
+        await asyncio.sleep(0.05)
+
+        assert progress['sent'] <= b.stream_window + a.stream_chunk + 1
+        for stream in b.streams_in.values():
+            assert len(stream._items) <= b.stream_window
+        task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_plain_peer_gets_list_argument(self, make_pair, result):
+        a, b = make_pair(expose=Rows())
+
+        assert await result(a, 'Rows.size', numbers(10, {})) == 10
+
+    @pytest.mark.asyncio
+    async def test_unread_argument_is_released(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+
+        assert await result(a, 'Rows.first', numbers(100000, {})) == 1
+        await asyncio.sleep(0.01)
+        assert not a.streams_out and not b.streams_in
+
+    @pytest.mark.asyncio
+    async def test_streamed_result_reads_argument(self, make_pair, result):
+        a, b = make_pair(STREAMS, expose=Rows())
+
+        stream = await result(a, 'Rows.doubled', numbers(1000, {}))
+        assert [v async for v in stream] == [2] * 1000
+        await asyncio.sleep(0.01)
+        assert not a.streams_out and not b.streams_in and not b.streams_out
+
+    @pytest.mark.asyncio
+    async def test_stream_marker_from_plain_peer(self, make_pair, result):
+        a, b = make_pair()
+        b.methods['Data.get'] = lambda params, next_cb: next_cb(None, {'$stream': 1})
+
+        assert await result(a, 'Data.get') == {'$stream': 1}
+        assert not a.streams_in
+
+    @pytest.mark.asyncio
+    async def test_failed_call_stops_producer(self, make_pair):
+        a, b = make_pair(STREAMS)
+        future = asyncio.get_running_loop().create_future()
+        a.call('Missing.method', {'args': [numbers(100, {})]}, lambda err, res: future.set_result(err))
+
+        assert await asyncio.wait_for(future, 1) is not None
+        await asyncio.sleep(0.01)
+        assert not a.streams_out and not b.streams_in
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
+
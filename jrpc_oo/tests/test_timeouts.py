@@ -0,0 +1,102 @@
+"""
+Tests for per method and adaptive call timeouts.
+"""
+import pytest
+import asyncio
+import time
+
+from jrpc_oo import AdaptiveTimeouts, timeout
+from jrpc_oo.JRPC2 import JRPC2
+from jrpc_oo.JRPCServer import JRPCServer
+
+
+class Service:
+    def __init__(self):
+        self.gate = asyncio.Event()
+
+    @timeout(0.05)
+    async def quick(self):
+        await self.gate.wait()
+        return 'quick'
+
+    async def hang(self):
+        await self.gate.wait()
+        return 'hang'
+
+    def echo(self, n):
+        return n
+
+
+@pytest.fixture
+def timed_call(call):
+    """Return a coroutine function like call, also giving the seconds it took."""
+    async def timed_call(remote, method, *args):
+        started = time.monotonic()
+        err, res = await call(remote, method, *args)
+        return err, res, time.monotonic() - started
+    return timed_call
+
+
+class TestAdaptiveTimeouts:
+    """Tests for learning timeouts from latencies."""
+
+    def test_multiple_of_percentile(self):
+        timeouts = AdaptiveTimeouts(multiple=3, samples=10, min_timeout=0.05)
+        for _ in range(9):
+            timeouts.record('A.get', 0.001)
+        assert timeouts.timeout('A.get') is None
+
+        timeouts.record('A.get', 0.001)
+        assert timeouts.timeout('A.get') == 0.05
+
+        for n in range(100):
+            timeouts.record('A.get', 0.1 if n == 0 else 0.02)
+        assert timeouts.timeout('A.get') == pytest.approx(0.06)
+        assert timeouts.stats()['A.get']['samples'] == 110
+
+
+class TestMethodTimeouts:
+    """Tests for the timeouts used by JRPC2.call."""
+
+    def test_decorated_timeouts_are_offered(self):
+        server = JRPCServer(port=19170)
+        server.add_class(Service())
+        assert server.capabilities()['timeouts'] == {'Service.quick': 0.05}
+
+    @pytest.mark.asyncio
+    async def test_offered_and_configured_timeouts(self, make_pair, timed_call):
+        service = Service()
+        a, b = make_pair(a=JRPC2(remote_timeout=5), expose=service)
+        a.peer_capabilities = {'timeouts': {'Service.quick': 0.05}}
+        err, res, took = await timed_call(a, 'Service.quick')
+        assert 'timeout' in str(err) and took < 0.5
+
+        # The caller's own map wins over what the remote offered
+        a.method_timeouts = {'Service.quick': 0.5, 'Service.hang': 0.02}
+        err, res, took = await timed_call(a, 'Service.hang')
+        assert 'timeout' in str(err) and took < 0.4
+        assert a.method_timeout('Service.quick') == 0.5
+        assert a.method_timeout('Service.echo') == 5
+
+    @pytest.mark.asyncio
+    async def test_adaptive_timeout(self, make_pair, timed_call):
+        service = Service()
+        a, b = make_pair(a=JRPC2(remote_timeout=5), expose=service)
+        a.adaptive_timeouts = AdaptiveTimeouts(samples=20, min_timeout=0.03)
+        for n in range(20):
+            assert (await timed_call(a, 'Service.echo', n))[:2] == (None, n)
+        assert a.method_timeout('Service.echo') == 0.03
+
+        # A lost reply is noticed in milliseconds instead of remote_timeout
+        b.methods['Service.echo'] = lambda params, next_cb: None
+        err, res, took = await timed_call(a, 'Service.echo', 0)
+        assert 'timeout' in str(err) and took < 0.5
+
+        # Timeouts count as slow calls, so the timeout grows past them
+        for _ in range(2):
+            await timed_call(a, 'Service.echo', 0)
+        assert a.method_timeout('Service.echo') == pytest.approx(0.81)
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
@@ -0,0 +1,171 @@
+"""
+Tests for zstd compression of small messages with a trained dictionary.
+"""
+import pytest
+import asyncio
+import json
+import random
+import os
+
+pytest.importorskip('zstandard')
+
+from jrpc_oo import Zstd, ZstdTrain
+from jrpc_oo.JRPCServer import JRPCServer
+from jrpc_oo.JRPCClient import JRPCClient
+from jrpc_oo.Zstd import TrafficCapture, ZstdCodec, read_capture, train_dictionary
+
+METHODS = ['Calc.add', 'Store.get', 'Store.put', 'Users.lookup', 'Feed.poll']
+
+
+def envelope(rng):
+    """A typical small request or response."""
+    if rng.random() < 0.5:
+        return json.dumps({'jsonrpc': '2.0', 'method': rng.choice(METHODS),
+                           'params': {'args': [rng.randint(0, 1000), f"user{rng.randint(0, 99)}"]},
+                           'id': str(rng.randint(0, 10**6))})
+    return json.dumps({'jsonrpc': '2.0', 'id': str(rng.randint(0, 10**6)),
+                       'result': {'ok': True, 'count': rng.randint(0, 50), 'name': f"item{rng.randint(0, 999)}"}})
+
+
+@pytest.fixture(scope='module')
+def dictionary():
+    rng = random.Random(1)
+    return train_dictionary([envelope(rng).encode() for _ in range(5000)], 8192)
+
+
+def offer(codec):
+    """The capabilities of a side with codec, see JRPCCommon.capabilities."""
+    return {'zstd': {'dict': codec.dict_id}} if codec else {}
+
+
+class TestCodec:
+    """Tests for compressing single messages."""
+
+    def test_dictionary_shrinks_small_messages(self, dictionary):
+        codec = ZstdCodec(dictionary)
+        rng = random.Random(2)
+        messages = [envelope(rng).encode() for _ in range(500)]
+        compressed = [codec.compress(m) for m in messages]
+
+        assert all(c[0] == Zstd.WITH_DICT for c in compressed)
+        assert [codec.decompress(c, 2**20) for c in compressed] == messages
+        ratio = sum(map(len, messages)) / sum(map(len, compressed))
+        assert ratio > 3, f"Expected a 3x reduction, got {ratio:.2f}x"
+
+    def test_incompressible_message_is_left_alone(self, dictionary):
+        codec = ZstdCodec(dictionary)
+        assert codec.compress(os.urandom(100), with_dict=False) is None
+        assert codec.compress(b'{}') is None, "Below min_size"
+
+    def test_decompressed_size_is_limited(self):
+        codec = ZstdCodec()
+        data = codec.compress(b'[' + b'0, ' * 10000 + b'0]')
+        with pytest.raises(ValueError, match="exceeds"):
+            codec.decompress(data, 1000)
+
+    def test_unknown_dictionary_is_refused(self, dictionary):
+        data = ZstdCodec(dictionary).compress(b'{"jsonrpc": "2.0", "id": "1", "result": 1}' * 2)
+        with pytest.raises(ValueError, match="dictionary"):
+            ZstdCodec().decompress(data, 2**20)
+
+
+class TestNegotiation:
+    """Tests for zstd between two JRPC2 peers."""
+
+    @pytest.mark.asyncio
+    async def test_shared_dictionary(self, make_pair, dictionary, call, wire):
+        a_codec, b_codec = ZstdCodec(dictionary), ZstdCodec(dictionary)
+        a, b = make_pair(offer(a_codec), offer(b_codec))
+        a.zstd, b.zstd = a_codec, b_codec
+        b.methods['Store.get'] = lambda params, next_cb: next_cb(None, {'ok': True, 'name': params['args'][0]})
+
+        assert await call(a, 'Store.get', 'user7') == (None, {'ok': True, 'name': 'user7'})
+        assert len(wire.messages) == 2
+        assert all(isinstance(m, bytes) and m[0] == Zstd.WITH_DICT for m in wire.messages)
+
+    @pytest.mark.asyncio
+    async def test_different_dictionaries_fall_back(self, make_pair, dictionary, call, wire):
+        a_codec, b_codec = ZstdCodec(dictionary), ZstdCodec()
+        a, b = make_pair(offer(a_codec), offer(b_codec))
+        a.zstd, b.zstd = a_codec, b_codec
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+
+        value = 'repeat ' * 20
+        assert await call(a, 'Echo.echo', value) == (None, value)
+        assert all(m[0] == Zstd.PLAIN for m in wire.messages)
+
+    @pytest.mark.asyncio
+    async def test_plain_peer_gets_text(self, make_pair, dictionary, call, wire):
+        a_codec, b_codec = ZstdCodec(dictionary), None
+        a, b = make_pair(offer(a_codec), offer(b_codec))
+        a.zstd, b.zstd = a_codec, b_codec
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+
+        assert await call(a, 'Echo.echo', 'x' * 100) == (None, 'x' * 100)
+        assert all(isinstance(m, str) for m in wire.messages)
+
+    @pytest.mark.asyncio
+    async def test_large_messages_are_sent_as_text(self, make_pair, call, wire):
+        a_codec, b_codec = ZstdCodec(max_size=256), ZstdCodec(max_size=256)
+        a, b = make_pair(offer(a_codec), offer(b_codec))
+        a.zstd, b.zstd = a_codec, b_codec
+        b.methods['Echo.echo'] = lambda params, next_cb: next_cb(None, params['args'][0])
+
+        assert await call(a, 'Echo.echo', 'x' * 1000) == (None, 'x' * 1000)
+        assert all(isinstance(m, str) for m in wire.messages)
+
+
+class TestTraining:
+    """Tests for capturing traffic and training a dictionary from it."""
+
+    @pytest.mark.asyncio
+    async def test_capture_and_train(self, make_pair, tmp_path, capsys, call):
+        capture = TrafficCapture(tmp_path / 'capture.jsonl', max_messages=3000)
+        a, b = make_pair()
+        a.capture = capture
+        b.methods['Users.lookup'] = lambda params, next_cb: next_cb(None, {'user': params['args'][0], 'ok': True})
+
+        for i in range(1500):
+            await call(a, 'Users.lookup', f"user{i % 97}")
+        assert capture.count == 3000 and capture._file is None, "Capture should stop at max_messages"
+        assert json.loads(read_capture([tmp_path / 'capture.jsonl'])[0])['method'] == 'Users.lookup'
+
+        output = tmp_path / 'jrpc.dict'
+        assert ZstdTrain.main([str(tmp_path / 'capture.jsonl'), '-o', str(output), '--size', '4096']) == 0
+        assert ZstdCodec(str(output)).dict_id != 0
+        assert 'with the dictionary' in capsys.readouterr().out
+
+
+class TestZstdWebSocket:
+    """zstd negotiated during the handshake of a real connection."""
+
+    @pytest.mark.asyncio
+    async def test_negotiated_over_websocket(self, dictionary):
+        class Store:
+            def get(self, name):
+                return {'ok': True, 'name': name}
+
+        server = JRPCServer(port=19130)
+        server.zstd = ZstdCodec(dictionary)
+        server.add_class(Store())
+        await server.start()
+        client = JRPCClient("ws://127.0.0.1:19130")
+        client.zstd = ZstdCodec(dictionary)
+        task = asyncio.create_task(client.connect())
+        try:
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if 'Store.get' in client.server and all(r.peer_capabilities for r in client.remotes.values()):
+                    break
+            remote = next(iter(client.remotes.values()))
+            assert remote.peer_capabilities['zstd'] == {'dict': remote.zstd.dict_id}
+            assert remote._compress(envelope(random.Random(3)))[0] == Zstd.WITH_DICT
+            assert await client.server['Store.get']('user1') == {'ok': True, 'name': 'user1'}
+        finally:
+            await client.disconnect()
+            task.cancel()
+            await server.stop()
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])